@@ -0,0 +1,873 @@
+#!/usr/bin/env python3
+"""Benchmarks which run against synthetic data (no network required).
+
+`python bench.py suite --baseline bench_baseline.json` times the main
+operations and exits with 1 when one of them got slower than the stored
+baseline. Baselines only compare on the machine (and scale) they were
+recorded on, refresh it with `--update-baseline`.
+"""
+import argparse
+import gzip
+import http.server
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import county_tensor
+import data
+import download
+import plot_data
+import profiling
+import report
+import server
+import synthetic
+from synthetic import write_census_csv, write_nytimes_csv
+
+
+def _peak_rss_mb():
+    # VmHWM (unlike ru_maxrss) is reset by exec so a fresh interpreter
+    # doesn't inherit the peak of the process which spawned it
+    with open('/proc/self/status') as ifp:
+        for line in ifp:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure_in_subprocess(*args):
+    """Run one measurement in a fresh interpreter so peak RSS is its own"""
+    out = subprocess.run([sys.executable, __file__, '_measure'] + list(args),
+                         check=True, stdout=subprocess.PIPE)
+    return json.loads(out.stdout)
+
+
+def _measure(kind, csv_path, states=None):
+    states = set(states.split(',')) if states else None
+    base = _peak_rss_mb()
+    start = time.perf_counter()
+    if kind == 'read_csv':
+        # what NyTimesData did before the columnar cache
+        df = pd.read_csv(csv_path, parse_dates=['date'],
+                         usecols=data.NYTIMES_COLUMNS,
+                         encoding='raw_unicode_escape')
+        df.sort_values('date', inplace=True)
+    elif kind == 'columnar':
+        df = data._load_nytimes_df(csv_path, states=states)
+    elif kind == 'streaming':
+        df, _ = data._stream_nytimes_csv(csv_path, states or set(),
+                                         64 * 2 ** 20)
+    else:
+        raise ValueError("Unknown measurement {}".format(kind))
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'rows': len(df),
+            'peak_rss_mb': _peak_rss_mb(), 'base_rss_mb': base}
+
+
+def bench_nytimes_load(n_counties, n_days):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = write_nytimes_csv(os.path.join(tmp_dir, 'daily.csv'),
+                                     n_counties, n_days)
+        results['read_csv'] = _measure_in_subprocess('read_csv', csv_path)
+        # first columnar load has to build the cache
+        results['columnar_cold'] = _measure_in_subprocess('columnar', csv_path)
+        results['columnar_warm'] = _measure_in_subprocess('columnar', csv_path)
+        results['columnar_warm_3_states'] = _measure_in_subprocess(
+            'columnar', csv_path, 'Ohio,Pennsylvania,California')
+        # national deltas included
+        results['streaming_64mb_3_states'] = _measure_in_subprocess(
+            'streaming', csv_path, 'Ohio,Pennsylvania,California')
+    return results
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+class _BodyHandler(http.server.BaseHTTPRequestHandler):
+    """Serves `server.body`, or `server.gzipped` gzip encoded when set"""
+
+    def do_GET(self):
+        body = self.server.gzipped or self.server.body
+        self.send_response(200)
+        if self.server.gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_download_ingest(n_counties, n_days):
+    """Download the nytimes csv from a local server and load it, stored
+    as is vs gzip compressed while downloading vs kept as the server
+    gzipped it"""
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _BodyHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}/us-counties.csv'.format(httpd.server_port)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = write_nytimes_csv(os.path.join(tmp_dir, 'body.csv'),
+                                         n_counties, n_days)
+            with open(csv_path, 'rb') as ifp:
+                httpd.body = ifp.read()
+            gzipped = gzip.compress(httpd.body, download.GZIP_LEVEL)
+            for name, suffix, encoded in (
+                    ('plain', '', None),
+                    ('gzip', download.GZIP_SUFFIX, None),
+                    ('gzip_encoded', download.GZIP_SUFFIX, gzipped)):
+                httpd.gzipped = encoded
+                path = os.path.join(tmp_dir, name, 'daily.csv' + suffix)
+                fetch_seconds = _timed(download.fetch, url, path, 0)
+                load_seconds = _timed(data.NyTimesData, csv_path=path)
+                results[name] = {
+                    'mb': os.path.getsize(path) / 2 ** 20,
+                    'fetch_seconds': fetch_seconds,
+                    'load_seconds': load_seconds,
+                    'seconds': fetch_seconds + load_seconds,
+                }
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return results
+
+
+def bench_nytimes_ingest(n_counties, n_days):
+    """Refresh after one more day was appended to the csv"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        full_path = write_nytimes_csv(os.path.join(tmp_dir, 'full.csv'),
+                                      n_counties, n_days)
+        with open(full_path, 'rb') as ifp:
+            full = ifp.read()
+        last_date = full[full.rindex(b'\n', 0, len(full) - 1) + 1:][:10]
+        yesterday = full[:full.index(b'\n' + last_date) + 1]
+
+        csv_path = os.path.join(tmp_dir, 'daily.csv')
+        with open(csv_path, 'wb') as ofp:
+            ofp.write(yesterday)
+        data._load_nytimes_df(csv_path)
+        with open(csv_path, 'wb') as ofp:
+            ofp.write(full)
+
+        cache_dir = data._columnar_cache_dir(csv_path)
+        return {
+            'incremental_seconds': _timed(data._update_columnar_cache,
+                                          csv_path, cache_dir),
+            'rebuild_seconds': _timed(data._rebuild_columnar_cache,
+                                      csv_path, cache_dir),
+        }
+
+
+def bench_county_lookup(n_counties, n_days, n_lookups=500):
+    """Resolve `n_lookups` counties, with the index and with masks"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = write_nytimes_csv(os.path.join(tmp_dir, 'daily.csv'),
+                                     n_counties, n_days)
+        nytimes = data.NyTimesData(csv_path=csv_path)
+
+    pairs = (nytimes.df[['state', 'county']].drop_duplicates()
+             .head(n_lookups).itertuples(index=False))
+    pairs = list(pairs)
+
+    def indexed():
+        for state, county in pairs:
+            nytimes.get_state_data(state).get_county_data(county)
+
+    def masked():
+        # what the lookups did before the index
+        df = nytimes.df
+        for state, county in pairs:
+            state_df = df[df.state == state]
+            data.CountyData(state_df[state_df.county == county])
+
+    return {'lookups': len(pairs),
+            'indexed_seconds': _timed(indexed),
+            'masked_seconds': _timed(masked)}
+
+
+def bench_build_df_many(n_counties, n_days, n_locations=200):
+    """Build `n_locations` counties one by one and with build_df_many"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = write_nytimes_csv(os.path.join(tmp_dir, 'daily.csv'),
+                                     n_counties, n_days)
+        census_path = write_census_csv(os.path.join(tmp_dir, 'census.csv'),
+                                       n_counties)
+        nytimes = data.NyTimesData(csv_path=csv_path)
+        census = data.CensusData(csv_path=census_path)
+
+    pairs = (nytimes.df[['state', 'county']].drop_duplicates()
+             .head(n_locations).itertuples(index=False))
+    locations = [data.Location('USA', state, county) for state, county in pairs]
+    windows = [7, 14]
+
+    def per_location():
+        # what plot_data.load_df did before build_df_many
+        normalized = data.PopulationNormalizedData(nytimes, census)
+        pd.concat([normalized.build_df(loc, windows) for loc in locations])
+
+    def many():
+        normalized = data.PopulationNormalizedData(nytimes, census)
+        normalized.build_df_many(locations, windows, columns=['cases100k'])
+
+    return {'locations': len(locations),
+            'per_location_seconds': _timed(per_location),
+            'many_seconds': _timed(many)}
+
+
+def _legacy_add_avg_columns(df, window):
+    """add_avg_columns before it took several windows"""
+    numeric = df.drop(data.NON_NUMERIC_COLUMNS, axis=1, errors='ignore')
+    roller = numeric.rolling(window)
+    df = df.join(roller.mean(), rsuffix='_{}day-avg'.format(window))
+    if data.TEST_TOTAL_COL in df.columns:
+        totals = roller.sum()
+        df['positive-test-rate_{}day-avg'.format(window)] = (
+            totals[data.POSITIVE_CASE_COL] / totals[data.TEST_TOTAL_COL])
+    return df
+
+
+def bench_avg_columns(n_counties, n_days, n_locations=200):
+    """Averages for `n_locations` daily frames, 1 and 5 windows"""
+    rng = np.random.default_rng(0)
+    frames = [pd.DataFrame({
+        'date': pd.date_range('2020-01-21', periods=n_days),
+        'location': 'location {}'.format(i),
+        'cases': rng.poisson(50, n_days).astype(float),
+        'tests': rng.poisson(500, n_days).astype(float),
+        'cases100k': rng.random(n_days),
+    }) for i in range(min(n_locations, n_counties))]
+
+    results = {}
+    for windows in ([7], [3, 7, 14, 21, 28]):
+        def per_window():
+            for df in frames:
+                for window in windows:
+                    _legacy_add_avg_columns(df, window)
+
+        def one_pass():
+            for df in frames:
+                data.add_avg_columns(df, windows)
+
+        results['{}_windows'.format(len(windows))] = {
+            'per_window_seconds': _timed(per_window),
+            'one_pass_seconds': _timed(one_pass),
+        }
+    return results
+
+
+def bench_top_counties(n_counties, n_days, n=25):
+    """The `n` counties with the highest 7 day cases100k, by building every
+    county's frame vs ranking the county tensor"""
+    prev_dirs = data.DATA_DIR, data.CENSUS_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            tmp_dir, n_counties, n_days)
+        try:
+            nytimes = data.NyTimesData()
+            census = data.CensusData()
+            normalized = data.PopulationNormalizedData(nytimes, census,
+                                                       cache_bytes=0)
+            tensor = county_tensor.CountyTensor(nytimes, census)
+            locations = [tensor.location(_) for _ in range(len(tensor))]
+
+            def by_build_df():
+                last = {}
+                for loc in locations:
+                    df = normalized.build_df(loc, 7)
+                    last[str(loc)] = df['cases100k_7day-avg'].iloc[-1]
+                return sorted(last, key=last.get, reverse=True)[:n]
+
+            results = {
+                'counties': len(locations),
+                'build_df_seconds': _timed(by_build_df),
+                'build_df_many_seconds': _timed(
+                    normalized.build_df_many, locations, 7,
+                    columns=['cases100k']),
+                'tensor_build_seconds': _timed(county_tensor.CountyTensor,
+                                               nytimes, census),
+                'tensor_top_seconds': _timed(tensor.top, n, 'cases100k', 7),
+                'tensor_mb': tensor.values.nbytes / 2 ** 20,
+            }
+        finally:
+            data.DATA_DIR, data.CENSUS_DIR = prev_dirs
+    return results
+
+
+def bench_resolve_locations(n_counties, n_days, repeat=10):
+    """Every county as one `STATE:*` selector per state vs a 'County,ST'
+    string each, and deduplicating the resolved locations"""
+    prev_dirs = data.DATA_DIR, data.CENSUS_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            tmp_dir, n_counties, n_days)
+        try:
+            counties = data.nytimes_counties()
+            census = data.CensusData()
+            index = data.LocationIndex.from_sources(counties, census)
+            strings = ['{},{}'.format(county, data.STATE_ABV_MAP[state])
+                       for state, county in counties]
+            selectors = ['{}:*'.format(_) for _ in sorted(data.ABV_STATE_MAP)]
+            locations = [data.parse_location(_) for _ in strings]
+            results = {
+                'counties': len(index),
+                'nytimes_counties_seconds': _timed(data.nytimes_counties),
+                'index_seconds': _timed(data.LocationIndex.from_sources,
+                                        counties, census),
+                'parse_seconds': _timed(
+                    data.resolve_locations, strings),
+                'selectors_seconds': _timed(
+                    data.resolve_locations, selectors, index),
+                'dedupe_seconds': _timed(
+                    lambda: [set(locations) for _ in range(repeat)]) / repeat,
+            }
+        finally:
+            data.DATA_DIR, data.CENSUS_DIR = prev_dirs
+    return results
+
+
+def bench_compact_memory(n_counties, n_days):
+    """Memory held by NyTimesData with and without compact frames"""
+    def frame_mb(nytimes):
+        frames = (nytimes.df, nytimes.state_df, nytimes.national_df)
+        return sum(_.memory_usage(deep=True).sum() for _ in frames) / 2 ** 20
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = write_nytimes_csv(os.path.join(tmp_dir, 'daily.csv'),
+                                     n_counties, n_days)
+        # build the columnar cache up front so both loads are warm
+        data._load_nytimes_df(csv_path)
+        results = {}
+        for compact in (False, True):
+            start = time.perf_counter()
+            nytimes = data.NyTimesData(csv_path=csv_path, compact=compact)
+            elapsed = time.perf_counter() - start
+            state = nytimes.get_state_data('Ohio')
+            results['compact' if compact else 'wide'] = {
+                'frames_mb': frame_mb(nytimes),
+                'load_seconds': elapsed,
+                'county_seconds': _timed(lambda: [
+                    state.get_county_data(county).get_df()
+                    for county in state.county_index]),
+            }
+    return results
+
+
+def _report_figures(n_counties, n_days, n_locations=10):
+    """4 metrics x 3 windows, the shape of the daily report"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'date': np.tile(pd.date_range('2020-01-21', periods=n_days),
+                        n_locations),
+        'location': np.repeat(['location {}'.format(i)
+                               for i in range(min(n_locations, n_counties))],
+                              n_days),
+        'value': rng.random(n_days * n_locations) * 100,
+    })
+    return [px.line(df, x='date', y='value', color='location',
+                    hover_name='location', title='{} {}'.format(metric, window))
+            for metric in range(4) for window in range(3)]
+
+
+def bench_report_size(n_counties, n_days):
+    """Bytes and seconds to write the report, to_html per figure vs ReportWriter"""
+    figures = _report_figures(n_counties, n_days)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def to_html():
+            # what plot_data.main did before the report writer
+            html = ''
+            for fig in figures:
+                html += fig.to_html(full_html=False)
+            with open(os.path.join(tmp_dir, 'to_html.html'), 'w') as ofp:
+                ofp.write("<html>{}</html>".format(html))
+
+        results['to_html'] = {'seconds': _timed(to_html)}
+        for plotlyjs in report.PLOTLYJS_MODES:
+            def write():
+                path = os.path.join(tmp_dir, '{}.html'.format(plotlyjs))
+                with report.ReportWriter(path, plotlyjs=plotlyjs) as out:
+                    for fig in figures:
+                        out.add_figure(fig)
+            results[plotlyjs] = {'seconds': _timed(write)}
+        for name in results:
+            results[name]['mb'] = os.path.getsize(
+                os.path.join(tmp_dir, '{}.html'.format(name))) / 2 ** 20
+    return results
+
+
+def bench_report_regenerate(n_counties, n_days, n_locations=40):
+    """plot_data.main writing a report from scratch, then again after one
+    county outside the report and then one of its states changed"""
+    counties = ['County {},{}'.format(i, state) for i, state in
+                enumerate(synthetic._states(n_counties))][:n_locations]
+    prev = (data.DATA_DIR, data.CENSUS_DIR, plot_data.CHECK_SUM_FILE,
+            plot_data.FRAGMENT_DIR)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            tmp_dir, n_counties, n_days)
+        plot_data.CHECK_SUM_FILE = os.path.join(tmp_dir, 'checksums')
+        plot_data.FRAGMENT_DIR = os.path.join(tmp_dir, 'fragments')
+        argv = ['plot_data.py'] + counties + [
+            '--windows=1,7,14', '--plotlyjs=directory',
+            '--metrics=cases100k,deaths100k,positive-test-rate,tests100k',
+            '-o', os.path.join(tmp_dir, 'report.html')]
+
+        def regenerate():
+            plot_data.load_pn_data.cache_clear()
+            plot_data.load_census_data.cache_clear()
+            return _timed(plot_data.main, argv)
+
+        try:
+            results['first_seconds'] = regenerate()
+
+            # the last county isn't in the report
+            csv_path = data._csv_path('nytimes', 'us-counties')
+            with download.open_file(csv_path, 'at') as ofp:
+                ofp.write('{},County {},{},0,1000000,0\n'.format(
+                    (pd.Timestamp(synthetic.FIRST_DATE)
+                     + pd.Timedelta(days=n_days - 1)).strftime('%Y-%m-%d'),
+                    n_counties - 1, synthetic._states(n_counties)[-1]))
+            download.mark_downloaded(data.NYTIMES_URL, csv_path)
+            results['other_county_seconds'] = regenerate()
+
+            state = data.STATE_ABV_MAP[synthetic._states(n_counties)[0]]
+            csv_path = data._csv_path('covidtracking', state)
+            synthetic.covidtracking_df(n_days, state, seed=99).to_csv(
+                csv_path, index=False)
+            download.mark_downloaded(data._covidtracking_url(state.lower()),
+                                     csv_path)
+            results['one_state_seconds'] = regenerate()
+
+            os.unlink(plot_data.CHECK_SUM_FILE)
+            shutil.rmtree(plot_data.FRAGMENT_DIR)
+            results['everything_seconds'] = regenerate()
+        finally:
+            (data.DATA_DIR, data.CENSUS_DIR, plot_data.CHECK_SUM_FILE,
+             plot_data.FRAGMENT_DIR) = prev
+    return results
+
+
+def bench_downsample(n_counties, n_days, n_locations=300, max_points=200):
+    """Figure build time and report size for `n_locations` long series"""
+    rng = np.random.default_rng(0)
+    n_locations = min(n_locations, n_counties)
+    df = pd.DataFrame({
+        'date': np.tile(pd.date_range('2020-01-21', periods=n_days),
+                        n_locations),
+        'location': np.repeat(['location {}'.format(i)
+                               for i in range(n_locations)], n_days),
+        'cases100k_7day-avg': rng.random(n_days * n_locations).cumsum(),
+    })
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for points in (None, max_points):
+            start = time.perf_counter()
+            fig = plot_data.make_figure(None, None, 'cases100k', 7, df=df,
+                                        max_points=points)
+            elapsed = time.perf_counter() - start
+            path = os.path.join(tmp_dir, 'report.html')
+            with report.ReportWriter(path, plotlyjs='directory') as out:
+                out.add_figure(fig)
+            results['max_points_{}'.format(points)] = {
+                'points': sum(len(trace.y) for trace in fig.data),
+                'build_seconds': elapsed,
+                'html_mb': os.path.getsize(path) / 2 ** 20,
+            }
+    return results
+
+
+def bench_render_jobs(n_counties, n_days, n_locations=50):
+    """Render 4 metrics x 3 windows serially and with a process per cpu"""
+    rng = np.random.default_rng(0)
+    n_locations = min(n_locations, n_counties)
+    metrics = ['cases', 'deaths', 'cases100k', 'deaths100k']
+    windows = [1, 7, 14]
+    df = pd.DataFrame({
+        'date': np.tile(pd.date_range('2020-01-21', periods=n_days),
+                        n_locations),
+        'location': np.repeat(['location {}'.format(i)
+                               for i in range(n_locations)], n_days),
+    })
+    for metric in metrics:
+        df[metric] = rng.random(len(df))
+        for window in windows[1:]:
+            df['{}_{}day-avg'.format(metric, window)] = rng.random(len(df))
+    frames = {metric: (None, df) for metric in metrics}
+    tasks = [(metric, window, None) for metric in metrics for window in windows]
+
+    results = {'cpus': os.cpu_count()}
+    for jobs in sorted({1, os.cpu_count() or 1}):
+        results['jobs_{}_seconds'.format(jobs)] = _timed(
+            lambda: list(plot_data.render_figures(frames, tasks, jobs)))
+    return results
+
+
+def bench_profiling_overhead(n_counties, n_days, n_calls=2000):
+    """Cost of the instrumentation on a small, often called stage"""
+    df = pd.DataFrame({
+        'date': pd.date_range('2020-01-21', periods=n_days),
+        'cases': np.arange(n_days, dtype=float),
+    })
+    raw = data.add_avg_columns.__wrapped__
+
+    def calls(func):
+        return _timed(lambda: [func(df, 7) for _ in range(n_calls)]) / n_calls
+
+    results = {'uninstrumented_us': calls(raw) * 1e6,
+               'disabled_us': calls(data.add_avg_columns) * 1e6}
+    profiling.enable()
+    try:
+        results['enabled_us'] = calls(data.add_avg_columns) * 1e6
+    finally:
+        profiling.disable()
+
+    def spans():
+        for _ in range(n_calls * 10):
+            with profiling.span('bench'):
+                pass
+    results['disabled_span_ns'] = _timed(spans) / (n_calls * 10) * 1e9
+    return results
+
+
+def _import_times(code):
+    """Cumulative microseconds of every import `code` made, from -X importtime"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         check=True, stderr=subprocess.PIPE,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    times = {}
+    for line in out.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def bench_startup(n_counties, n_days, repeat=5):
+    """Import time of the CLI, and what importing its dependencies costs"""
+    heavy = ['numpy', 'pandas', 'plotly.express', 'requests']
+    plot_data_times = min((_import_times('import plot_data')
+                           for _ in range(repeat)),
+                          key=lambda _: _['plot_data'])
+    heavy_times = min((_import_times('import ' + ', '.join(heavy))
+                       for _ in range(repeat)),
+                      key=lambda _: sum(_[name] for name in heavy))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'plot_data.py', '--help'], check=True,
+                   stdout=subprocess.DEVNULL,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    return {
+        'import_plot_data_ms': plot_data_times['plot_data'] / 1000,
+        'import_heavy_ms': sum(heavy_times[name] for name in heavy) / 1000,
+        'heavy_imported_by_plot_data': sorted(set(plot_data_times) & set(heavy)),
+        'help_seconds': time.perf_counter() - start,
+    }
+
+
+def _percentiles_ms(seconds):
+    seconds = np.asarray(seconds) * 1000
+    if not len(seconds):
+        return {}
+    return {'count': len(seconds),
+            'p50_ms': float(np.percentile(seconds, 50)),
+            'p99_ms': float(np.percentile(seconds, 99))}
+
+
+def _server_plan(n_counties, n_requests, n_queries):
+    """(path, params) of each request, alternating /figure and /data over
+    `n_queries` random queries"""
+    rng = np.random.default_rng(0)
+    counties = ['County {},{}'.format(i, state) for i, state in
+                enumerate(synthetic._states(n_counties))]
+    metrics = ['cases100k', 'deaths100k', 'positive-test-rate']
+    queries = []
+    for _ in range(n_queries):
+        picked = rng.choice(len(counties), 3, replace=False)
+        queries.append({
+            'locations': ';'.join([counties[i] for i in picked] + ['PA']),
+            'metric': metrics[rng.integers(len(metrics))],
+            'window': str(rng.choice([1, 7, 14])),
+        })
+    return [('/data' if i % 2 else '/figure', queries[i % n_queries])
+            for i in range(n_requests)]
+
+
+def _server_results(timings, reload_window, seconds):
+    """Percentiles of (path, start, end) `timings`, overall, per path and
+    while the reload ran"""
+    reload_start, reload_end = reload_window
+    results = {
+        'reload_seconds': reload_end - reload_start,
+        'requests_per_second': len(timings) / seconds,
+        'all': _percentiles_ms([end - start for _, start, end in timings]),
+        'during_reload': _percentiles_ms([
+            end - start for _, start, end in timings
+            if start < reload_end and end > reload_start]),
+    }
+    for path in ('/data', '/figure'):
+        results[path] = _percentiles_ms([end - start for p, start, end
+                                         in timings if p == path])
+    return results
+
+
+def bench_server_latency(n_counties, n_days, n_requests=400, clients=4,
+                         n_queries=40):
+    """p50/p99 of /data and /figure from `clients` threads, with a reload of
+    every dataset in the middle of the run"""
+    import requests
+
+    plan = _server_plan(n_counties, n_requests, n_queries)
+
+    prev_dirs = data.DATA_DIR, data.CENSUS_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            tmp_dir, n_counties, n_days)
+        try:
+            load_seconds = _timed(server.DatasetStore)
+            store = server.DatasetStore()
+            httpd = server.make_server(store, port=0)
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            base = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+
+            timings = []
+            next_request = iter(range(n_requests))
+            lock = threading.Lock()
+
+            def client():
+                session = requests.Session()
+                while True:
+                    with lock:
+                        i = next(next_request, None)
+                    if i is None:
+                        return
+                    path, params = plan[i]
+                    start = time.perf_counter()
+                    response = session.get(base + path, params=params)
+                    response.raise_for_status()
+                    # list.append is atomic
+                    timings.append((path, start, time.perf_counter()))
+
+            def reload():
+                # wait for the first half, then reload while serving
+                while len(timings) < n_requests // 2:
+                    time.sleep(0.001)
+                reload_window[0] = time.perf_counter()
+                store.refresh(force=True)
+                reload_window[1] = time.perf_counter()
+
+            reload_window = [None, None]
+            threads = [threading.Thread(target=client) for _ in range(clients)]
+            threads.append(threading.Thread(target=reload))
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+            httpd.shutdown()
+            httpd.server_close()
+        finally:
+            data.DATA_DIR, data.CENSUS_DIR = prev_dirs
+
+    return dict(load_seconds=load_seconds,
+                **_server_results(timings, reload_window, seconds))
+
+
+def _suite_cases(n_counties, n_days, n_locations=100):
+    """name -> function the suite times, over a synthetic dataset
+
+    Expects `data.DATA_DIR` and `data.CENSUS_DIR` to hold the dataset.
+    """
+    csv_path = data._dl_nytimes_csv()
+    raw_df = data._load_nytimes_df(csv_path)
+    nytimes = data.NyTimesData()
+    census = data.CensusData()
+    national_df = nytimes.get_df()
+
+    pairs = (raw_df[['state', 'county']].drop_duplicates()
+             .head(n_locations).itertuples(index=False))
+    locations = [data.Location('USA', state, county) for state, county in pairs]
+    states = sorted(data.STATE_ABV_MAP)
+    # no caching, every build is timed
+    normalized = data.PopulationNormalizedData(nytimes, census, cache_bytes=0)
+    many_df = normalized.build_df_many(locations, [7], columns=['cases100k'])
+
+    def slice_counties():
+        for loc in locations:
+            nytimes.get_state_data(loc.state).get_county_data(loc.county).get_df()
+
+    def check_sum():
+        data.NyTimesData.source_check_sum(locations)
+        data.CovidTrackingData.source_check_sum(locations)
+        data.CensusData.source_check_sum()
+
+    return {
+        'load_nytimes': data.NyTimesData,
+        'load_covidtracking': lambda: data.CovidTrackingData().prefetch(
+            states + ['USA']),
+        'load_census': data.CensusData,
+        'slice_states': lambda: [nytimes.get_state_data(state).get_df()
+                                 for state in states],
+        'slice_counties': slice_counties,
+        'convert_to_deltas': lambda: data.convert_to_deltas(raw_df),
+        'add_avg_columns': lambda: data.add_avg_columns(national_df,
+                                                        [7, 14, 28]),
+        'check_sum': check_sum,
+        'build_df': lambda: [normalized.build_df(loc, [7])
+                             for loc in locations],
+        'build_df_many': lambda: normalized.build_df_many(
+            locations, [7], columns=['cases100k']),
+        'make_figure': lambda: plot_data.make_figure(
+            None, locations, 'cases100k', 7, df=many_df),
+    }
+
+
+def bench_suite(n_counties, n_days, repeat=3):
+    """Best of `repeat` seconds of each of the main operations"""
+    prev_dirs = data.DATA_DIR, data.CENSUS_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            tmp_dir, n_counties, n_days)
+        try:
+            cases = _suite_cases(n_counties, n_days)
+            seconds = {name: min(_timed(func) for _ in range(repeat))
+                       for name, func in cases.items()}
+        finally:
+            data.DATA_DIR, data.CENSUS_DIR = prev_dirs
+    return {'counties': n_counties, 'days': n_days, 'seconds': seconds}
+
+
+def find_regressions(result, baseline, tolerance=0.25, min_seconds=0.01):
+    """Suite cases more than `tolerance` (and `min_seconds`) slower than
+    `baseline`"""
+    if ((result['counties'], result['days'])
+            != (baseline['counties'], baseline['days'])):
+        raise ValueError("Baseline is for {} counties x {} days".format(
+            baseline['counties'], baseline['days']))
+    regressions = {}
+    for name, seconds in sorted(result['seconds'].items()):
+        expected = baseline['seconds'].get(name)
+        if expected is None:
+            continue
+        if seconds > expected * (1 + tolerance) and seconds - expected > min_seconds:
+            regressions[name] = {'seconds': seconds,
+                                 'baseline_seconds': expected,
+                                 'ratio': seconds / expected}
+    return regressions
+
+
+BENCHMARKS = {
+    'compact_memory': bench_compact_memory,
+    'avg_columns': bench_avg_columns,
+    'build_df_many': bench_build_df_many,
+    'county_lookup': bench_county_lookup,
+    'download_ingest': bench_download_ingest,
+    'downsample': bench_downsample,
+    'nytimes_load': bench_nytimes_load,
+    'nytimes_ingest': bench_nytimes_ingest,
+    'profiling_overhead': bench_profiling_overhead,
+    'render_jobs': bench_render_jobs,
+    'report_regenerate': bench_report_regenerate,
+    'report_size': bench_report_size,
+    'resolve_locations': bench_resolve_locations,
+    'server_latency': bench_server_latency,
+    'startup': bench_startup,
+    'suite': bench_suite,
+    'top_counties': bench_top_counties,
+}
+
+
+def main(argv):
+    if len(argv) > 1 and argv[1] == '_measure':
+        print(json.dumps(_measure(*argv[2:])))
+        return
+
+    parser = argparse.ArgumentParser(description=argv[0])
+    parser.add_argument('benchmarks',
+                        help='Benchmarks to run. Allowed: {}'.format(
+                            sorted(BENCHMARKS)),
+                        type=str,
+                        nargs='*'
+                        )
+    parser.add_argument('--counties',
+                        help='number of synthetic counties',
+                        type=int,
+                        default=3200
+                        )
+    parser.add_argument('--days',
+                        help='number of synthetic days',
+                        type=int,
+                        default=300
+                        )
+    parser.add_argument('-o', '--output',
+                        help='also write the results (json) to this file',
+                        type=str,
+                        default=None
+                        )
+    parser.add_argument('--baseline',
+                        help='compare the suite with this file, exit with 1 '
+                             'on regressions',
+                        type=str,
+                        default=None
+                        )
+    parser.add_argument('--update-baseline',
+                        help='write the suite results to --baseline',
+                        action='store_true'
+                        )
+    parser.add_argument('--tolerance',
+                        help='fraction slower than the baseline which is a '
+                             'regression',
+                        type=float,
+                        default=0.25
+                        )
+    args = parser.parse_args(argv[1:])
+
+    names = args.benchmarks or sorted(BENCHMARKS)
+    if args.baseline and 'suite' not in names:
+        names.append('suite')
+    results = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark {}\n"
+                             "Allowed: {}".format(name, sorted(BENCHMARKS)))
+        results[name] = BENCHMARKS[name](args.counties, args.days)
+        print(json.dumps({name: results[name]}, indent=2))
+
+    status = 0
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as ofp:
+            json.dump(results['suite'], ofp, indent=2, sort_keys=True)
+    elif args.baseline:
+        with open(args.baseline, 'r') as ifp:
+            baseline = json.load(ifp)
+        results['regressions'] = find_regressions(
+            results['suite'], baseline, args.tolerance)
+        print(json.dumps({'regressions': results['regressions']}, indent=2))
+        status = 1 if results['regressions'] else 0
+
+    if args.output:
+        with open(args.output, 'w') as ofp:
+            json.dump(results, ofp, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,189 @@
+"""Every county's daily numbers in one dense array.
+
+`CountyTensor` holds the NYTimes daily deltas of all of the counties as an
+array shaped [county, day, metric] next to a vector of their populations.
+Averages and per 100k numbers for every county are a few vectorized
+operations, so counties can be ranked without building a frame for each:
+
+    tensor = CountyTensor(data.NyTimesData(), data.CensusData())
+    tensor.top(25, 'cases100k', window=7)
+"""
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+import data
+import lazy
+import profiling
+
+np = lazy.LazyModule('numpy')
+pd = lazy.LazyModule('pandas')
+
+PER_100K = '100k'
+
+
+class CountyTensor(object):
+    """Dense [county, day, metric] array of daily numbers.
+
+    Days a county didn't report are NaN, like `add_avg_columns` an average
+    is NaN unless every day of its window was reported.
+    """
+
+    @profiling.profiled('tensor.build')
+    def __init__(self, nytimes: data.NyTimesData, census: data.CensusData):
+        """`nytimes` must hold every county, i.e. be loaded without
+        `locations`"""
+        if nytimes.states is not None:
+            raise data.DataUnavailableException(
+                "Needs every county, loaded {}".format(nytimes.states))
+        # daily deltas sorted by state, county and date
+        df = nytimes.df
+        ranges = data._group_ranges(df, ['state', 'county'])
+        keys = list(ranges)
+        starts, stops = np.array(list(ranges.values()), dtype=int).reshape(
+            -1, 2).T
+        county = np.repeat(np.arange(len(keys)), stops - starts)
+
+        days = df['date']
+        days = (days.to_numpy() if data._is_compact_date(days)
+                else data._to_day(days).to_numpy())
+        first_day = int(days.min()) if len(days) else 0
+        n_days = int(days.max()) - first_day + 1 if len(days) else 0
+        day = days - first_day
+
+        self.metrics = [_ for _ in ('cases', 'deaths') if _ in df.columns]
+        self.values = np.full((len(keys), n_days, len(self.metrics)), np.nan)
+        for i, metric in enumerate(self.metrics):
+            self.values[county, day, i] = df[metric].to_numpy(dtype=float)
+
+        self.dates = pd.DatetimeIndex(
+            data._from_day(np.arange(first_day, first_day + n_days)))
+        self.states = np.array([state for state, _ in keys], dtype=object)
+        self.counties = np.array([county for _, county in keys], dtype=object)
+        self.population = census.county_populations(keys)
+
+    def __len__(self):
+        return len(self.counties)
+
+    def location(self, i: int) -> data.Location:
+        return data.Location('USA', self.states[i], self.counties[i])
+
+    def _metric(self, metric: str, days: slice = slice(None),
+                counties=slice(None)) -> np.ndarray:
+        """[county, day] daily values of `metric` of `counties` on `days`"""
+        raw = metric[:-len(PER_100K)] if metric.endswith(PER_100K) else metric
+        if raw not in self.metrics:
+            raise ValueError("Unknown metric {}\nAllowed: {}".format(
+                metric, self.metrics + [_ + PER_100K for _ in self.metrics]))
+        values = self.values[counties, days, self.metrics.index(raw)]
+        if raw != metric:
+            # downward corrections count as 0, like build_df_many
+            values = (np.clip(values, 0, None)
+                      / self.population[counties, None] * 100000)
+        return values
+
+    def _day(self, date=None) -> int:
+        if date is None:
+            return len(self.dates) - 1
+        day = self.dates.get_indexer([pd.Timestamp(date)])[0]
+        if day < 0:
+            raise ValueError("No data for {}, have {} to {}".format(
+                date, self.dates[0].date(), self.dates[-1].date()))
+        return day
+
+    def series(self, metric: str, window: int = 1) -> np.ndarray:
+        """[county, day] `metric` averaged over trailing `window` days"""
+        values = self._metric(metric)
+        if window < 2:
+            return values
+        return data._rolling_sum(data._prefix_sums(values), window) / window
+
+    def values_on(self, metric: str, window: int = 1,
+                  date=None) -> np.ndarray:
+        """`metric` of every county averaged over the `window` days ending
+        on `date` (the last day by default)"""
+        day = self._day(date)
+        if day < window - 1:
+            return np.full(len(self), np.nan)
+        # NaN when any day is missing, like `series`
+        return self._metric(metric, slice(day - window + 1, day + 1)).mean(
+            axis=1)
+
+    def _ranking(self, index: np.ndarray, values: np.ndarray,
+                 column: str) -> pd.DataFrame:
+        states, counties = self.states[index], self.counties[index]
+        return pd.DataFrame({
+            'state': states,
+            'county': counties,
+            'location': [data.location_label('USA', state, county)
+                         for state, county in zip(states, counties)],
+            column: values[index],
+        }, index=pd.Index(index, name='county_index'))
+
+    def top(self, n: int, metric: str, window: int = 1,
+            date=None) -> pd.DataFrame:
+        """The `n` counties with the highest `metric`, highest first.
+
+        The index holds the position of each county in the tensor, e.g. for
+        `long_df`. Counties without a value are never ranked.
+        """
+        return self._ranked(n, metric, window, date, descending=True)
+
+    def bottom(self, n: int, metric: str, window: int = 1,
+               date=None) -> pd.DataFrame:
+        """The `n` counties with the lowest `metric`, lowest first"""
+        return self._ranked(n, metric, window, date, descending=False)
+
+    def _ranked(self, n, metric, window, date, descending):
+        values = self.values_on(metric, window, date)
+        valid = np.flatnonzero(~np.isnan(values))
+        keys = -values[valid] if descending else values[valid]
+        if n < len(valid):
+            keep = np.argpartition(keys, n)[:n]
+            valid, keys = valid[keep], keys[keep]
+        index = valid[np.argsort(keys, kind='stable')]
+        return self._ranking(index, values,
+                             data.window_column(metric, window))
+
+    def threshold(self, metric: str, window: int = 1, date=None,
+                  above: Optional[float] = None,
+                  below: Optional[float] = None) -> pd.DataFrame:
+        """Counties whose `metric` is at least `above` and at most `below`,
+        highest first"""
+        values = self.values_on(metric, window, date)
+        selected = ~np.isnan(values)
+        if above is not None:
+            selected &= values >= above
+        if below is not None:
+            selected &= values <= below
+        index = np.flatnonzero(selected)
+        index = index[np.argsort(-values[index], kind='stable')]
+        return self._ranking(index, values, data.window_column(metric, window))
+
+    def long_df(self, index: Iterable[int], metric: str,
+                windows: Iterable[int], start_date=None,
+                end_date=None) -> pd.DataFrame:
+        """Long format (date, location, metric, averages) frame of the
+        counties at `index`, like `PopulationNormalizedData.build_df_many`
+        with `columns=[metric]`"""
+        index = np.asarray(list(index), dtype=int)
+        daily = self._metric(metric, counties=index)
+        columns = {metric: daily}
+        prefix = data._prefix_sums(daily)
+        for window in windows:
+            # add_avg_columns averages over a single day too
+            columns[data.avg_column(metric, window)] = (
+                data._rolling_sum(prefix, window) / window)
+
+        # only the days a county reported, like its frame would have
+        reported = ~np.isnan(self.values[index]).all(axis=2)
+        county, day = np.nonzero(reported)
+        labels = np.array([data.location_label('USA', state, county)
+                           for state, county in zip(self.states[index],
+                                                    self.counties[index])],
+                          dtype=object)
+        df = pd.DataFrame({'date': self.dates[day], 'location': labels[county]})
+        for column, values in columns.items():
+            df[column] = values[county, day]
+        return data.date_filter(df, start_date, end_date).reset_index(
+            drop=True)
@@ -1,11 +1,23 @@
-import functools
+from __future__ import annotations
+
+import collections
+import concurrent.futures
 import hashlib
+import io
+import json
 import os
+import shutil
+import threading
+import weakref
 from abc import ABC
-from typing import Optional, Union
+from typing import Iterable, List, Optional, Tuple, Union
+
+import download
+import lazy
+import profiling
 
-import pandas as pd
-import requests
+np = lazy.LazyModule('numpy')
+pd = lazy.LazyModule('pandas')
 
 DATA_DIR = "/tmp/covid-testing"
 
@@ -33,6 +45,14 @@ ABV_STATE_MAP = {'AK': 'Alaska', 'AL': 'Alabama', 'AR': 'Arkansas',
 STATE_ABV_MAP = {v: k for k, v in ABV_STATE_MAP.items()}
 
 
+class UnknownStateError(KeyError):
+    """A state name or abbreviation which isn't a state"""
+
+    def __str__(self):
+        # not the repr of the key like KeyError
+        return str(self.args[0])
+
+
 def _lookup_name_abbrev(state_str):
     """Return state (name, abbreviation) tuple. Abbrev is UPPERCASE"""
     # Look up by abbreviation
@@ -43,14 +63,50 @@ def _lookup_name_abbrev(state_str):
     if state_str in STATE_ABV_MAP:
         return state_str, STATE_ABV_MAP[state_str]
 
-    raise KeyError("Failed to find state string {}".format(state_str))
+    raise UnknownStateError(
+        "Failed to find state string {}".format(state_str))
 
 
 class Location(object):
-    def __init__(self, nation: str, state: str, county: Union[str, None]):
-        self.nation = nation
-        self.state = state
-        self.county = county
+    """A nation, optionally one of its states and one of that state's
+    counties.
+
+    Immutable and interned, the same location is always the same object so
+    they are cheap to hash, compare and hold by the thousand. State
+    abbreviations are stored as the state's name.
+    """
+    __slots__ = ('nation', 'state', 'county', '_str', '_hash', '__weakref__')
+
+    # only the locations still referenced somewhere are kept
+    _interned = weakref.WeakValueDictionary()
+    _intern_lock = threading.Lock()
+
+    def __new__(cls, nation: str, state: Optional[str],
+                county: Optional[str] = None):
+        if state:
+            state = ABV_STATE_MAP.get(state.upper(), state)
+        key = (nation, state or None, county or None)
+        self = cls._interned.get(key)
+        if self is not None:
+            return self
+
+        with cls._intern_lock:
+            self = cls._interned.get(key)
+            if self is None:
+                self = super().__new__(cls)
+                for name, value in zip(('nation', 'state', 'county'), key):
+                    object.__setattr__(self, name, value)
+                object.__setattr__(self, '_str', ','.join(filter(None, key)))
+                object.__setattr__(self, '_hash', hash(key))
+                cls._interned[key] = self
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Location is immutable")
+
+    def __reduce__(self):
+        # unpickled locations are interned too
+        return Location, (self.nation, self.state, self.county)
 
     def drop_county(self):
         if not self.county:
@@ -59,15 +115,20 @@ class Location(object):
         return Location(self.nation, self.state, None)
 
     def __str__(self):
-        val = self.nation
-        if self.state:
-            val += "," + self.state
-        if self.county:
-            val += "," + self.county
-        return val
+        return self._str
+
+    def __repr__(self):
+        return 'Location({!r}, {!r}, {!r})'.format(
+            self.nation, self.state, self.county)
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, Location):
+            return NotImplemented
+        # interned, equal locations are the same object
+        return self is other
 
     def __lt__(self, other):
         return str(self) < str(other)
@@ -94,7 +155,8 @@ def parse_location(location_string: str) -> Location:
         raise ValueError("Could not parse '{}' un-parsed datum {}"
                          .format(location_string, unparsed))
     if len(unparsed) == len(data):
-        raise ValueError("Failed to parse location '{}' -- check casing? ")
+        raise ValueError("Failed to parse location '{}' -- check casing? "
+                         .format(location_string))
 
     if unparsed:
         county = unparsed[0]
@@ -102,41 +164,165 @@ def parse_location(location_string: str) -> Location:
     return Location(nation, state, county)
 
 
+# `STATE:COUNTY` selectors, either side may be WILDCARD
+SELECTOR_SEPARATOR = ':'
+WILDCARD = '*'
+# `@FILE` reads selectors from FILE, one per line
+SELECTOR_FILE_PREFIX = '@'
+
+
+def is_pattern(selector: str) -> bool:
+    """Whether `selector` has to be resolved against a `LocationIndex`"""
+    return SELECTOR_SEPARATOR in selector
+
+
+def read_selectors(selectors: Iterable[str]) -> List[str]:
+    """`selectors` with each `@FILE` replaced by the lines of FILE.
+
+    Blank lines and lines starting with '#' are skipped, files may name
+    other files.
+    """
+    result = []
+    seen = set()
+
+    def add(selectors):
+        for selector in selectors:
+            selector = selector.strip()
+            if not selector or selector.startswith('#'):
+                continue
+            if not selector.startswith(SELECTOR_FILE_PREFIX):
+                result.append(selector)
+                continue
+            path = os.path.abspath(selector[len(SELECTOR_FILE_PREFIX):])
+            if path in seen:
+                raise ValueError("{} is read more than once".format(path))
+            seen.add(path)
+            with open(path, 'r', encoding='utf8') as ifp:
+                add(ifp.read().splitlines())
+
+    add(selectors)
+    return result
+
+
+class LocationIndex(object):
+    """Known counties, to resolve `STATE:COUNTY` selectors against"""
+
+    def __init__(self, counties: Iterable[Tuple[str, str]]):
+        """`counties` are (state name, county) pairs"""
+        self.counties = sorted({Location('USA', state, county)
+                                for state, county in counties})
+        # every selector is a lookup, however many counties it matches
+        self._by_state = {}
+        self._by_county = {}
+        for loc in self.counties:
+            self._by_state.setdefault(loc.state, []).append(loc)
+            self._by_county.setdefault(loc.county.casefold(), []).append(loc)
+
+    @classmethod
+    def from_sources(cls, counties: Iterable[Tuple[str, str]],
+                     census: CensusData) -> LocationIndex:
+        """The `counties` with data that `census` has a population for"""
+        counties = list(counties)
+        populations = census.county_populations(counties)
+        return cls(key for key, population in zip(counties, populations)
+                   if not np.isnan(population))
+
+    def __len__(self):
+        return len(self.counties)
+
+    def match(self, state: str, county: str) -> List[Location]:
+        """Counties of `state` named `county`, sorted"""
+        if state == WILDCARD:
+            if county == WILDCARD:
+                return self.counties
+            return self._by_county.get(county.casefold(), [])
+        try:
+            name = _lookup_name_abbrev(state)[0]
+        except KeyError:
+            raise ValueError("Unknown state '{}'".format(state))
+        matches = self._by_state.get(name, [])
+        if county != WILDCARD:
+            matches = [loc for loc in matches
+                       if loc.county.casefold() == county.casefold()]
+        return matches
+
+
+def resolve_locations(selectors: Iterable[str],
+                      index: Optional[LocationIndex] = None
+                      ) -> List[Location]:
+    """Locations of `selectors`, in order and without duplicates.
+
+    A selector is a location (see `parse_location`) or `STATE:COUNTY`,
+    where `PA:*` is every county of Pennsylvania and `*:Orange` every
+    county named Orange. Those are resolved against `index`. Expand `@FILE`
+    selectors with `read_selectors` first.
+    """
+    resolved = []
+    for selector in selectors:
+        selector = selector.strip()
+        if selector.startswith(SELECTOR_FILE_PREFIX):
+            raise ValueError("Read selector files first, got '{}'"
+                             .format(selector))
+        if not is_pattern(selector):
+            resolved.append(parse_location(selector))
+            continue
+        if index is None:
+            raise ValueError("No counties to resolve '{}' against"
+                             .format(selector))
+        state, county = (_.strip() for _ in
+                         selector.split(SELECTOR_SEPARATOR, 1))
+        matches = index.match(state, county)
+        if not matches:
+            raise ValueError("'{}' matches no counties".format(selector))
+        resolved.extend(matches)
+    # interned, so duplicates are cheap to find
+    return list(dict.fromkeys(resolved))
+
+
 #
 #
 #
 
-def _dl_csv(url, data_source, target):
-    target = target.lower()
-    # this doesn't have county-level testing data
-    out_dir = os.path.join(DATA_DIR, data_source, target)
-    out_path = os.path.join(out_dir, f'daily.csv')
+def _csv_path(data_source, target):
+    # compressed, see download.open_file
+    return os.path.join(DATA_DIR, data_source, target.lower(),
+                        'daily.csv' + download.GZIP_SUFFIX)
 
-    r = requests.get(url)
-    r.raise_for_status()
 
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    with open(out_path, 'w') as ofp:
-        ofp.write(r.text)
-    return out_path
+def _dl_csv(url, data_source, target):
+    # this doesn't have county-level testing data
+    with profiling.span('download', source=data_source, target=target):
+        return download.fetch(url, _csv_path(data_source, target),
+                              download.source_ttl(data_source))
 
 
+@profiling.profiled('convert_to_deltas')
 def convert_to_deltas(df):
-    cumulative = df.groupby('date').sum()
-    # insert one at the top with zeros
-    # this is an awful lot of screwing around to assure that the
-    # delta @t0 is correct
-    before_time = pd.DataFrame(
-        data={
-            # 'date': [df['date'].iloc[0]],
-            'cases': [0],
-            'deaths': [0]
-        },
-    )
-    extended = before_time.append(cumulative)
-    deltas = extended.diff().dropna().reset_index(drop=False).rename(
-        columns={'index': 'date'})
+    cumulative = df.groupby('date').sum(numeric_only=True)
+    deltas = cumulative.diff()
+    # diff against zeros to assure that the delta @t0 is correct
+    if not deltas.empty:
+        deltas.iloc[0] = cumulative.iloc[0]
+    return deltas.reset_index()
+
+
+@profiling.profiled('nytimes.deltas')
+def _county_deltas(df: pd.DataFrame, county_starts) -> pd.DataFrame:
+    """Daily deltas for every county in one pass.
+
+    `df` holds cumulative counts sorted by state, county and date and
+    `county_starts` are the first row of every county. Like
+    `convert_to_deltas` each county's first day is diffed against zeros and
+    blank counts are zeros.
+    """
+    deltas = df.copy(deep=False)
+    for col in NUMERIC_COLUMNS & set(df.columns):
+        # a blank would otherwise void this and the next day's delta
+        values = np.nan_to_num(df[col].to_numpy(dtype=float))
+        delta = np.empty_like(values)
+        delta[1:] = values[1:] - values[:-1]
+        delta[county_starts] = values[county_starts]
+        deltas[col] = delta
     return deltas
 
 
@@ -158,10 +344,59 @@ NUMERIC_COLUMNS = {POSITIVE_CASE_COL, TEST_TOTAL_COL, DEATHS_COL,
                    HOSPITALIZATIONS_COL}
 
 
+EPOCH = '1970-01-01'
+
+
+def _to_day(dates) -> np.ndarray:
+    """Dates as days since the epoch"""
+    return ((pd.to_datetime(dates) - pd.Timestamp(EPOCH)) //
+            pd.Timedelta(1, unit='D'))
+
+
+def _from_day(days) -> pd.DatetimeIndex:
+    return pd.Timestamp(EPOCH) + pd.to_timedelta(days, unit='D')
+
+
+def compact_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Smaller representation of a daily data frame.
+
+    state and county become categoricals, counts int32 (float32 when there
+    are gaps) and the date a day number (see `expand_df`).
+    """
+    columns = {}
+    for col in ('state', 'county'):
+        if col in df.columns and not isinstance(df[col].dtype,
+                                                pd.CategoricalDtype):
+            columns[col] = df[col].astype('category')
+    for col in NUMERIC_COLUMNS & set(df.columns):
+        values = df[col]
+        if values.isna().any() or (values % 1 != 0).any():
+            columns[col] = values.astype('float32')
+        else:
+            columns[col] = values.astype('int32')
+    if 'date' in df.columns and not _is_compact_date(df['date']):
+        columns['date'] = _to_day(df['date']).astype('int32')
+    return df.assign(**columns)
+
+
+def expand_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Undo the date compaction of `compact_df`"""
+    if 'date' in df.columns and _is_compact_date(df['date']):
+        df = df.assign(date=_from_day(df['date'].to_numpy()))
+    return df
+
+
+def _is_compact_date(dates: pd.Series) -> bool:
+    return pd.api.types.is_integer_dtype(dates.dtype)
+
+
 def date_filter(df: pd.DataFrame,
                 start_date: Optional[pd.Timestamp] = None,
                 end_date: Optional[pd.Timestamp] = None):
     """Inclusive date filtering"""
+    if 'date' in df.columns and _is_compact_date(df['date']):
+        start_date = _to_day(start_date) if start_date else None
+        end_date = _to_day(end_date) if end_date else None
     if start_date:
         df = df[df.date >= start_date]
     if end_date:
@@ -169,26 +404,120 @@ def date_filter(df: pd.DataFrame,
     return df
 
 
-def add_avg_columns(df: pd.DataFrame, window: int):
-    if window < 2 and TEST_TOTAL_COL in df.columns:
-        # just need to add raw test rate
-        df['positive-test-rate'] = (df[POSITIVE_CASE_COL] /
-                                    df[TEST_TOTAL_COL])
-        return df
+def _group_ranges(df: pd.DataFrame, keys) -> dict:
+    """Map every group of `keys` to its (start, stop) rows.
+
+    `df` must be sorted by `keys`. Groups are keyed by value for one key and
+    by tuple of values for more.
+    """
+    if df.empty:
+        return {}
+    boundary = np.zeros(len(df), dtype=bool)
+    boundary[0] = True
+    for key in keys:
+        column = df[key]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # much cheaper to compare than the strings
+            column = column.cat.codes
+        value = column.to_numpy()
+        boundary[1:] |= value[1:] != value[:-1]
+    starts = np.flatnonzero(boundary)
+    stops = np.append(starts[1:], len(df))
+
+    labels = [df[key].iloc[starts].tolist() for key in keys]
+    labels = labels[0] if len(keys) == 1 else zip(*labels)
+    return dict(zip(labels, zip(starts.tolist(), stops.tolist())))
+
+
+def _prefix_sums(values: np.ndarray):
+    """Cumulative sums and counts of the non-NaN values along the last axis,
+    with a leading 0"""
+    valid = ~np.isnan(values)
+    zeros = np.zeros(values.shape[:-1] + (1,))
+    sums = np.concatenate(
+        (zeros, np.cumsum(np.where(valid, values, 0.), axis=-1)), axis=-1)
+    counts = np.concatenate(
+        (zeros.astype(int), np.cumsum(valid, axis=-1)), axis=-1)
+    return sums, counts
+
+
+def _rolling_sum(prefix, window: int,
+                 position: Optional[np.ndarray] = None) -> np.ndarray:
+    """Trailing `window` sums from `_prefix_sums`, along the last axis.
+
+    Like `rolling(window).sum()` rows without `window` numbers are NaN.
+    `position` is the position of each row within its series when several
+    series are stored back to back, windows never span two series.
+    """
+    sums, counts = prefix
+    out = np.full(sums.shape[:-1] + (sums.shape[-1] - 1,), np.nan)
+    if 0 < window < sums.shape[-1]:
+        window_sums = sums[..., window:] - sums[..., :-window]
+        full = (counts[..., window:] - counts[..., :-window]) == window
+        out[..., window - 1:] = np.where(full, window_sums, np.nan)
+    if position is not None:
+        out[position < window - 1] = np.nan
+    return out
+
+
+def _series_position(lengths: Iterable[int]) -> np.ndarray:
+    """Position of every row within its series, series are `lengths` long"""
+    lengths = np.asarray(lengths, dtype=int)
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(starts, lengths)
+
+
+def avg_column(col: str, window: int) -> str:
+    """Column `add_avg_columns` adds for `col` averaged over `window` days"""
+    return '{}_{}day-avg'.format(col, window)
+
+
+def window_column(metric: str, window: int) -> str:
+    """Column holding `metric` averaged over `window` days, the daily
+    column itself for windows below 2"""
+    return metric if window < 2 else avg_column(metric, window)
+
+
+@profiling.profiled('add_avg_columns')
+def add_avg_columns(df: pd.DataFrame, window: Union[int, Iterable[int]],
+                    lengths: Optional[Iterable[int]] = None):
+    """Add `{col}_{window}day-avg` columns for one or more windows.
+
+    Every window is computed from a single pass of prefix sums per column.
+    `lengths` splits `df` into consecutive series which are averaged
+    separately.
+    """
+    windows = [window] if isinstance(window, int) else list(window)
+    position = None if lengths is None else _series_position(lengths)
+    numeric = (df.drop(NON_NUMERIC_COLUMNS, axis=1, errors='ignore')
+               .select_dtypes('number'))
+    prefixes = {col: _prefix_sums(numeric[col].to_numpy(dtype=float))
+                for col in numeric.columns}
+    has_tests = {TEST_TOTAL_COL, POSITIVE_CASE_COL} <= set(df.columns)
+
+    new_columns = {}
+    for window in windows:
+        if window < 2 and has_tests:
+            # just need to add raw test rate
+            new_columns['positive-test-rate'] = (df[POSITIVE_CASE_COL] /
+                                                 df[TEST_TOTAL_COL])
+            continue
 
-    # First find rolling means
-    numeric = df.drop(NON_NUMERIC_COLUMNS, axis=1, errors='ignore')
-    roller = numeric.rolling(window)
-    means = roller.mean()
-    df = df.join(means, rsuffix='_{}day-avg'.format(window))
+        # First find rolling means
+        for col, prefix in prefixes.items():
+            new_columns[avg_column(col, window)] = (
+                _rolling_sum(prefix, window, position) / window)
 
-    if TEST_TOTAL_COL in df.columns:
-        totals = roller.sum()
-        test_rates = (totals[POSITIVE_CASE_COL] /
-                      totals[TEST_TOTAL_COL])
-        df['positive-test-rate_{}day-avg'.format(window)] = test_rates
+        if has_tests:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                totals = (_rolling_sum(prefixes[POSITIVE_CASE_COL], window,
+                                       position) /
+                          _rolling_sum(prefixes[TEST_TOTAL_COL], window,
+                                       position))
+            new_columns[avg_column('positive-test-rate', window)] = totals
 
-    return df
+    # one concat rather than inserting the columns one at a time
+    return pd.concat([df, pd.DataFrame(new_columns, index=df.index)], axis=1)
 
 
 class DailyData(object):
@@ -197,9 +526,14 @@ class DailyData(object):
         """Returns a data frame with state (and county) plus other columns"""
         raise NotImplementedError
 
-    def get_avg_df(self, window) -> pd.DataFrame:
+    def get_avg_df(self, window: Union[int, Iterable[int]]) -> pd.DataFrame:
         return add_avg_columns(self.get_df(), window)
 
+    def get_daily_df(self) -> Tuple[pd.DataFrame, str]:
+        """(`get_df` without the location columns, location label)"""
+        df = self.get_df()
+        return df, df['location'].iloc[0]
+
 
 class _StateData(DailyData, ABC):
 
@@ -207,11 +541,34 @@ class _StateData(DailyData, ABC):
         raise NotImplementedError("County data unavailable")
 
 
+def _numeric_columns(df: pd.DataFrame,
+                     columns: Optional[set] = None) -> List[str]:
+    """Sorted numeric columns of `df`, only those in `columns` unless None"""
+    return [col for col in sorted(NUMERIC_COLUMNS)
+            if col in df.columns and (columns is None or col in columns)]
+
+
 class NationalData(DailyData, ABC):
 
     def get_state_data(self, state_str) -> _StateData:
         raise NotImplementedError("State data not available")
 
+    @classmethod
+    def source_check_sum(cls, locations: Iterable[Location]) -> str:
+        """Fingerprint of the downloads `locations` would be built from.
+
+        Stale downloads are refreshed but nothing is parsed.
+        """
+        raise NotImplementedError
+
+    def check_sum(self) -> str:
+        """Fingerprint of the downloads this data was loaded from"""
+        raise NotImplementedError
+
+    def location_check_sum(self, loc: Location) -> str:
+        """Fingerprint of the data `loc` is built from"""
+        return self.check_sum()
+
     def build_source(self, loc: Location):
         source = self
 
@@ -223,101 +580,653 @@ class NationalData(DailyData, ABC):
 
         return source
 
-    def build_df(self, loc: Location, window: int,
+    def get_daily_many(self, locations: List[Location],
+                       columns: Optional[set] = None
+                       ) -> Tuple[pd.DataFrame, List[str], np.ndarray]:
+        """(date and numeric columns of every location one after the other,
+        location labels, rows of each location)
+
+        `columns` are the numeric columns to keep, None keeps all of them.
+        """
+        frames = []
+        labels = []
+        for loc in locations:
+            raw_df, label = self.build_source(loc).get_daily_df()
+            frames.append(raw_df[['date'] + _numeric_columns(raw_df, columns)])
+            labels.append(label)
+        lengths = np.array([len(_) for _ in frames], dtype=int)
+        return pd.concat(frames, ignore_index=True), labels, lengths
+
+    def build_df(self, loc: Location, window: Union[int, Iterable[int]],
                  start_date=None, end_date=None) -> pd.DataFrame:
         source = self.build_source(loc)
         df = source.get_avg_df(window)
         return date_filter(df, start_date, end_date)
 
 
+def location_label(nation: str, state: str, county: str) -> str:
+    return " ".join([_ for _ in (county, state, nation) if _])
+
+
 def add_location_info(df: pd.DataFrame, nation: str, state: str, county: str):
     df['nation'] = nation
     df['state'] = state
     df['county'] = county
-    location = " ".join([_ for _ in (county, state, nation) if _])
-    df['location'] = location
+    df['location'] = location_label(nation, state, county)
 
 
 class CountyData(DailyData):
-    def __init__(self, df: pd.DataFrame):
-        assert len(df[['state', 'county']].drop_duplicates()) == 1
+    def __init__(self, df: pd.DataFrame, is_aggregate: bool = True):
+        """`df` holds cumulative counts when `is_aggregate` else daily"""
+        assert df['state'].nunique() == 1 and df['county'].nunique() == 1
         self.df = df
+        self.is_aggregate = is_aggregate
+
+    def _deltas(self) -> pd.DataFrame:
+        if self.is_aggregate:
+            deltas = convert_to_deltas(self.df)
+        else:
+            deltas = self.df.copy()
+        return expand_df(deltas)
 
     def get_df(self) -> pd.DataFrame:
-        deltas = convert_to_deltas(self.df)
+        deltas = self._deltas()
         add_location_info(deltas, 'USA',
                           self.df['state'].iloc[0],
                           self.df['county'].iloc[0])
         return deltas
 
+    def get_daily_df(self) -> Tuple[pd.DataFrame, str]:
+        return self._deltas(), location_label('USA',
+                                              self.df['state'].iloc[0],
+                                              self.df['county'].iloc[0])
+
 
 class StateData(_StateData):
 
     def __init__(self, df: pd.DataFrame,
-                 is_aggregate: bool):
+                 is_aggregate: bool,
+                 county_df: Optional[pd.DataFrame] = None,
+                 county_index: Optional[dict] = None):
+        """`county_df` holds daily county rows when they aren't in `df`.
+
+        `county_index` maps county to its (start, stop) rows in the county
+        rows.
+        """
         # 'state' should always be present
         assert len(df['state'].unique()) == 1
         self.df = df
         self.is_aggregate = is_aggregate
+        self.county_df = county_df
+        self.county_index = county_index
 
-    def get_df(self) -> pd.DataFrame:
+    def _deltas(self) -> pd.DataFrame:
         if self.is_aggregate:
             df = convert_to_deltas(self.df)
         else:
-            df = self.df
+            df = self.df.copy()
+        return expand_df(df)
 
+    def get_df(self) -> pd.DataFrame:
+        df = self._deltas()
         add_location_info(df, 'USA',
                           self.df['state'].iloc[0],
                           None)
         return df
 
+    def get_daily_df(self) -> Tuple[pd.DataFrame, str]:
+        return self._deltas(), location_label('USA',
+                                              self.df['state'].iloc[0], None)
+
     def get_county_data(self, county_str) -> DailyData:
+        if self.county_df is not None:
+            return self._get_daily_county_data(county_str)
+
         if 'county' not in self.df.columns:
             raise DataUnavailableException("County data not available.")
 
         county_df = self.df[self.df.county == county_str]
         if county_df.empty:
-            raise ValueError("Invalid state {} choose from {}".
-                             format(county_df,
+            raise ValueError("Invalid county {} choose from {}".
+                             format(county_str,
                                     self.df.county.unique()))
-        return CountyData(county_df)
+        return CountyData(county_df, self.is_aggregate)
+
+    def _get_daily_county_data(self, county_str) -> DailyData:
+        if county_str not in self.county_index:
+            raise ValueError("Invalid county {} choose from {}".
+                             format(county_str, list(self.county_index)))
+        start, stop = self.county_index[county_str]
+        return CountyData(self.county_df.iloc[start:stop], False)
+
+
+NYTIMES_COLUMNS = ['date', 'county', 'state', 'cases', 'deaths']
+
+
+def _columnar_cache_dir(csv_path):
+    return os.path.join(os.path.dirname(csv_path), 'columnar')
+
+
+def _csv_stamp(csv_path):
+    """Identifies one particular download of the csv"""
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# compact the cache once this many incremental parts were appended
+MAX_COLUMNAR_PARTS = 32
+
+
+def _ingest_meta_path(cache_dir):
+    # leading underscore keeps pyarrow from treating it as data
+    return os.path.join(cache_dir, '_ingest.json')
+
+
+def _read_ingest_meta(cache_dir) -> Optional[dict]:
+    meta_path = _ingest_meta_path(cache_dir)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf8') as ifp:
+        return json.load(ifp)
+
+
+def _md5_prefix(path, n_bytes):
+    md5 = hashlib.md5()
+    with download.open_file(path, 'rb') as ifp:
+        while n_bytes > 0:
+            chunk = ifp.read(min(n_bytes, download.CHUNK_SIZE))
+            if not chunk:
+                break
+            md5.update(chunk)
+            n_bytes -= len(chunk)
+    return md5
+
+
+def _parse_nytimes_csv(path_or_buffer) -> pd.DataFrame:
+    # ['date', 'county', 'state', 'fips', 'cases', 'deaths']
+    df = pd.read_csv(path_or_buffer, parse_dates=['date'],
+                     usecols=NYTIMES_COLUMNS, encoding='utf8')
+    # rows within each state partition are kept in date order
+    df.sort_values('date', inplace=True, kind='stable')
+    return df
+
+
+def _write_columnar_part(df: pd.DataFrame, out_dir, part: int):
+    df.to_parquet(out_dir, partition_cols=['state'], index=False,
+                  basename_template='part-{:06d}-{{i}}.parquet'.format(part))
+
+
+def _rollup_rows(rows: pd.DataFrame, carry: Optional[pd.DataFrame]):
+    """Daily state and national deltas of cumulative county `rows`.
+
+    `carry` holds the last cumulative counts of every county seen before
+    `rows` (indexed by state and county), each county's first row in `rows`
+    is diffed against it (zeros for counties not seen before). Returns
+    (state daily, national daily, carry including `rows`).
+    """
+    numeric = ['cases', 'deaths']
+    keys = ['state', 'county']
+    rows = rows.sort_values(keys + ['date'], kind='stable')
+    # blank counts are zeros, like `_county_deltas`
+    rows = rows.fillna({_: 0 for _ in numeric})
+    previous = rows.groupby(keys)[numeric].shift()
+    first = (rows.groupby(keys).cumcount() == 0).to_numpy()
+    carried = np.zeros((first.sum(), len(numeric)))
+    if carry is not None:
+        # counties seen earlier continue from there
+        index = pd.MultiIndex.from_frame(rows.loc[first, keys])
+        carried = carry.reindex(index).fillna(0).to_numpy()
+    previous.loc[first] = carried
+    deltas = rows[numeric] - previous
+    state_daily = deltas.groupby([rows['state'], rows['date']]).sum()
+    national_daily = state_daily.groupby(level='date').sum()
+
+    last = rows.groupby(keys)[numeric].last()
+    carry = last if carry is None else last.combine_first(carry)
+    return state_daily, national_daily, carry
+
+
+# state and national daily deltas, and every county's last cumulative
+# counts to continue them from, kept next to the columnar cache. Each
+# ingest writes a new generation, the ingest meta names the current one so
+# rollups and the offset they were made up to change together.
+ROLLUP_FILES = {
+    'state': '_state_daily-{}.parquet',
+    'national': '_national_daily-{}.parquet',
+    'carry': '_county_last-{}.parquet',
+}
+
+
+def _rollup_path(cache_dir, name, generation: int):
+    # leading underscore keeps pyarrow from treating it as data
+    return os.path.join(cache_dir, ROLLUP_FILES[name].format(generation))
+
+
+def _read_rollups(cache_dir, generation: int,
+                  names=tuple(ROLLUP_FILES)) -> dict:
+    rollups = {name: pd.read_parquet(_rollup_path(cache_dir, name,
+                                                  generation))
+               for name in names}
+    if 'carry' in rollups:
+        rollups['carry'] = rollups['carry'].set_index(['state', 'county'])
+    return rollups
+
+
+def _write_rollups(cache_dir, generation: int, rows: pd.DataFrame,
+                   previous: Optional[dict] = None):
+    """Roll up `rows` as `generation`, continuing from the `previous`
+    rollups"""
+    carry = previous['carry'] if previous else None
+    state_daily, national_daily, carry = _rollup_rows(rows, carry)
+    state_daily = state_daily.reset_index()
+    national_daily = national_daily.reset_index()
+    if previous:
+        # appended rows may still fall on the last ingested date
+        state_daily = (pd.concat([previous['state'], state_daily])
+                       .groupby(['state', 'date'], as_index=False).sum())
+        national_daily = (pd.concat([previous['national'], national_daily])
+                          .groupby('date', as_index=False).sum())
+    frames = {'state': state_daily, 'national': national_daily,
+              'carry': carry.reset_index()}
+    for name, df in frames.items():
+        path = _rollup_path(cache_dir, name, generation)
+        df.to_parquet(path + '.part', index=False)
+        os.replace(path + '.part', path)
+
+
+def _rebuild_columnar_cache(csv_path, cache_dir, df=None):
+    """Store the whole csv (or `df`) as parquet partitioned by state.
+
+    The cache is built in a scratch directory and moved into place so a
+    reader never sees a half written cache.
+    """
+    if df is None:
+        df = _parse_nytimes_csv(csv_path)
+    offset = download.content_size(csv_path)
+
+    tmp_dir = '{}.tmp-{}'.format(cache_dir, os.getpid())
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _write_columnar_part(df, tmp_dir, 0)
+    _write_rollups(tmp_dir, 0, df)
+    download.atomic_write_json(_ingest_meta_path(tmp_dir), {
+        'stamp': _csv_stamp(csv_path),
+        'offset': offset,
+        # md5 of everything, without reading the csv again
+        'prefix_md5': download.fingerprint(csv_path),
+        'last_date': df['date'].max().isoformat(),
+        'parts': 1,
+        'rollup_generation': 0,
+    })
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
+
+
+def _append_columnar_rows(csv_path, cache_dir, meta) -> bool:
+    """Ingest the rows appended to the csv since the cache was written.
+
+    Returns False when the csv no longer starts with what was ingested,
+    i.e. upstream rewrote history and the cache has to be rebuilt.
+    """
+    offset = meta['offset']
+    if download.content_size(csv_path) < offset:
+        return False
+    md5 = _md5_prefix(csv_path, offset)
+    if md5.hexdigest() != meta['prefix_md5']:
+        return False
+
+    with download.open_file(csv_path, 'rb') as ifp:
+        header = ifp.readline()
+        ifp.seek(offset)
+        tail = ifp.read()
+
+    if tail.strip():
+        new_rows = _parse_nytimes_csv(io.BytesIO(header + tail))
+        if (new_rows['date'] < pd.Timestamp(meta['last_date'])).any():
+            return False
+
+        tmp_dir = '{}.tmp-{}'.format(cache_dir, os.getpid())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        _write_columnar_part(new_rows, tmp_dir, meta['parts'])
+        for dir_path, _, file_names in os.walk(tmp_dir):
+            out_dir = os.path.join(cache_dir,
+                                   os.path.relpath(dir_path, tmp_dir))
+            os.makedirs(out_dir, exist_ok=True)
+            for file_name in file_names:
+                os.rename(os.path.join(dir_path, file_name),
+                          os.path.join(out_dir, file_name))
+        shutil.rmtree(tmp_dir)
+        # the appended partition files are rewritten as they are if this
+        # is retried, the rollups only count once the meta names them
+        generation = meta['rollup_generation']
+        _write_rollups(cache_dir, generation + 1, new_rows,
+                       _read_rollups(cache_dir, generation))
+
+        meta['parts'] += 1
+        meta['last_date'] = new_rows['date'].max().isoformat()
+        meta['rollup_generation'] = generation + 1
+
+    md5.update(tail)
+    meta['offset'] += len(tail)
+    meta['prefix_md5'] = md5.hexdigest()
+    meta['stamp'] = _csv_stamp(csv_path)
+    download.atomic_write_json(_ingest_meta_path(cache_dir), meta)
+    if tail.strip():
+        for name in ROLLUP_FILES:
+            os.remove(_rollup_path(cache_dir, name, generation))
+    return True
+
+
+def _update_columnar_cache(csv_path, cache_dir):
+    """Bring the cache up to date with the csv, parsing as little as possible"""
+    meta = _read_ingest_meta(cache_dir)
+    if meta is not None and 'rollup_generation' not in meta:
+        # written before there were (generations of) rollups
+        meta = None
+    if meta is not None and meta['stamp'] == _csv_stamp(csv_path):
+        return
+
+    if meta is None or not _append_columnar_rows(csv_path, cache_dir, meta):
+        _rebuild_columnar_cache(csv_path, cache_dir)
+    elif meta['parts'] > MAX_COLUMNAR_PARTS:
+        # lots of tiny files make reads slow, re-write what we have
+        df = _read_columnar_cache(cache_dir, NYTIMES_COLUMNS, None)
+        _rebuild_columnar_cache(csv_path, cache_dir, df)
+
+
+def _read_columnar_cache(cache_dir, columns, states):
+    filters = [('state', 'in', sorted(states))] if states else None
+    df = pd.read_parquet(cache_dir, columns=columns, filters=filters,
+                         memory_map=True)
+    # partition values come back as a categorical
+    df['state'] = df['state'].astype(str)
+    return df[columns]
+
+
+@profiling.profiled('nytimes.parse')
+def _load_nytimes_df(csv_path, columns=None, states=None) -> pd.DataFrame:
+    """Load the county csv via the columnar cache.
+
+    Only `columns` are read and only the rows for `states` (full names) are
+    read when given. Rows added to the csv since the last load are appended
+    to the cache, which is rebuilt if the csv changed in any other way.
+    """
+    columns = list(columns or NYTIMES_COLUMNS)
+    cache_dir = _columnar_cache_dir(csv_path)
+    with download.FileLock(cache_dir + '.lock'):
+        _update_columnar_cache(csv_path, cache_dir)
+        return _read_columnar_cache(cache_dir, columns, states)
+
+
+@profiling.profiled('nytimes.rollups')
+def _load_nytimes_rollups(csv_path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(state daily, national daily) deltas rolled up when the csv was
+    ingested into the columnar cache, no county rows are read"""
+    rollups = _read_nytimes_rollups(csv_path, ('state', 'national'))
+    return rollups['state'], rollups['national']
+
+
+def _read_nytimes_rollups(csv_path, names) -> dict:
+    cache_dir = _columnar_cache_dir(csv_path)
+    with download.FileLock(cache_dir + '.lock'):
+        _update_columnar_cache(csv_path, cache_dir)
+        generation = _read_ingest_meta(cache_dir)['rollup_generation']
+        return _read_rollups(cache_dir, generation, names)
+
+
+def nytimes_counties(csv_path: Optional[str] = None
+                     ) -> List[Tuple[str, str]]:
+    """(state, county) of every county in the NYTimes data, read from the
+    rollups without loading any county rows"""
+    carry = _read_nytimes_rollups(csv_path or _dl_nytimes_csv(),
+                                  ('carry',))['carry']
+    return list(carry.index)
+
+
+# rough in-memory size of one parsed csv row, used to size chunks
+PARSED_ROW_BYTES = 200
+MIN_CHUNK_ROWS = 1000
+
+
+@profiling.profiled('nytimes.stream')
+def _stream_nytimes_csv(csv_path, states, max_bytes: int):
+    """Read the csv chunk by chunk, keeping only the rows of `states`.
+
+    Chunks are sized so parsing stays within `max_bytes`. National daily
+    deltas are reduced chunk by chunk (carrying every county's last
+    cumulative count over to the next chunk) so all rows are never held
+    at once. Returns (compact rows of `states`, national daily deltas).
+    """
+    chunk_rows = max(MIN_CHUNK_ROWS, max_bytes // (4 * PARSED_ROW_BYTES))
+    carry = None
+    national = None
+    kept = []
+    with pd.read_csv(csv_path, parse_dates=['date'], usecols=NYTIMES_COLUMNS,
+                     encoding='utf8', chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            kept.append(compact_df(chunk[chunk.state.isin(states)]))
+            _, daily, carry = _rollup_rows(chunk, carry)
+            national = daily if national is None else national.add(
+                daily, fill_value=0)
+
+    df = compact_df(pd.concat(kept, ignore_index=True))
+    national_df = national.sort_index().reset_index()
+    profiling.set_rows(len(df))
+    return df, compact_df(national_df)
+
+
+def _nytimes_requirements(locations: Optional[Iterable[Location]]):
+    """Return (columns, states) required to answer `locations`"""
+    if locations is None:
+        return NYTIMES_COLUMNS, None
+
+    # state and national numbers come from the rollups, only counties need
+    # the county rows of their state
+    counties = [loc for loc in locations if loc.county]
+    if not all(loc.state for loc in counties):
+        return NYTIMES_COLUMNS, None
+
+    states = {_lookup_name_abbrev(loc.state)[0] for loc in counties}
+    return NYTIMES_COLUMNS, states
+
+
+NYTIMES_URL = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv"
+
+
+def _dl_nytimes_csv():
+    return _dl_csv(NYTIMES_URL, 'nytimes', 'us-counties')
 
 
 class NyTimesData(NationalData):
-    def __init__(self):
-        # download data and create initial data frame
-        csv_path = _dl_csv(
-            "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv",
-            'nytimes', 'us-counties'
-        )
-        """
-        ['date', 'county', 'state', 'fips', 'cases', 'deaths']
+    @profiling.profiled('nytimes.load')
+    def __init__(self, locations: Optional[Iterable[Location]] = None,
+                 csv_path: Optional[str] = None,
+                 compact: bool = True,
+                 max_bytes: Optional[int] = None):
+        """When `locations` is given only the data needed for them is loaded.
+
+        State and national numbers are read from the rollups made when the
+        csv was ingested, county rows are only loaded for the states of
+        county `locations`. `csv_path` is read instead of downloading the
+        data. With `compact` the frames are stored as `compact_df`. With
+        `max_bytes` the csv is streamed in chunks parsed within about that
+        much memory (and always compacted), keeping only the county rows
+        `locations` need.
         """
-        self.df = pd.read_csv(csv_path, parse_dates=['date'],
-                              usecols=['date', 'county', 'state', 'cases',
-                                       'deaths'], encoding='raw_unicode_escape')
-        # No mapping required
-        self.df.sort_values('date', inplace=True)
+        # download data and create initial data frame
+        if csv_path is None:
+            csv_path = _dl_nytimes_csv()
+        self.csv_path = csv_path
+        self._check_sum = download.fingerprint(csv_path)
+        columns, states = _nytimes_requirements(locations)
+        state_df = None
+        if max_bytes is not None:
+            # national numbers come out of the stream, no need for every state
+            states = {_lookup_name_abbrev(loc.state)[0]
+                      for loc in locations or () if loc.state}
+            df, national_df = _stream_nytimes_csv(csv_path, states, max_bytes)
+        else:
+            state_df, national_df = _load_nytimes_rollups(csv_path)
+            if states is not None and not states:
+                df = pd.DataFrame({col: [] for col in columns})
+            else:
+                # No mapping required
+                df = _load_nytimes_df(csv_path, columns, states)
+            if compact:
+                df = compact_df(df)
+        # states whose county rows were loaded, None for all of them
+        self.states = states
+
+        # sorted so every state and county is a contiguous block of rows
+        df = df.sort_values(['state', 'county', 'date'], kind='stable',
+                            ignore_index=True)
+        county_ranges = _group_ranges(df, ['state', 'county'])
+        county_starts = [start for start, _ in county_ranges.values()]
+
+        # daily numbers for every county
+        df = _county_deltas(df, county_starts)
+        if state_df is None:
+            numeric = [_ for _ in df.columns if _ in NUMERIC_COLUMNS]
+            state_df = (df.groupby(['state', 'date'], observed=True)[numeric]
+                        .sum().reset_index())
+        state_df = state_df.sort_values(['state', 'date'], kind='stable',
+                                        ignore_index=True)
+        if compact:
+            df, state_df = compact_df(df), compact_df(state_df)
+            national_df = compact_df(national_df)
+        self.df, self.state_df, self.national_df = df, state_df, national_df
+
+        self._state_index = _group_ranges(self.df, ['state'])
+        self._state_daily_index = _group_ranges(self.state_df, ['state'])
+        self._county_index = {}
+        for (state, county), (start, stop) in county_ranges.items():
+            state_start = self._state_index[state][0]
+            self._county_index.setdefault(state, {})[county] = (
+                start - state_start, stop - state_start)
+        profiling.set_rows(len(self.df))
+
+    def counties(self) -> List[Tuple[str, str]]:
+        """(state, county) of every loaded county"""
+        return [(state, county)
+                for state, counties in self._county_index.items()
+                for county in counties]
 
     def get_state_data(self, state_str) -> StateData:
         name, state = _lookup_name_abbrev(state_str)
-        state_df = self.df[self.df.state == name]
-        if state_df.empty:
+        if name not in self._state_daily_index:
+            if self.states is not None and name not in self.states:
+                raise DataUnavailableException(
+                    "{} was not loaded, loaded {}".format(name, self.states))
             raise ValueError("Invalid state {} choose from {}".
-                             format(name,
-                                    self.df.state.unique()))
-        return StateData(state_df, True)
+                             format(name, list(self._state_daily_index)))
+        start, stop = self._state_daily_index[name]
+        if name not in self._state_index:
+            # the state's rollup without its counties
+            return StateData(self.state_df.iloc[start:stop], False)
+        county_start, county_stop = self._state_index[name]
+        return StateData(self.state_df.iloc[start:stop], False,
+                         self.df.iloc[county_start:county_stop],
+                         self._county_index[name])
 
     def get_df(self) -> pd.DataFrame:
-        df = convert_to_deltas(self.df)
+        if self.national_df is None:
+            raise DataUnavailableException(
+                "National data unavailable, loaded {}".format(self.states))
+        df = expand_df(self.national_df.copy())
         add_location_info(df, 'USA',
                           None, None)
         return df
 
+    def _daily_rows(self, loc: Location) -> Tuple[int, int, int, str]:
+        """(frame, start, stop, label) of the rows `build_source(loc)` holds,
+        frame 0 is `df`, 1 `state_df` and 2 `national_df`"""
+        if not loc.state:
+            if self.national_df is None:
+                self.get_df()
+            return 2, 0, len(self.national_df), location_label('USA', None,
+                                                               None)
+        name, _ = _lookup_name_abbrev(loc.state)
+        try:
+            if not loc.county:
+                start, stop = self._state_daily_index[name]
+                return 1, start, stop, location_label('USA', name, None)
+            state_start = self._state_index[name][0]
+            start, stop = self._county_index[name][loc.county]
+            return (0, state_start + start, state_start + stop,
+                    location_label('USA', name, loc.county))
+        except KeyError:
+            # raises the errors of the state or county lookups
+            self.build_source(loc)
+            raise
+
+    def get_daily_many(self, locations: List[Location],
+                       columns: Optional[set] = None
+                       ) -> Tuple[pd.DataFrame, List[str], np.ndarray]:
+        """Like `NationalData.get_daily_many`, with one positional take of
+        the row ranges of all of the locations in each frame"""
+        rows = [self._daily_rows(loc) for loc in locations]
+        frame_of = np.array([_[0] for _ in rows], dtype=int)
+        starts = np.array([_[1] for _ in rows], dtype=int)
+        lengths = np.array([_[2] for _ in rows], dtype=int) - starts
+        labels = [_[3] for _ in rows]
+
+        pieces = []
+        order = []
+        for i, frame in enumerate((self.df, self.state_df, self.national_df)):
+            picked = np.flatnonzero(frame_of == i)
+            if not len(picked):
+                continue
+            positions = (np.repeat(starts[picked], lengths[picked])
+                         + _series_position(lengths[picked]))
+            keep = ['date'] + _numeric_columns(frame, columns)
+            pieces.append(expand_df(frame.iloc[positions][keep]))
+            order.append(picked)
+        df = pd.concat(pieces, ignore_index=True)
+        if len(pieces) > 1:
+            # back to the order of `locations`
+            order = np.concatenate(order)
+            piece_starts = np.empty(len(locations), dtype=int)
+            piece_starts[order] = np.cumsum(lengths[order]) - lengths[order]
+            df = df.iloc[np.repeat(piece_starts, lengths)
+                         + _series_position(lengths)].reset_index(drop=True)
+        return df, labels, lengths
+
+    @classmethod
+    def source_check_sum(cls, locations: Iterable[Location]) -> str:
+        return download.fingerprint(_dl_nytimes_csv())
+
+    def check_sum(self) -> str:
+        return self._check_sum
+
+
+COVIDTRACKING_URL = 'https://covidtracking.com/api/v1'
+
+
+def _covidtracking_url(target, base_url=COVIDTRACKING_URL):
+    if target == 'usa':
+        return f'{base_url}/us/daily.csv'
+    return f'{base_url}/states/{target}/daily.csv'
+
+
+def _dl_covidtracking_csv(target, base_url=COVIDTRACKING_URL):
+    return _dl_csv(_covidtracking_url(target, base_url), 'covidtracking',
+                   target)
+
+
+def _covidtracking_target(loc: Location):
+    if not loc.state:
+        return 'usa'
+    return _lookup_name_abbrev(loc.state)[1].lower()
+
+
+# concurrent downloads when prefetching states
+PREFETCH_WORKERS = 8
+
 
 class CovidTrackingData(NationalData):
 
-    def __init__(self):
+    def __init__(self, base_url: str = COVIDTRACKING_URL,
+                 max_workers: int = PREFETCH_WORKERS):
         """
         https://covidtracking.com/api
 
@@ -342,24 +1251,58 @@ class CovidTrackingData(NationalData):
             'deathIncrease': 'deaths',
             'hospitalizedIncrease': 'hospitalizations',
         }
-
+        self.base_url = base_url
+        self.max_workers = max_workers
+        # target -> (fingerprint, parsed data frame)
+        self._frames = {}
+        self._frames_lock = threading.Lock()
+        self._frozen = False
+
+    def freeze(self):
+        """Only serve the states loaded so far and never download again,
+        so the data can't change (or block on the network) under readers"""
+        self._frozen = True
+
+    def _frozen_memo(self, target):
+        memo = self._frames.get(target)
+        if memo is None:
+            raise DataUnavailableException(
+                "{} wasn't loaded before freezing".format(target))
+        return memo
+
+    @profiling.profiled('covidtracking.load')
     def _load_df(self, target):
-        if target == 'usa':
-            url = f'https://covidtracking.com/api/v1/us/daily.csv'
-        else:
-            url = f'https://covidtracking.com/api/v1/states/{target}/daily.csv'
-
-        csv_path = _dl_csv(url, 'covidtracking', target)
+        if self._frozen:
+            return self._frozen_memo(target)[1].copy()
+        csv_path = _dl_covidtracking_csv(target, self.base_url)
+        check_sum = download.fingerprint(csv_path)
+        with self._frames_lock:
+            memo = self._frames.get(target)
+        if memo is not None and memo[0] == check_sum:
+            return memo[1].copy()
 
         # load data frame
         df = pd.read_csv(csv_path, parse_dates=['date'],
-                         usecols=self._column_mapping.keys(), encoding='raw_unicode_escape')
+                         usecols=self._column_mapping.keys(), encoding='utf8')
 
         # map columns
         df.rename(columns=self._column_mapping, inplace=True)
         df.sort_values('date', inplace=True)
 
-        return df
+        with self._frames_lock:
+            self._frames[target] = (check_sum, df)
+        return df.copy()
+
+    def prefetch(self, states: Iterable[str]):
+        """Download and parse `states` concurrently.
+
+        States are names or abbreviations, 'USA' for the national numbers.
+        """
+        targets = {'usa' if _.upper() == 'USA'
+                   else _lookup_name_abbrev(_)[1].lower() for _ in states}
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+            # list() so any exceptions are raised
+            list(pool.map(self._load_df, sorted(targets)))
 
     def get_state_data(self, state_str) -> StateData:
         name, state = _lookup_name_abbrev(state_str)
@@ -373,6 +1316,25 @@ class CovidTrackingData(NationalData):
                           None, None)
         return df
 
+    @classmethod
+    def source_check_sum(cls, locations: Iterable[Location]) -> str:
+        targets = sorted({_covidtracking_target(loc) for loc in locations})
+        return ' '.join(download.fingerprint(_dl_covidtracking_csv(target))
+                        for target in targets)
+
+    def _target_check_sum(self, target) -> str:
+        if self._frozen:
+            return self._frozen_memo(target)[0]
+        return download.fingerprint(
+            _dl_covidtracking_csv(target, self.base_url))
+
+    def check_sum(self) -> str:
+        return self._target_check_sum('usa')
+
+    def location_check_sum(self, loc: Location) -> str:
+        # every state is downloaded (so may change) separately
+        return self._target_check_sum(_covidtracking_target(loc))
+
 
 class PopulationData(object):
     def build_df(self, loc: Location) -> pd.DataFrame:
@@ -385,37 +1347,28 @@ class PopulationData(object):
 CENSUS_DIR = "/tmp/us-census"
 
 
-def _dl_census_csv():
-    csv_file = os.path.join(CENSUS_DIR, 'co-est2019-alldata.csv')
-    if os.path.exists(csv_file):
-        return csv_file
+CENSUS_URL = 'https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/co-est2019-alldata.csv'
 
-    url = 'https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/co-est2019-alldata.csv'
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        raise ValueError("Bad error code\n{}", resp)
 
-    if not os.path.exists(CENSUS_DIR):
-        os.makedirs(CENSUS_DIR)
+def _census_csv_path():
+    return os.path.join(CENSUS_DIR,
+                        'co-est2019-alldata.csv' + download.GZIP_SUFFIX)
 
-    with open(csv_file, 'w') as ofp:
-        ofp.write(resp.text)
 
-    return csv_file
+def _dl_census_csv():
+    return download.fetch(CENSUS_URL, _census_csv_path(),
+                          download.source_ttl('census'))
 
 
-def _fix_county_name(name: str):
-    return (name
-            .replace(" County", "")
-            .replace(" Borough", "")
-            .replace(" Parish", "")
-            )
+def _fix_county_names(names: pd.Series) -> pd.Series:
+    return names.str.replace(" County| Borough| Parish", "", regex=True)
 
 
-def _load_census_df():
-    csv_path = _dl_census_csv()
+@profiling.profiled('census.parse')
+def _parse_census_csv(csv_path):
     fields = ['SUMLEV', 'STNAME', 'CTYNAME', 'POPESTIMATE2019']
-    df = pd.read_csv(csv_path, usecols=fields, encoding='raw_unicode_escape')
+    # the census serves latin-1
+    df = pd.read_csv(csv_path, usecols=fields, encoding='latin-1')
     # map columns
     col_map = {
         "SUMLEV": 'sumlev',
@@ -424,17 +1377,73 @@ def _load_census_df():
         'POPESTIMATE2019': 'population'
     }
     df.rename(columns=col_map, inplace=True)
-    # strip " County" Borough, Census Area, Parish
-    df['county'] = df['county'].apply(_fix_county_name)
     # keep only county level
-    county = df[df['sumlev'] == 50]
-
-    return county.drop(columns=['sumlev'])
+    county = df[df['sumlev'] == 50].drop(columns=['sumlev'])
+    # strip " County" Borough, Census Area, Parish
+    county['county'] = _fix_county_names(county['county'])
+    return county.reset_index(drop=True)
+
+
+def _census_totals(df: pd.DataFrame):
+    """(population and count of rows by state and county, population by
+    state, national population)"""
+    counties = (df.groupby(['state', 'county'])['population']
+                .agg(['sum', 'count']).reset_index())
+    states = df.groupby('state')['population'].sum()
+    return (counties, {k: int(v) for k, v in states.items()},
+            int(df['population'].sum()))
+
+
+@profiling.profiled('census.load')
+def _load_census_df(csv_path, check_sum):
+    """Load the cleaned county table with its totals (see `_census_totals`),
+    cached as parquet next to the csv"""
+    cache_path = csv_path + '.parquet'
+    counties_path = csv_path + '.counties.parquet'
+    meta_path = cache_path + '.json'
+    with download.FileLock(cache_path + '.lock'):
+        if os.path.exists(meta_path) and os.path.exists(cache_path):
+            with open(meta_path, 'r', encoding='utf8') as ifp:
+                meta = json.load(ifp)
+            # caches from before the totals were kept are rebuilt
+            if meta.get('md5') == check_sum and 'states' in meta:
+                return (pd.read_parquet(cache_path),
+                        pd.read_parquet(counties_path),
+                        meta['states'], meta['nation'])
+
+        df = _parse_census_csv(csv_path)
+        counties, states, nation = _census_totals(df)
+        for path, frame in ((cache_path, df), (counties_path, counties)):
+            tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+            frame.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        # written last, the cache is only used once it matches
+        download.atomic_write_json(meta_path, {
+            'md5': check_sum, 'states': states, 'nation': nation})
+    return df, counties, states, nation
 
 
 class CensusData(PopulationData):
-    def __init__(self):
-        self.df = _load_census_df()
+    def __init__(self, csv_path: Optional[str] = None):
+        """`csv_path` is read instead of downloading the data"""
+        self.csv_path = csv_path or _dl_census_csv()
+        self._check_sum = download.fingerprint(self.csv_path)
+        (self.df, counties, self._state_population,
+         self._national_population) = _load_census_df(self.csv_path,
+                                                      self._check_sum)
+
+        # populations by (state, county) and by state for O(1) lookups
+        keys = list(zip(counties['state'].tolist(),
+                        counties['county'].tolist()))
+        self._county_population = dict(zip(keys, counties['sum'].tolist()))
+        self._county_count = dict(zip(keys, counties['count'].tolist()))
+
+    @classmethod
+    def source_check_sum(cls) -> str:
+        return download.fingerprint(_dl_census_csv())
+
+    def check_sum(self) -> str:
+        return self._check_sum
 
     def build_df(self, loc: Location) -> pd.DataFrame:
         if loc.nation != 'USA':
@@ -454,18 +1463,141 @@ class CensusData(PopulationData):
         return df
 
     def get_population(self, loc: Location) -> int:
-        df = self.build_df(loc)
-        return df['population'].sum()
+        if loc.nation != 'USA':
+            raise ValueError("Unknown nation: {}".format(loc.nation))
+        if not loc.state:
+            return self._national_population
+
+        name, abbrev = _lookup_name_abbrev(loc.state)
+        if name not in self._state_population:
+            raise DataUnavailableException(
+                "No census population for {}".format(name))
+        if not loc.county:
+            return self._state_population[name]
+
+        key = (name, loc.county)
+        count = self._county_count.get(key, 0)
+        if count != 1:
+            raise DataUnavailableException(
+                "Expected one census county {} of {}, got {}".format(
+                    loc.county, name, count))
+        return self._county_population[key]
+
+    def county_populations(self, counties: Iterable[Tuple[str, str]]
+                           ) -> np.ndarray:
+        """Populations of (state name, county) pairs, NaN where the census
+        doesn't have exactly one such county"""
+        return np.array([self._county_population[key]
+                         if self._county_count.get(key) == 1 else np.nan
+                         for key in counties], dtype=float)
+
+
+def _copy_on_write() -> bool:
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    return pd.get_option('mode.copy_on_write') is True
+
+
+def _protected_copy(df: pd.DataFrame) -> pd.DataFrame:
+    """Copy which can be modified without touching `df`.
+
+    Lazy (nothing is copied until written) when copy on write is enabled.
+    """
+    return df.copy(deep=not _copy_on_write())
+
+
+class FrameCache(object):
+    """LRU cache of data frames bounded by their memory usage, safe to share
+    between threads"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[pd.DataFrame]:
+        with self._lock:
+            memo = self._frames.get(key)
+            if memo is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._frames.move_to_end(key)
+        return _protected_copy(memo[0])
+
+    def put(self, key, df: pd.DataFrame) -> pd.DataFrame:
+        """Cache `df`, returns a copy of it safe to hand out"""
+        n_bytes = int(df.memory_usage(deep=True).sum())
+        if n_bytes > self.max_bytes:
+            return df
+
+        with self._lock:
+            if key in self._frames:
+                self.current_bytes -= self._frames.pop(key)[1]
+            self._frames[key] = (df, n_bytes)
+            self.current_bytes += n_bytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._frames.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+        return _protected_copy(df)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+
+def metric_requirements(metrics: Optional[Iterable[str]]) -> Optional[set]:
+    """Raw columns needed to compute `metrics`, None (everything) for None"""
+    if metrics is None:
+        return None
+    required = set()
+    for metric in metrics:
+        if metric == 'positive-test-rate':
+            required.update((POSITIVE_CASE_COL, TEST_TOTAL_COL))
+        elif metric.endswith('100k'):
+            required.add(metric[:-len('100k')])
+        else:
+            required.add(metric)
+    return required
+
+
+# memory budget for the frames built by PopulationNormalizedData
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
 
 
 class PopulationNormalizedData(object):
 
-    def __init__(self, covid_data: NationalData, census_data: CensusData):
+    def __init__(self, covid_data: NationalData, census_data: CensusData,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES):
         self.covid_data = covid_data
         self.census_data = census_data
+        self.cache = FrameCache(cache_bytes)
 
-    def build_df(self, loc: Location, window: int,
+    @profiling.profiled('build_df')
+    def build_df(self, loc: Location, window: Union[int, Iterable[int]],
                  start_date=None, end_date=None) -> pd.DataFrame:
+        """Results are cached until the data they were built from changes"""
+        windows = (window,) if isinstance(window, int) else tuple(window)
+        key = (self.covid_data.location_check_sum(loc),
+               self.census_data.check_sum(),
+               str(loc), windows, start_date, end_date)
+        df = self.cache.get(key)
+        if df is None:
+            df = self.cache.put(key, self._build_df(loc, windows,
+                                                    start_date, end_date))
+        return df
+
+    def _build_df(self, loc: Location, window: Union[int, Iterable[int]],
+                  start_date=None, end_date=None) -> pd.DataFrame:
         raw_df = self.covid_data.build_source(loc).get_df()
 
         population = self.census_data.get_population(loc)
@@ -477,11 +1609,49 @@ class PopulationNormalizedData(object):
         df = add_avg_columns(raw_df, window)
         return date_filter(df, start_date, end_date)
 
-    @functools.lru_cache(maxsize=None)
-    def check_sum(self) -> str:
-        md5 = hashlib.md5()
-        for d in self.covid_data.get_df().iterrows():
-            md5.update(str(d).encode('utf8'))
-        for d in self.census_data.df.iterrows():
-            md5.update(str(d).encode('utf8'))
-        return md5.hexdigest()
+    @profiling.profiled('build_df_many')
+    def build_df_many(self, locations: Iterable[Location],
+                      window: Union[int, Iterable[int]],
+                      start_date=None, end_date=None,
+                      columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Long format (date, location, ...) frame of every location.
+
+        `columns` are the metrics (e.g. 'cases100k') to keep, with their
+        averages for every window. Only the raw columns they need are
+        gathered, then the 100k and average columns of all of the locations
+        are computed at once. Results are cached like `build_df`.
+        """
+        locations = list(locations)
+        windows = (window,) if isinstance(window, int) else tuple(window)
+        columns = None if columns is None else tuple(columns)
+        key = ('many',
+               tuple(self.covid_data.location_check_sum(_) for _ in locations),
+               self.census_data.check_sum(),
+               tuple(str(_) for _ in locations), windows, start_date, end_date,
+               columns)
+        df = self.cache.get(key)
+        if df is None:
+            df = self.cache.put(key, self._build_df_many(
+                locations, windows, start_date, end_date, columns))
+        return df
+
+    def _build_df_many(self, locations, windows, start_date, end_date,
+                       columns) -> pd.DataFrame:
+        df, labels, lengths = self.covid_data.get_daily_many(
+            locations, metric_requirements(columns))
+        populations = [self.census_data.get_population(loc)
+                       for loc in locations]
+        df.insert(1, 'location', np.repeat(labels, lengths))
+        pop100k = np.repeat(np.array(populations, dtype=float) / 100e3,
+                            lengths)
+        for col in NUMERIC_COLUMNS & set(df.columns):
+            df['{}100k'.format(col)] = df[col].clip(lower=0) / pop100k
+
+        df = add_avg_columns(df, windows, lengths=lengths)
+        df = date_filter(df, start_date, end_date)
+        if columns is not None:
+            keep = [col for col in df.columns
+                    if col in ('date', 'location')
+                    or col.split('_')[0] in columns]
+            df = df[keep]
+        return df.reset_index(drop=True)
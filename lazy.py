@@ -0,0 +1,29 @@
+"""Deferred imports.
+
+pandas, plotly and requests take most of a second to import, which the CLI
+paid even for `--help` or when nothing needed to be done. Modules import
+them with `LazyModule` instead and they are only loaded on first use:
+
+    pd = lazy.LazyModule('pandas')
+
+Type annotations naming a lazy module need
+`from __future__ import annotations` so they aren't evaluated on import.
+"""
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for the module `name`, imported on first attribute access"""
+
+    def __init__(self, name: str):
+        super(LazyModule, self).__init__(name)
+
+    def __getattr__(self, attr):
+        # only called for attributes which haven't been cached yet
+        value = getattr(importlib.import_module(self.__name__), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name__)
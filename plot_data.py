@@ -1,49 +1,258 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
 import argparse
+import concurrent.futures
+import contextlib
 import functools
+import hashlib
 import logging
+import multiprocessing
 import os.path
 import sys
 from datetime import datetime
-from typing import Iterable
-
-import pandas as pd
-import plotly.express as px
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+import county_tensor
 import data
+import lazy
+import profiling
+import report
+
+np = lazy.LazyModule('numpy')
+pd = lazy.LazyModule('pandas')
+px = lazy.LazyModule('plotly.express')
+importlib_metadata = lazy.LazyModule('importlib.metadata')
+
+
+def use_tracking_data(metric: str) -> bool:
+    return 'test' in metric or 'hospitalization' in metric
 
 
 def update_locations(locations: Iterable[data.Location], metric: str) -> Iterable[data.Location]:
-    use_tracking = 'test' in metric or 'hospitalization' in metric
-    if use_tracking:
-        # exclude any county-level locations
-        return [location.drop_county() for location in locations]
+    if use_tracking_data(metric):
+        # exclude any county-level locations, counties of a state are one
+        return list(dict.fromkeys(location.drop_county()
+                                  for location in locations))
     else:
         return locations
 
 
 @functools.lru_cache(maxsize=None)
-def load_pn_data(metric: str) -> data.PopulationNormalizedData:
-    use_tracking = 'test' in metric or 'hospitalization' in metric
+def load_census_data() -> data.CensusData:
+    """One census table shared by every metric"""
+    return data.CensusData()
+
+
+@functools.lru_cache(maxsize=None)
+def load_location_index() -> data.LocationIndex:
+    """NYTimes counties with a census population, for selectors"""
+    return data.LocationIndex.from_sources(data.nytimes_counties(),
+                                           load_census_data())
 
-    covid_data = data.CovidTrackingData() if use_tracking else data.NyTimesData()
-    census_data = data.CensusData()
+
+def resolve_locations(selectors: Iterable[str]) -> List[data.Location]:
+    """Locations of command line `selectors`, see `data.resolve_locations`.
+
+    The counties are only listed when a selector needs them.
+    """
+    selectors = data.read_selectors(selectors)
+    index = (load_location_index()
+             if any(data.is_pattern(_) for _ in selectors) else None)
+    return data.resolve_locations(selectors, index)
+
+
+@functools.lru_cache(maxsize=None)
+def load_pn_data(metric: str,
+                 locations: Tuple[data.Location, ...] = None,
+                 max_bytes: Optional[int] = None) -> data.PopulationNormalizedData:
+    if use_tracking_data(metric):
+        covid_data = data.CovidTrackingData()
+        # one file per state, fetch them all at once
+        covid_data.prefetch(loc.state or 'USA' for loc in locations or ())
+    else:
+        covid_data = data.NyTimesData(locations, max_bytes=max_bytes)
+    census_data = load_census_data()
     pop_normalized = data.PopulationNormalizedData(covid_data, census_data)
     return pop_normalized
 
 
+@functools.lru_cache(maxsize=None)
+def load_tensor() -> county_tensor.CountyTensor:
+    """Every county, to rank them"""
+    return county_tensor.CountyTensor(data.NyTimesData(), load_census_data())
+
+
+def load_top(metric: str, n: int, windows: List[int], start_date=None,
+             end_date=None) -> Tuple[List[data.Location], pd.DataFrame]:
+    """(locations, `load_df` like frame) of the `n` counties with the
+    highest `metric` averaged over the first of `windows`, on `end_date` or
+    the last day"""
+    tensor = load_tensor()
+    ranking = tensor.top(n, metric, windows[0], end_date)
+    locations = [tensor.location(_) for _ in ranking.index]
+    return locations, tensor.long_df(ranking.index, metric, windows,
+                                     start_date, end_date)
+
+
+def source_check_sum(metric: str, locations: Iterable[data.Location]) -> str:
+    """Fingerprint of the downloads the `metric` figures are made from"""
+    source = data.CovidTrackingData if use_tracking_data(metric) else data.NyTimesData
+    return '{} {}'.format(source.source_check_sum(locations),
+                          data.CensusData.source_check_sum())
+
+
+# options which change what a report shows
+REPORT_OPTIONS = ('metrics', 'windows', 'start', 'end', 'top', 'max_points',
+                  'plotlyjs', 'out_file')
+
+
+def report_check_sums(args: argparse.Namespace,
+                      locations: Iterable[data.Location],
+                      metrics: Iterable[str]) -> str:
+    """The options, locations and data fingerprints a report is made from.
+
+    `locations` are the resolved ones, selectors can match other counties
+    (or files hold other locations) from one run to the next. Only
+    downloads are checked, nothing is parsed (or imports pandas).
+    """
+    options = ' '.join('{}={}'.format(name, getattr(args, name))
+                       for name in REPORT_OPTIONS)
+    resolved = hashlib.md5('\n'.join(
+        str(loc) for loc in locations).encode('utf8')).hexdigest()
+    return '{}\nlocations={}\n'.format(options, resolved) + ''.join(
+        source_check_sum(metric, update_locations(locations, metric)) + "\n"
+        for metric in metrics)
+
+
+def load_df(pop_normalized: data.PopulationNormalizedData,
+            locations: Iterable[data.Location],
+            windows: Iterable[int], start_date=None, end_date=None,
+            metrics: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Every location with the averages for all `windows`
+
+    Only `metrics` (and their averages) are kept when given.
+    """
+    return pop_normalized.build_df_many(locations,
+                                        window=list(windows),
+                                        start_date=start_date,
+                                        end_date=end_date,
+                                        columns=metrics)
+
+
+def _lttb(x: np.ndarray, y: np.ndarray, starts: np.ndarray,
+          lengths: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets of many series stored back to back.
+
+    Series `i` is `x[starts[i]:starts[i] + lengths[i]]` (sorted) and every
+    series is longer than `n_out`. The series are stepped through their
+    buckets together, returns the (series, n_out) indices into `x` kept.
+    """
+    x = np.asarray(x, dtype=float)
+    x = x - x.min()
+    y = np.asarray(y, dtype=float)
+    ends = starts + lengths
+
+    # n_out - 2 buckets between the first and last point of every series
+    edges = starts[:, None] + np.linspace(1, lengths - 1, n_out - 1).T.astype(int)
+    # each bucket is compared against the average of the next one, the
+    # last against the last point
+    avg_starts = edges[:, 1:]
+    avg_stops = np.concatenate([edges[:, 2:], ends[:, None]], axis=1)
+    x_sums = np.concatenate([[0.], x.cumsum()])
+    y_sums = np.concatenate([[0.], y.cumsum()])
+    counts = avg_stops - avg_starts
+    avg_x = (x_sums[avg_stops] - x_sums[avg_starts]) / counts
+    avg_y = (y_sums[avg_stops] - y_sums[avg_starts]) / counts
+
+    out = np.empty((len(starts), n_out), dtype=int)
+    out[:, 0] = starts
+    out[:, -1] = ends - 1
+    rows = np.arange(len(starts))
+    offsets = np.arange(np.diff(edges, axis=1).max())
+    a = starts
+    for i in range(n_out - 2):
+        start = edges[:, i, None]
+        candidates = start + offsets
+        valid = candidates < edges[:, i + 1, None]
+        candidates = np.where(valid, candidates, start)
+        x_a = x[a, None]
+        y_a = y[a, None]
+        area = np.abs((x_a - avg_x[:, i, None]) * (y[candidates] - y_a)
+                      - (x_a - x[candidates]) * (avg_y[:, i, None] - y_a))
+        area[~valid] = -1
+        a = candidates[rows, area.argmax(axis=1)]
+        out[:, i + 1] = a
+    return out
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the `n_out` points Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points are always kept, every bucket in between
+    keeps the point making the largest triangle with the point kept before
+    it and the average of the next bucket. `x` must be sorted.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        raise ValueError("Must keep at least 3 points, got {}".format(n_out))
+    return _lttb(x, y, np.array([0]), np.array([n]), n_out)[0]
+
+
+def downsample(df: pd.DataFrame, y: str, max_points: int,
+               x: str = 'date', by: str = 'location') -> pd.DataFrame:
+    """At most `max_points` rows of each `by` series, chosen by LTTB on `y`
+
+    Series longer than `max_points` lose their missing `y` values.
+    """
+    if max_points < 3:
+        raise ValueError("Must keep at least 3 points, got {}".format(max_points))
+    xs = df[x].to_numpy()
+    if xs.dtype.kind == 'M':
+        xs = xs.astype('datetime64[ns]').astype(np.int64)
+    ys = df[y].to_numpy(dtype=float, na_value=np.nan)
+
+    keep = []
+    long_series = []
+    for positions in df.groupby(by, sort=False).indices.values():
+        if len(positions) > max_points:
+            positions = positions[np.argsort(xs[positions], kind='stable')]
+            positions = positions[~np.isnan(ys[positions])]
+        if len(positions) > max_points:
+            long_series.append(positions)
+        else:
+            keep.append(positions)
+
+    if long_series:
+        # every long series is downsampled in one go
+        positions = np.concatenate(long_series)
+        lengths = np.array([len(_) for _ in long_series])
+        starts = np.concatenate([[0], lengths.cumsum()[:-1]])
+        kept = _lttb(xs[positions], ys[positions], starts, lengths, max_points)
+        keep.append(positions[kept.ravel()])
+    if not keep:
+        return df
+    return df.iloc[np.sort(np.concatenate(keep))]
+
+
+@profiling.profiled('make_figure')
 def make_figure(pop_normalized: data.PopulationNormalizedData,
                 locations: Iterable[data.Location],
-                metric: str, window: int, start_date=None, end_date=None):
-    def load_df(loc):
-        return pop_normalized.build_df(loc,
-                                       window=window,
-                                       start_date=start_date,
-                                       end_date=end_date)
+                metric: str, window: int, start_date=None, end_date=None,
+                df: pd.DataFrame = None, max_points: Optional[int] = None):
+    """`df` from `load_df` is used when given, else it is loaded
 
-    df = pd.concat(map(load_df, locations))
+    With `max_points` each location is downsampled to that many points.
+    """
+    if df is None:
+        df = load_df(pop_normalized, locations, [window],
+                     start_date, end_date, metrics=[metric])
 
-    plot_value = metric if window < 2 else f'{metric}_{window}day-avg'
+    plot_value = data.window_column(metric, window)
+    if max_points:
+        df = downsample(df, plot_value, max_points)
 
     fig = px.line(df,
                   x="date",
@@ -56,6 +265,87 @@ def make_figure(pop_normalized: data.PopulationNormalizedData,
     return fig
 
 
+# metric -> (locations, df) of the figures being rendered, forked workers
+# inherit it instead of loading the data again
+_render_frames = {}
+
+
+def _render(task: Tuple[str, int, Optional[int]]) -> Tuple[str, str, str]:
+    metric, window, max_points = task
+    locations, df = _render_frames[metric]
+    fig = make_figure(pop_normalized=None,
+                      locations=locations,
+                      metric=metric,
+                      window=window,
+                      df=df,
+                      max_points=max_points)
+    return report.render_figure(fig)
+
+
+def _render_in_worker(task):
+    """`_render` plus the spans it recorded, which the parent can't see"""
+    n_spans = len(profiling.spans())
+    rendered = _render(task)
+    return rendered, profiling.spans()[n_spans:]
+
+
+def _render_pooled(executor, tasks):
+    for rendered, spans in executor.map(_render_in_worker, tasks):
+        profiling.extend(spans)
+        yield rendered
+
+
+def render_figures(frames: Dict[str, Tuple[Iterable[data.Location], pd.DataFrame]],
+                   tasks: List[Tuple[str, int, Optional[int]]],
+                   jobs: int = 1) -> Iterator[Tuple[str, str, str]]:
+    """`report.render_figure` of each (metric, window, max_points) task, in order
+
+    With `jobs` > 1 the figures are rendered by forked worker processes
+    which share `frames` with this one.
+    """
+    _render_frames.update(frames)
+    try:
+        if jobs > 1 and len(tasks) > 1:
+            context = multiprocessing.get_context('fork')
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(jobs, len(tasks)),
+                    mp_context=context) as executor:
+                yield from _render_pooled(executor, tasks)
+        else:
+            yield from map(_render, tasks)
+    finally:
+        _render_frames.clear()
+
+
+# bump when figures are rendered differently, so cached ones aren't used
+FRAGMENT_VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def _plotly_version() -> str:
+    # without importing plotly
+    return importlib_metadata.version('plotly')
+
+
+def fragment_key(df: pd.DataFrame, metric: str, window: int,
+                 max_points: Optional[int] = None,
+                 digits: int = report.DEFAULT_DIGITS) -> str:
+    """Fingerprint of exactly the series the figure of `df` plots, and of how
+    it is rendered"""
+    column = data.window_column(metric, window)
+    md5 = hashlib.md5('{} {} {} {} {} {}'.format(
+        FRAGMENT_VERSION, _plotly_version(), metric, window, max_points,
+        digits).encode('utf8'))
+    hashes = pd.util.hash_pandas_object(df[['date', 'location', column]],
+                                        index=False)
+    md5.update(hashes.to_numpy().tobytes())
+    return md5.hexdigest()
+
+
+CHECK_SUM_FILE = os.path.join('/tmp', 'covid_data_checksums')
+# rendered figures of earlier reports
+FRAGMENT_DIR = os.path.join('/tmp', 'covid_report_fragments')
+
 ALLOWED_METRICS = {
     'cases', 'deaths', 'tests', 'hospitalizations',
     'cases100k', 'deaths100k', 'tests100k', 'hospitalizations100k',
@@ -63,21 +353,31 @@ ALLOWED_METRICS = {
 }
 
 
-def main(argv):
+def parse_args(argv: List[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description=argv[0])
     parser.add_argument('locations',
-                        help='County, state (full). e.g. Clark,OH',
+                        help='County, state (full). e.g. Clark,OH. '
+                             'PA:* is every county of a state, *:Orange every '
+                             'county with that name, @FILE reads locations '
+                             'from FILE (one per line)',
                         type=str,
-                        nargs='+'
+                        nargs='*'
+                        )
+    parser.add_argument('--top',
+                        help='plot the N counties with the highest of each '
+                             'metric (averaged over the first window) on the '
+                             'last day, or --end, instead of locations',
+                        type=int,
+                        default=None
                         )
     parser.add_argument('--start',
                         help='start date',
-                        type=pd.to_datetime,
+                        type=str,
                         default=None
                         )
     parser.add_argument('--end',
                         help='end date',
-                        type=pd.to_datetime,
+                        type=str,
                         default=None
                         )
     parser.add_argument('--windows',
@@ -91,23 +391,66 @@ def main(argv):
                         type=str,
                         required=True
                         )
+    parser.add_argument('--max-memory',
+                        help='stream the county data, parsing within about '
+                             'this many MB',
+                        type=int,
+                        default=None
+                        )
+    parser.add_argument('--max-points',
+                        help='downsample each location to at most this many '
+                             'points (at least 3)',
+                        type=int,
+                        default=None
+                        )
+    parser.add_argument('--plotlyjs',
+                        help='include plotly.js in the HTML (inline) or '
+                             'next to it (directory). '
+                             'Allowed: {}'.format(report.PLOTLYJS_MODES),
+                        type=str,
+                        choices=report.PLOTLYJS_MODES,
+                        default='inline'
+                        )
+    parser.add_argument('--jobs',
+                        help='render the figures of the HTML in this many '
+                             'processes',
+                        type=int,
+                        default=1
+                        )
     parser.add_argument('-o', '--out_file',
                         help='write HTML to this file',
                         type=str,
                         default=None
                         )
+    parser.add_argument('--profile',
+                        help='write the time, rows and memory of every stage '
+                             '(json) to this file',
+                        type=str,
+                        default=None
+                        )
+
+    return parser.parse_args(argv[1:])
 
-    args = parser.parse_args(argv[1:])
+
+def main(argv):
+    args = parse_args(argv)
 
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(argv[0])
+    if not args.profile:
+        return make_plots(argv, args)
 
-    locations = set(data.parse_location(_) for _ in args.locations)
-    windows = [int(_.strip()) for _ in args.windows.split(",") if _.strip()]
-    if not windows:
-        raise ValueError("Must supply at least one window")
+    profiling.enable()
+    try:
+        with profiling.span('main'):
+            return make_plots(argv, args)
+    finally:
+        profiling.dump(args.profile)
+        profiling.disable()
+
+
+def _parse_metrics(metrics_arg):
     metrics = []
-    for metric in args.metrics.split(","):
+    for metric in metrics_arg.split(","):
         metric = metric.strip()
         if not metric:
             continue
@@ -118,57 +461,144 @@ def main(argv):
         metrics.append(metric)
     if not metrics:
         raise ValueError("Must supply at least one metric")
-    start_date = args.start
-    end_date = args.end
-    out_file = args.out_file
+    return metrics
 
-    check_sum_file = os.path.join('/tmp', 'covid_data_checksums')
 
-    prev_checksums = None
-    if os.path.exists(check_sum_file):
-        with open(check_sum_file, 'r', encoding='utf8') as ifp:
-            prev_checksums = ifp.read()
+def _check_args(args, locations):
+    """Windows and metrics of `args`, raising ValueError on bad options"""
+    windows = [int(_.strip()) for _ in args.windows.split(",") if _.strip()]
+    if not windows:
+        raise ValueError("Must supply at least one window")
+    metrics = _parse_metrics(args.metrics)
+    if args.top is not None:
+        if locations:
+            raise ValueError("Supply either locations or --top")
+        if args.top < 1:
+            raise ValueError("--top must be at least 1")
+        if args.max_memory:
+            raise ValueError("--top needs every county, drop --max-memory")
+        tracking = [_ for _ in metrics if use_tracking_data(_)]
+        if tracking:
+            raise ValueError("--top ranks counties, which don't have "
+                             "{}".format(tracking))
+    elif not locations:
+        raise ValueError("Must supply at least one location or --top")
+    if args.max_points is not None and args.max_points < 3:
+        raise ValueError("--max-points must be at least 3")
+    return windows, metrics
+
+
+def _load_frames(args, locations, metrics, windows, logger):
+    """metric -> (locations, df) of each metric with data"""
+    # pandas isn't imported until here
+    start_date = pd.to_datetime(args.start) if args.start else None
+    end_date = pd.to_datetime(args.end) if args.end else None
+    max_bytes = args.max_memory * 2 ** 20 if args.max_memory else None
+
+    frames = {}
+    for metric in metrics:
+        if args.top:
+            with profiling.span('top', metric=metric):
+                frames[metric] = load_top(metric, args.top, windows,
+                                          start_date, end_date)
+            continue
+        try:
+            updated_locs = update_locations(locations, metric)
+            with profiling.span('load', metric=metric):
+                pn_data = load_pn_data(metric, tuple(sorted(updated_locs)),
+                                       max_bytes)
+            # all of the windows are averaged in one go
+            with profiling.span('normalize', metric=metric):
+                frames[metric] = (updated_locs,
+                                  load_df(pn_data, updated_locs, windows,
+                                          start_date, end_date, [metric]))
+        except data.DataUnavailableException:
+            logger.exception("Could not make figure. ")
+    return frames
+
+
+def _show_figures(frames, windows, max_points):
+    for metric, (updated_locs, df) in frames.items():
+        for window in windows:
+            make_figure(pop_normalized=None,
+                        locations=updated_locs,
+                        metric=metric,
+                        window=window,
+                        df=df,
+                        max_points=max_points).show()
 
-    current_checksums = ""
+
+def _cached_fragments(fragments, frames, tasks):
+    """Keys of the (metric, window, max_points) `tasks`, and the fragments
+    an earlier report cached for them, None where not cached"""
+    with profiling.span('fragments'):
+        keys = [fragment_key(frames[metric][1], metric, window, max_points)
+                for metric, window, max_points in tasks]
+        return keys, [fragments.get(key) for key in keys]
+
+
+def _write_report(args, frames, metrics, windows, logger):
     header = ' | '.join(
         f'<a href="#{metric}">{metric}</a>'
         for metric in metrics)
     now_str = datetime.now().strftime('%Y-%m-%d %H:%M')
-    html = f'<font size=24>{now_str}</br>{header}</font>'
-    for metric in metrics:
-        html += '<h2 id={}>{}</h2>'.format(metric, metric)
-        for window in windows:
-            try:
-                updated_locs = update_locations(locations, metric)
-                pn_data = load_pn_data(metric)
-                checksum = pn_data.check_sum()
-                current_checksums += checksum + "\n"
-
-                fig = make_figure(pop_normalized=pn_data,
-                                  locations=updated_locs,
-                                  metric=metric,
-                                  window=window,
-                                  start_date=start_date,
-                                  end_date=end_date)
-            except data.DataUnavailableException:
-                logger.exception("Could not make figure. ")
+
+    logger.info("Saving HTML to {}".format(args.out_file))
+    tasks = [(metric, window, args.max_points)
+             for metric in frames for window in windows]
+    # only figures whose series changed since an earlier report are rendered
+    fragments = report.FragmentCache(FRAGMENT_DIR)
+    keys, cached = _cached_fragments(fragments, frames, tasks)
+    dirty = [task for task, fragment in zip(tasks, cached) if fragment is None]
+    logger.info("Rendering {} of {} figures".format(len(dirty), len(tasks)))
+    with profiling.span('report', figures=len(tasks), rendered=len(dirty)), \
+            contextlib.closing(render_figures(frames, dirty, args.jobs)) as rendered, \
+            report.ReportWriter(args.out_file, plotlyjs=args.plotlyjs) as out:
+        figures = zip(keys, cached)
+        out.write(f'<font size=24>{now_str}</br>{header}</font>\n')
+        for metric in metrics:
+            out.write('<h2 id={}>{}</h2>\n'.format(metric, metric))
+            if metric not in frames:
                 continue
+            for _ in windows:
+                key, fragment = next(figures)
+                if fragment is None:
+                    fragment = next(rendered)
+                    fragments.put(key, fragment)
+                out.add_rendered(fragment)
+    fragments.prune()
+
 
-            if out_file:
-                html += fig.to_html(full_html=False)
-            else:
-                fig.show()
+def make_plots(argv, args):
+    logger = logging.getLogger(argv[0])
+
+    with profiling.span('locations'):
+        locations = resolve_locations(args.locations)
+    windows, metrics = _check_args(args, locations)
 
-    if out_file:
+    prev_checksums = None
+    if os.path.exists(CHECK_SUM_FILE):
+        with open(CHECK_SUM_FILE, 'r', encoding='utf8') as ifp:
+            prev_checksums = ifp.read()
+
+    current_checksums = None
+    if args.out_file:
+        # checked before loading any data so there is nothing else to do
+        with profiling.span('checksums'):
+            current_checksums = report_check_sums(args, locations,
+                                                  metrics)
         if current_checksums == prev_checksums:
             logger.warning("Not writing file because data hasn't changed!")
-        else:
-            with open(check_sum_file, 'w', encoding='utf8') as ofp:
-                ofp.write(current_checksums)
+            return
+
+    frames = _load_frames(args, locations, metrics, windows, logger)
+    if not args.out_file:
+        _show_figures(frames, windows, args.max_points)
+        return
 
-            logger.info("Saving HTML to {}".format(out_file))
-            with open(out_file, 'w') as ofp:
-                ofp.write("<html>{}</html>".format(html))
+    _write_report(args, frames, metrics, windows, logger)
+    with open(CHECK_SUM_FILE, 'w', encoding='utf8') as ofp:
+        ofp.write(current_checksums)
 
 
 if __name__ == '__main__':
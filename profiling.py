@@ -0,0 +1,171 @@
+"""Span instrumentation of the pipeline stages.
+
+Stages are wrapped with `span` (or the `profiled` decorator). Nothing is
+recorded until `enable` is called, until then a span costs one global
+lookup. Each recorded span has its wall time, the rows it produced and
+how much the resident memory changed while it ran.
+
+    profiling.enable()
+    ...
+    profiling.dump('profile.json')
+"""
+import functools
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+_spans = None
+_started = 0.
+_local = threading.local()
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def _rss_bytes() -> int:
+    """Current resident set size, 0 where /proc isn't available"""
+    try:
+        with open('/proc/self/statm', 'rb') as ifp:
+            return int(ifp.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def enable():
+    """Start recording spans, dropping any recorded before"""
+    global _spans, _started
+    _started = time.perf_counter()
+    _spans = []
+
+
+def disable():
+    global _spans
+    _spans = None
+
+
+def enabled() -> bool:
+    return _spans is not None
+
+
+def spans() -> list:
+    return list(_spans or ())
+
+
+class _NullSpan(object):
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ('name', 'attrs', 'rows', '_start', '_rss', '_parent')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.rows = None
+
+    def __enter__(self):
+        self._parent = getattr(_local, 'span', None)
+        _local.span = self
+        self._rss = _rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        end = time.perf_counter()
+        _local.span = self._parent
+        recorded = _spans
+        if recorded is None:
+            return False
+        record = {
+            'name': self.name,
+            'parent': self._parent.name if self._parent else None,
+            'start': self._start - _started,
+            'seconds': end - self._start,
+            'rows': self.rows,
+            'rss_delta_bytes': _rss_bytes() - self._rss,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+        }
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        if self.attrs:
+            record['attrs'] = self.attrs
+        # list.append is atomic, spans may end on several threads
+        recorded.append(record)
+        return False
+
+
+def span(name: str, **attrs):
+    """Context manager timing the stage `name`"""
+    if _spans is None:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+
+def extend(records: list):
+    """Add spans recorded elsewhere, e.g. by a worker process"""
+    if _spans is not None:
+        _spans.extend(records)
+
+
+def set_rows(rows: int):
+    """Rows produced by the innermost span running on this thread"""
+    if _spans is None:
+        return
+    current = getattr(_local, 'span', None)
+    if current is not None:
+        current.rows = rows
+
+
+def profiled(name: str):
+    """Decorator recording a span for every call.
+
+    Calls returning a data frame record its number of rows.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _spans is None:
+                return func(*args, **kwargs)
+            with _Span(name, None) as current:
+                result = func(*args, **kwargs)
+                shape = getattr(result, 'shape', None)
+                if shape:
+                    current.rows = shape[0]
+                return result
+        return wrapper
+    return decorator
+
+
+def summary(records: Optional[list] = None) -> dict:
+    """Totals per span name"""
+    totals = {}
+    for record in spans() if records is None else records:
+        total = totals.setdefault(record['name'], {
+            'count': 0, 'seconds': 0., 'rows': 0, 'rss_delta_bytes': 0})
+        total['count'] += 1
+        total['seconds'] += record['seconds']
+        total['rows'] += record['rows'] or 0
+        total['rss_delta_bytes'] += record['rss_delta_bytes']
+    return totals
+
+
+def dump(path):
+    """Write the recorded spans and their summary as json"""
+    records = spans()
+    with open(path, 'w', encoding='utf8') as ofp:
+        json.dump({'spans': records, 'summary': summary(records)}, ofp,
+                  indent=2)
@@ -0,0 +1,318 @@
+"""Writes many plotly figures into one HTML report.
+
+`fig.to_html` embeds plotly.js (~5MB) and the figure template with every
+figure. The report includes plotly.js once, either inline or as a
+`plotly.min.js` next to the report, and each template once. Figure data is
+written as compact JSON: values are rounded, date x values are indices into
+a date axis which is shared by every figure that plots the same dates, and
+constant hover text is a single string. Everything is streamed to a temp
+file which is renamed into place on close.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Optional, Tuple
+
+import download
+import lazy
+import profiling
+
+np = lazy.LazyModule('numpy')
+plotly_json = lazy.LazyModule('plotly.io.json')
+plotly_offline = lazy.LazyModule('plotly.offline')
+
+PLOTLYJS_MODES = ('inline', 'directory')
+PLOTLYJS_FILE = 'plotly.min.js'
+
+# significant digits kept for floating point values
+DEFAULT_DIGITS = 6
+
+# rendered figures kept by a FragmentCache
+MAX_FRAGMENTS = 1000
+
+_RENDER_JS = """
+function renderFigure(id, axis, template, figure) {
+  figure.data.forEach(function (trace) {
+    if (trace.xi !== undefined) {
+      trace.x = trace.xi.map(function (i) { return axis[i]; });
+      delete trace.xi;
+    } else if (trace.x0 !== undefined) {
+      trace.x = axis.slice(trace.x0, trace.x0 + trace.y.length);
+      delete trace.x0;
+    }
+  });
+  figure.layout.template = template;
+  Plotly.newPlot(id, figure.data, figure.layout, {responsive: true});
+}
+"""
+
+
+def round_values(values: np.ndarray, digits: int = DEFAULT_DIGITS) -> list:
+    """`values` rounded to `digits` significant digits, NaN becomes None"""
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub':
+        return values.tolist()
+    values = values.astype(float)
+    finite = np.isfinite(values)
+    rounded = values.copy()
+    nonzero = finite & (values != 0)
+    if nonzero.any():
+        v = values[nonzero]
+        decimals = digits - 1 - np.floor(np.log10(np.abs(v)))
+        # scale by exact powers of ten so the shortest repr stays short
+        scale = 10. ** np.abs(decimals)
+        rounded[nonzero] = np.where(decimals >= 0,
+                                    np.round(v * scale) / scale,
+                                    np.round(v / scale) * scale)
+    if finite.all() and (rounded == np.floor(rounded)).all():
+        return rounded.astype(np.int64).tolist()
+    return [v if ok else None for v, ok in zip(rounded.tolist(), finite)]
+
+
+def _date_strings(dates: np.ndarray) -> list:
+    dates = dates.astype('datetime64[s]')
+    if (dates == dates.astype('datetime64[D]')).all():
+        dates = dates.astype('datetime64[D]')
+    return np.datetime_as_string(dates).tolist()
+
+
+def _is_dates(values) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype.kind == 'M'
+
+
+def compact_figure(fig, digits: int = DEFAULT_DIGITS) -> Tuple[list, dict, dict]:
+    """Split `fig` into (date axis, template, figure json).
+
+    Traces with dates on x reference the date axis with either `x0` (a
+    contiguous run starting at that index) or `xi` (an index per point).
+    """
+    axis = np.array([], dtype='datetime64[s]')
+    for trace in fig.data:
+        x = getattr(trace, 'x', None)
+        if _is_dates(x):
+            axis = np.union1d(axis, x.astype('datetime64[s]'))
+
+    data = []
+    for trace in fig.data:
+        trace_json = trace.to_plotly_json()
+        x = getattr(trace, 'x', None)
+        y = getattr(trace, 'y', None)
+        if y is not None:
+            trace_json['y'] = round_values(y, digits)
+        if _is_dates(x):
+            del trace_json['x']
+            index = np.searchsorted(axis, x.astype('datetime64[s]'))
+            if len(index) and (index == np.arange(index[0], index[0] + len(index))).all():
+                trace_json['x0'] = int(index[0])
+            else:
+                trace_json['xi'] = index.tolist()
+        elif x is not None and np.asarray(x).dtype.kind == 'f':
+            trace_json['x'] = round_values(x, digits)
+
+        hovertext = getattr(trace, 'hovertext', None)
+        if (isinstance(hovertext, np.ndarray) and len(hovertext)
+                and (hovertext == hovertext[0]).all()):
+            trace_json['hovertext'] = hovertext[0]
+        data.append(trace_json)
+
+    layout = fig.layout.to_plotly_json()
+    template = layout.pop('template', {})
+    return _date_strings(axis), template, {'data': data, 'layout': layout}
+
+
+def _to_json(obj) -> str:
+    # safe to put inside a <script> element
+    return plotly_json.to_json_plotly(obj).replace('</', '<\\/')
+
+
+@profiling.profiled('report.render')
+def render_figure(fig, digits: int = DEFAULT_DIGITS) -> Tuple[str, str, str]:
+    """(axis, template, figure) json of `fig`, see `ReportWriter.add_rendered`
+
+    This is the expensive part of adding a figure, it can be done in
+    another process.
+    """
+    axis, template, figure = compact_figure(fig, digits)
+    return _to_json(axis), _to_json(template), _to_json(figure)
+
+
+class ReportWriter(object):
+    """Streams an HTML report of plotly figures to `path`
+
+    Nothing is visible at `path` until `close`, a report which is
+    abandoned (e.g. by an exception inside `with`) is discarded.
+    """
+
+    def __init__(self, path, plotlyjs: str = 'inline',
+                 digits: int = DEFAULT_DIGITS, title: Optional[str] = None):
+        if plotlyjs not in PLOTLYJS_MODES:
+            raise ValueError("Unknown plotlyjs mode {}\n"
+                             "Allowed: {}".format(plotlyjs, PLOTLYJS_MODES))
+        self.path = path
+        self.digits = digits
+        self.n_figures = 0
+        self._axes = {}
+        self._templates = {}
+
+        out_dir = os.path.dirname(os.path.abspath(path))
+        self._tmp_path = path + '.part'
+        self._ofp = open(self._tmp_path, 'w', encoding='utf8')
+
+        self.write(_page_start(title))
+        if plotlyjs == 'inline':
+            self.write('<script type="text/javascript">')
+            self.write(plotly_offline.get_plotlyjs())
+            self.write('</script>\n')
+        else:
+            _write_plotlyjs(out_dir)
+            self.write('<script src="{}"></script>\n'.format(PLOTLYJS_FILE))
+        self.write('<script type="text/javascript">{}</script>\n'.format(_RENDER_JS))
+        self.write('</head>\n<body>\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, html: str):
+        self._ofp.write(html)
+
+    def _var(self, registry: dict, prefix: str, value_json: str) -> str:
+        """Name of a js variable holding `value_json`, declared on first use"""
+        name = registry.get(value_json)
+        if name is None:
+            name = '{}{}'.format(prefix, len(registry))
+            registry[value_json] = name
+            self.write('<script type="text/javascript">var {} = {};</script>\n'
+                       .format(name, value_json))
+        return name
+
+    def add_figure(self, fig) -> str:
+        """Append `fig`, returns the id of its div"""
+        return self.add_rendered(render_figure(fig, self.digits))
+
+    @profiling.profiled('report.write')
+    def add_rendered(self, rendered: Tuple[str, str, str]) -> str:
+        """Append a figure from `render_figure`, returns the id of its div"""
+        axis, template, figure = rendered
+        axis_var = self._var(self._axes, 'reportAxis', axis)
+        template_var = self._var(self._templates, 'reportTemplate', template)
+
+        div_id = 'figure-{}'.format(self.n_figures)
+        self.n_figures += 1
+        self.write(_figure_html(div_id, axis_var, template_var, figure))
+        return div_id
+
+    def close(self):
+        """Finish the document and move it to `path`"""
+        if self._ofp is None:
+            return
+        self.write('</body>\n</html>\n')
+        self._ofp.close()
+        self._ofp = None
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        if self._ofp is None:
+            return
+        self._ofp.close()
+        self._ofp = None
+        os.unlink(self._tmp_path)
+
+
+class FragmentCache(object):
+    """Figures rendered by `render_figure`, stored on disk by key.
+
+    A regenerated report takes the figures whose key (a fingerprint of the
+    series they plot) didn't change from here instead of rendering them
+    again. The `max_fragments` most recently used are kept by `prune`.
+    """
+
+    def __init__(self, directory, max_fragments: int = MAX_FRAGMENTS):
+        self.directory = directory
+        self.max_fragments = max_fragments
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key: str) -> Optional[Tuple[str, str, str]]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf8') as ifp:
+                rendered = tuple(json.load(ifp))
+            # marks it as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rendered
+
+    def put(self, key: str, rendered: Tuple[str, str, str]):
+        os.makedirs(self.directory, exist_ok=True)
+        download.atomic_write_json(self._path(key), list(rendered))
+
+    def prune(self):
+        """Delete all but the `max_fragments` most recently used"""
+        if not os.path.isdir(self.directory):
+            return
+        paths = [os.path.join(self.directory, _)
+                 for _ in os.listdir(self.directory) if _.endswith('.json')]
+        if len(paths) <= self.max_fragments:
+            return
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.max_fragments:]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def _page_start(title: Optional[str]) -> str:
+    html = '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+    if title:
+        html += '<title>{}</title>\n'.format(title)
+    return html
+
+
+def _figure_html(div_id, axis, template, figure) -> str:
+    """Div of a figure and the script rendering it, the arguments are js"""
+    return ('<div id="{}" class="plotly-graph-div" '
+            'style="height:100%; width:100%;"></div>\n'
+            '<script type="text/javascript">'
+            'renderFigure("{}", {}, {}, {});</script>\n'
+            .format(div_id, div_id, axis, template, figure))
+
+
+def figure_page(rendered: Tuple[str, str, str],
+                plotlyjs_src: str = PLOTLYJS_FILE,
+                title: Optional[str] = None) -> str:
+    """HTML page of one figure from `render_figure`, plotly.js is loaded
+    from `plotlyjs_src`"""
+    axis, template, figure = rendered
+    return (_page_start(title)
+            + '<script src="{}"></script>\n'.format(plotlyjs_src)
+            + '<script type="text/javascript">{}</script>\n'.format(_RENDER_JS)
+            + '</head>\n<body>\n'
+            + _figure_html('figure-0', axis, template, figure)
+            + '</body>\n</html>\n')
+
+
+def _write_plotlyjs(out_dir):
+    """Put the plotly.js bundle next to the report, once per version"""
+    bundle = plotly_offline.get_plotlyjs().encode('utf8')
+    path = os.path.join(out_dir, PLOTLYJS_FILE)
+    if os.path.exists(path) and os.path.getsize(path) == len(bundle):
+        with open(path, 'rb') as ifp:
+            if ifp.read() == bundle:
+                return
+    with open(path + '.part', 'wb') as ofp:
+        ofp.write(bundle)
+    os.replace(path + '.part', path)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Serves figures and data from datasets kept in memory.
+
+    ./server.py --port 8050
+
+`/figure?locations=Allegheny,PA;PA&metric=cases100k&window=7` is an HTML
+page of one figure and `/data` (same parameters) the JSON of the series it
+plots. Locations are separated by ';' and may be selectors like `PA:*`
+(every county of Pennsylvania), `start`, `end` and `max_points` are
+optional. `/status` describes the loaded data.
+
+Requests are answered from a `Snapshot` of the NYTimes, CovidTracking and
+census data which is never modified once loaded. A background thread checks
+the downloads every `--refresh` seconds and when one of them changed loads a
+new snapshot and swaps it in. Requests never wait for a reload, the ones in
+flight finish with the snapshot they started with.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import data
+import lazy
+import plot_data
+import report
+
+pd = lazy.LazyModule('pandas')
+plotly_offline = lazy.LazyModule('plotly.offline')
+
+DEFAULT_PORT = 8050
+DEFAULT_REFRESH_SECONDS = 3600
+
+# every CovidTracking download, the nation and each state
+TRACKING_LOCATIONS = [data.Location('USA', None, None)] + [
+    data.Location('USA', state, None) for state in sorted(data.STATE_ABV_MAP)]
+
+logger = logging.getLogger(__name__)
+
+
+def source_fingerprints() -> Dict[str, str]:
+    """Fingerprints of every download, refreshing the stale ones"""
+    return {
+        'nytimes': data.NyTimesData.source_check_sum(()),
+        'covidtracking': data.CovidTrackingData.source_check_sum(
+            TRACKING_LOCATIONS),
+        'census': data.CensusData.source_check_sum(),
+    }
+
+
+class Snapshot(object):
+    """Every data source loaded in full, only read once built"""
+
+    def __init__(self, fingerprints: Dict[str, str],
+                 cache_bytes: int = data.DEFAULT_CACHE_BYTES):
+        """`fingerprints` of the downloads, taken before loading them"""
+        self.fingerprints = fingerprints
+        self.loaded_at = time.time()
+        census = data.CensusData()
+        tracking = data.CovidTrackingData()
+        tracking.prefetch(['USA'] + sorted(data.STATE_ABV_MAP))
+        tracking.freeze()
+        nytimes = data.NyTimesData()
+        self.index = data.LocationIndex.from_sources(nytimes.counties(),
+                                                     census)
+        self.counties = data.PopulationNormalizedData(nytimes, census,
+                                                      cache_bytes)
+        self.tracking = data.PopulationNormalizedData(
+            tracking, census, cache_bytes)
+
+    def pop_normalized(self, metric: str) -> data.PopulationNormalizedData:
+        if plot_data.use_tracking_data(metric):
+            return self.tracking
+        return self.counties
+
+
+class DatasetStore(object):
+    """Holds the current `Snapshot`, replacing it when the downloads change"""
+
+    def __init__(self, refresh_seconds: float = DEFAULT_REFRESH_SECONDS,
+                 cache_bytes: int = data.DEFAULT_CACHE_BYTES):
+        self.refresh_seconds = refresh_seconds
+        self.cache_bytes = cache_bytes
+        self.refreshes = 0
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.snapshot = Snapshot(source_fingerprints(), cache_bytes)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Load a new snapshot if any download changed (or `force`),
+        returns whether it was swapped in"""
+        with self._refresh_lock:
+            fingerprints = source_fingerprints()
+            if not force and fingerprints == self.snapshot.fingerprints:
+                return False
+            snapshot = Snapshot(fingerprints, self.cache_bytes)
+            # one reference assignment, a reader sees the old or new snapshot
+            self.snapshot = snapshot
+            self.refreshes += 1
+            logger.info("Loaded new data {}".format(fingerprints))
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refresh failed, keeping the loaded data")
+
+    def start(self):
+        """Refresh every `refresh_seconds` in a background thread"""
+        self._thread = threading.Thread(target=self._run, name='refresh',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _param(params: dict, name: str, default: Optional[str] = None) -> str:
+    values = params.get(name)
+    if not values:
+        if default is None:
+            raise ValueError("Missing parameter {}".format(name))
+        return default
+    if len(values) > 1:
+        raise ValueError("Parameter {} given more than once".format(name))
+    return values[0]
+
+
+class Query(object):
+    """Parameters of a /figure or /data request"""
+
+    def __init__(self, query_string: str,
+                 index: Optional[data.LocationIndex] = None):
+        """Selectors in `locations` are resolved against `index`"""
+        params = parse_qs(query_string)
+        self.metric = _param(params, 'metric')
+        if self.metric not in plot_data.ALLOWED_METRICS:
+            raise ValueError("Unknown metric {}\n"
+                             "Allowed: {}".format(self.metric,
+                                                  plot_data.ALLOWED_METRICS))
+        # no @FILE selectors, those would read files of the server
+        locations = data.resolve_locations(
+            [_ for value in params.get('locations', ())
+             for _ in value.split(';') if _.strip()], index)
+        if not locations:
+            raise ValueError("Must supply at least one location")
+        self.locations = list(plot_data.update_locations(locations,
+                                                         self.metric))
+        self.window = int(_param(params, 'window', '7'))
+        if self.window < 1:
+            raise ValueError("window must be at least 1")
+        self.max_points = int(_param(params, 'max_points', '0')) or None
+        if self.max_points is not None and self.max_points < 3:
+            raise ValueError("max_points must be at least 3")
+        start, end = _param(params, 'start', ''), _param(params, 'end', '')
+        self.start_date = pd.to_datetime(start) if start else None
+        self.end_date = pd.to_datetime(end) if end else None
+
+    @property
+    def column(self) -> str:
+        return data.window_column(self.metric, self.window)
+
+    def load_df(self, snapshot: Snapshot) -> pd.DataFrame:
+        return plot_data.load_df(snapshot.pop_normalized(self.metric),
+                                 self.locations, [self.window],
+                                 self.start_date, self.end_date,
+                                 metrics=[self.metric])
+
+
+def figure_html(snapshot: Snapshot, query: Query) -> str:
+    fig = plot_data.make_figure(None, query.locations, query.metric,
+                                query.window, df=query.load_df(snapshot),
+                                max_points=query.max_points)
+    return report.figure_page(report.render_figure(fig),
+                              plotlyjs_src='/' + report.PLOTLYJS_FILE,
+                              title=query.column)
+
+
+def data_json(snapshot: Snapshot, query: Query) -> str:
+    df = query.load_df(snapshot)
+    column = query.column
+    series = []
+    for location, group in df.groupby('location', sort=False):
+        series.append({
+            'location': location,
+            'dates': group['date'].dt.strftime('%Y-%m-%d').tolist(),
+            'values': report.round_values(group[column].to_numpy()),
+        })
+    return json.dumps({'metric': query.metric, 'window': query.window,
+                       'column': column, 'series': series})
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive, every response has a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        store = self.server.store
+        # one snapshot for the whole request even if a refresh swaps it
+        snapshot = store.snapshot
+        try:
+            if url.path == '/figure':
+                self._send(200, 'text/html; charset=utf-8',
+                           figure_html(snapshot,
+                                       Query(url.query, snapshot.index)))
+            elif url.path == '/data':
+                self._send(200, 'application/json',
+                           data_json(snapshot,
+                                     Query(url.query, snapshot.index)))
+            elif url.path == '/status':
+                self._send(200, 'application/json', json.dumps({
+                    'loaded_at': snapshot.loaded_at,
+                    'fingerprints': snapshot.fingerprints,
+                    'refreshes': store.refreshes,
+                    'counties': len(snapshot.index),
+                }))
+            elif url.path == '/' + report.PLOTLYJS_FILE:
+                self._send(200, 'application/javascript', _plotlyjs(),
+                           cache_seconds=86400)
+            else:
+                self._send_error(404, "Not found {}".format(url.path))
+        except (ValueError, data.UnknownStateError) as e:
+            self._send_error(400, str(e))
+        except data.DataUnavailableException as e:
+            self._send_error(404, "No data {}".format(e))
+        except Exception as e:
+            logger.exception("Failed {}".format(self.path))
+            self._send_error(500, repr(e))
+
+    def _send(self, status: int, content_type: str, body,
+              cache_seconds: int = 0):
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if cache_seconds:
+            self.send_header('Cache-Control',
+                             'max-age={}'.format(cache_seconds))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self._send(status, 'application/json',
+                   json.dumps({'error': message}))
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+_plotlyjs_bundle = None
+
+
+def _plotlyjs() -> bytes:
+    global _plotlyjs_bundle
+    if _plotlyjs_bundle is None:
+        _plotlyjs_bundle = plotly_offline.get_plotlyjs().encode('utf8')
+    return _plotlyjs_bundle
+
+
+def make_server(store: DatasetStore, host: str = '127.0.0.1',
+                port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Server answering from `store`, port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=argv[0])
+    parser.add_argument('--host',
+                        help='address to listen on',
+                        type=str,
+                        default='127.0.0.1'
+                        )
+    parser.add_argument('--port',
+                        help='port to listen on',
+                        type=int,
+                        default=DEFAULT_PORT
+                        )
+    parser.add_argument('--refresh',
+                        help='seconds between checks for new data',
+                        type=float,
+                        default=DEFAULT_REFRESH_SECONDS
+                        )
+    parser.add_argument('--max-memory',
+                        help='MB of built frames cached per data source',
+                        type=int,
+                        default=None
+                        )
+    args = parser.parse_args(argv[1:])
+    logging.basicConfig(level=logging.INFO)
+
+    cache_bytes = (args.max_memory * 2 ** 20 if args.max_memory
+                   else data.DEFAULT_CACHE_BYTES)
+    store = DatasetStore(args.refresh, cache_bytes)
+    store.start()
+    server = make_server(store, args.host, args.port)
+    logger.info("Serving on http://{}:{}".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        store.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
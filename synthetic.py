@@ -0,0 +1,138 @@
+"""Synthetic data shaped like the real downloads, at any scale.
+
+`write_dataset` lays out the NYTimes, CovidTracking and census files where
+`data` looks for them and records them as fresh downloads, so every data
+source loads offline:
+
+    data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(root, 3200, 300)
+"""
+import os
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+import data
+import download
+
+FIRST_DATE = '2020-01-21'
+
+
+def _states(n_counties):
+    states = sorted(data.STATE_ABV_MAP)
+    return [states[i % len(states)] for i in range(n_counties)]
+
+
+def _daily_counts(rng, n_days, n_columns, lam=5):
+    """(cases, deaths) per day and column, growing over time"""
+    growth = np.linspace(0.2, 2, n_days)[:, None]
+    cases = rng.poisson(lam * growth, size=(n_days, n_columns))
+    deaths = rng.binomial(cases, 0.02)
+    return cases, deaths
+
+
+def write_nytimes_csv(path, n_counties=3200, n_days=300, seed=0):
+    """Write a csv shaped like nytimes us-counties.csv"""
+    rng = np.random.default_rng(seed)
+    counties = ['County {}'.format(i) for i in range(n_counties)]
+
+    dates = pd.date_range(FIRST_DATE, periods=n_days, freq='D')
+    new_cases, new_deaths = _daily_counts(rng, n_days, n_counties)
+    df = pd.DataFrame({
+        'date': np.repeat(dates, n_counties),
+        'county': np.tile(counties, n_days),
+        'state': np.tile(_states(n_counties), n_days),
+        'fips': np.tile(np.arange(n_counties) + 1000, n_days),
+        'cases': new_cases.cumsum(axis=0).ravel(),
+        'deaths': new_deaths.cumsum(axis=0).ravel(),
+    })
+    df.to_csv(path, index=False, date_format='%Y-%m-%d')
+    return path
+
+
+def write_census_csv(path, n_counties=3200, seed=0):
+    """Write a csv shaped like the census co-est2019-alldata.csv, with the
+    counties of `write_nytimes_csv`"""
+    rng = np.random.default_rng(seed)
+    counties = pd.DataFrame({
+        'SUMLEV': 50,
+        'STNAME': _states(n_counties),
+        'CTYNAME': ['County {} County'.format(i) for i in range(n_counties)],
+        'POPESTIMATE2019': rng.integers(1000, 1000000, n_counties),
+    })
+    states = (counties.groupby('STNAME', as_index=False)['POPESTIMATE2019']
+              .sum().assign(SUMLEV=40))
+    states['CTYNAME'] = states['STNAME']
+    df = pd.concat([states, counties], ignore_index=True)
+    df.insert(1, 'REGION', 1)
+    df.sort_values(['STNAME', 'SUMLEV'], kind='stable', inplace=True)
+    df.to_csv(path, index=False, encoding='latin-1')
+    return path
+
+
+def covidtracking_df(n_days=300, state='XX', seed=0) -> pd.DataFrame:
+    """Frame shaped like a CovidTracking daily.csv, newest first"""
+    rng = np.random.default_rng(seed)
+    cases, deaths = _daily_counts(rng, n_days, 1, lam=500)
+    tests = cases * 10 + rng.poisson(1000, size=cases.shape)
+    hospitalizations = rng.binomial(cases, 0.1)
+    dates = pd.date_range(FIRST_DATE, periods=n_days, freq='D')
+    df = pd.DataFrame({
+        'date': dates.strftime('%Y%m%d').astype(int),
+        'state': state,
+        'positive': cases.cumsum(),
+        'totalTestResults': tests.cumsum(),
+        'positiveIncrease': cases.ravel(),
+        'totalTestResultsIncrease': tests.ravel(),
+        'deathIncrease': deaths.ravel(),
+        'hospitalizedIncrease': hospitalizations.ravel(),
+    })
+    return df.iloc[::-1]
+
+
+def write_covidtracking_csvs(n_days=300, seed=0):
+    """Write the daily.csv of every state and the nation into `data.DATA_DIR`"""
+    frames = []
+    for i, state in enumerate(sorted(data.ABV_STATE_MAP)):
+        df = covidtracking_df(n_days, state, seed + i)
+        _write_download(df, data._csv_path('covidtracking', state),
+                        data._covidtracking_url(state.lower()))
+        frames.append(df)
+
+    numeric = frames[0].columns.drop(['date', 'state'])
+    usa = pd.concat(frames).groupby('date', sort=False)[numeric].sum()
+    _write_download(usa.reset_index(), data._csv_path('covidtracking', 'usa'),
+                    data._covidtracking_url('usa'))
+
+
+def _write_download(df: pd.DataFrame, path, url):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False)
+    download.mark_downloaded(url, path)
+
+
+def write_dataset(root, n_counties=3200, n_days=300,
+                  seed=0) -> Tuple[str, str]:
+    """Write every data source under `root`, returns (data dir, census dir)
+
+    The files are recorded as fresh downloads of the real urls.
+    """
+    data_dir = os.path.join(root, 'covid-testing')
+    census_dir = os.path.join(root, 'us-census')
+    prev_dirs = data.DATA_DIR, data.CENSUS_DIR
+    data.DATA_DIR, data.CENSUS_DIR = data_dir, census_dir
+    try:
+        csv_path = data._csv_path('nytimes', 'us-counties')
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+        write_nytimes_csv(csv_path, n_counties, n_days, seed)
+        download.mark_downloaded(data.NYTIMES_URL, csv_path)
+
+        write_covidtracking_csvs(n_days, seed)
+
+        census_path = data._census_csv_path()
+        os.makedirs(census_dir, exist_ok=True)
+        write_census_csv(census_path, n_counties, seed)
+        download.mark_downloaded(data.CENSUS_URL, census_path)
+    finally:
+        data.DATA_DIR, data.CENSUS_DIR = prev_dirs
+    return data_dir, census_dir
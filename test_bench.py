@@ -0,0 +1,35 @@
+import unittest
+
+import bench
+
+
+class SuiteTest(unittest.TestCase):
+    def test_suite(self):
+        result = bench.bench_suite(60, 30, repeat=1)
+        self.assertEqual((result['counties'], result['days']), (60, 30))
+        self.assertIn('build_df', result['seconds'])
+        self.assertFalse(bench.find_regressions(result, result))
+
+    def test_server_latency(self):
+        result = bench.bench_server_latency(60, 30, n_requests=20, clients=2,
+                                            n_queries=4)
+        self.assertEqual(result['all']['count'], 20)
+        self.assertEqual(result['/data']['count'], 10)
+        self.assertLessEqual(result['all']['p50_ms'], result['all']['p99_ms'])
+
+    def test_regressions(self):
+        baseline = {'counties': 10, 'days': 5,
+                    'seconds': {'load': 1., 'tiny': 0.001, 'build': 1.}}
+        result = {'counties': 10, 'days': 5,
+                  'seconds': {'load': 1.2, 'tiny': 0.005, 'build': 2.,
+                              'new': 5.}}
+        regressions = bench.find_regressions(result, baseline, tolerance=0.25)
+        self.assertEqual(list(regressions), ['build'])
+        self.assertEqual(regressions['build']['ratio'], 2.)
+
+        with self.assertRaises(ValueError):
+            bench.find_regressions(dict(result, days=6), baseline)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import county_tensor
+import data
+import download
+import synthetic
+
+
+def _correct_cases(county, day, correction):
+    """Revise the cumulative cases of `county` down by `correction` from
+    `day` on, like the NYTimes does after a recount"""
+    csv_path = data._csv_path('nytimes', 'us-counties')
+    df = pd.read_csv(csv_path)
+    dates = pd.to_datetime(df.date)
+    corrected = (df.county == county) & (
+        dates >= pd.Timestamp(synthetic.FIRST_DATE) + pd.Timedelta(days=day))
+    df.loc[corrected, 'cases'] -= correction
+    df.to_csv(csv_path, index=False)
+    download.mark_downloaded(data.NYTIMES_URL, csv_path)
+
+
+class CountyTensorTest(unittest.TestCase):
+    """CountyTensor against build_df_many over a synthetic dataset"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.prev = data.DATA_DIR, data.CENSUS_DIR
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            cls.tmp_dir.name, n_counties=120, n_days=60)
+        _correct_cases('County 0', 40, 100)
+        cls.nytimes = data.NyTimesData()
+        cls.census = data.CensusData()
+        cls.tensor = county_tensor.CountyTensor(cls.nytimes, cls.census)
+        cls.normalized = data.PopulationNormalizedData(cls.nytimes, cls.census)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        data.DATA_DIR, data.CENSUS_DIR = cls.prev
+        cls.tmp_dir.cleanup()
+
+    def every_county(self, metric, window, date=None):
+        """`metric` of every county on `date` the slow way, by location"""
+        locations = [self.tensor.location(_) for _ in range(len(self.tensor))]
+        df = self.normalized.build_df_many(locations, [window],
+                                           columns=[metric])
+        date = self.tensor.dates[-1] if date is None else pd.Timestamp(date)
+        column = '{}_{}day-avg'.format(metric, window)
+        return df[df.date == date].set_index('location')[column]
+
+    def test_shape(self):
+        self.assertEqual(self.tensor.values.shape, (120, 60, 2))
+        self.assertEqual(len(self.tensor.dates), 60)
+        self.assertFalse(np.isnan(self.tensor.population).any())
+
+    def test_long_df(self):
+        index = [0, 17, 95]
+        start = pd.Timestamp('2020-02-01')
+        locations = [self.tensor.location(_) for _ in index]
+        for metric in ('cases', 'deaths100k'):
+            expected = self.normalized.build_df_many(
+                locations, [1, 7, 14], start_date=start, columns=[metric])
+            pd.testing.assert_frame_equal(
+                self.tensor.long_df(index, metric, [1, 7, 14], start),
+                expected, check_dtype=False, rtol=1e-9)
+
+    def test_top_bottom(self):
+        date = '2020-03-01'
+        expected = self.every_county('cases100k', 7, date).sort_values()
+        top = self.tensor.top(10, 'cases100k', 7, date)
+        self.assertEqual(list(top.location), list(expected.index[::-1][:10]))
+        np.testing.assert_allclose(top['cases100k_7day-avg'],
+                                   expected.values[::-1][:10], rtol=1e-9)
+        bottom = self.tensor.bottom(5, 'cases100k', 7, date)
+        self.assertEqual(list(bottom.location), list(expected.index[:5]))
+
+        # the index is where the counties are in the tensor
+        self.assertEqual(
+            [str(self.tensor.location(_)) for _ in top.index],
+            [str(data.Location('USA', state, county))
+             for state, county in zip(top.state, top.county)])
+        self.assertEqual(len(self.tensor.top(1000, 'cases', 7)), 120)
+
+    def test_threshold(self):
+        expected = self.every_county('cases100k', 14)
+        # cut between values so rounding can't move a county across
+        values = np.unique(expected)
+        low = (values[10] + values[11]) / 2
+        high = (values[-11] + values[-10]) / 2
+        above = self.tensor.threshold('cases100k', 14, above=low)
+        self.assertEqual(set(above.location),
+                         set(expected[expected >= low].index))
+        self.assertTrue(above['cases100k_14day-avg'].is_monotonic_decreasing)
+        between = self.tensor.threshold('cases100k', 14, above=low,
+                                        below=high)
+        self.assertEqual(
+            set(between.location),
+            set(expected[(expected >= low) & (expected <= high)].index))
+
+    def test_corrections(self):
+        i = list(self.tensor.counties).index('County 0')
+        label = data.location_label('USA', self.tensor.states[i], 'County 0')
+        date = self.tensor.dates[40]
+        self.assertLess(self.tensor.values[i, 40, 0], 0)
+        # negative deltas count as 0 per 100k, like build_df_many
+        self.assertEqual(self.tensor.values_on('cases100k', 1, date)[i], 0)
+        zero = self.tensor.threshold('cases100k', 1, date, below=0)
+        self.assertIn(label, list(zero.location))
+        np.testing.assert_allclose(
+            self.tensor.values_on('cases100k', 3, self.tensor.dates[41])[i],
+            self.every_county('cases100k', 3, self.tensor.dates[41])[label],
+            rtol=1e-9)
+        self.assertGreaterEqual(
+            self.tensor.long_df([i], 'cases100k', [7])['cases100k'].min(), 0)
+
+    def test_window_before_data(self):
+        # fewer days than the window, nothing to rank
+        self.assertTrue(self.tensor.top(5, 'cases', 7, '2020-01-23').empty)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.tensor.top(5, 'tests100k', 7)
+        with self.assertRaises(ValueError):
+            self.tensor.top(5, 'cases', 7, '2019-01-01')
+        partial = data.NyTimesData([data.parse_location('PA')])
+        with self.assertRaises(data.DataUnavailableException):
+            county_tensor.CountyTensor(partial, self.census)
+
+
+if __name__ == '__main__':
+    unittest.main()
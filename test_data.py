@@ -1,8 +1,16 @@
+import os
+import pickle
+import shutil
+import tempfile
+import time
 import unittest
+from unittest import mock
 
+import numpy as np
 import pandas as pd
 
 import data
+from test_download import FakeServer
 
 # there are required, but may be null
 _required_columns = {
@@ -156,5 +164,588 @@ class TestPopulationNormalizedData(unittest.TestCase):
         self.assertFalse(xx.empty)
 
 
+class AvgColumnsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.df = pd.DataFrame({
+            'date': pd.date_range('2020-03-01', periods=30),
+            'state': 'Ohio',
+            'cases': [float(_ % 7) for _ in range(30)],
+            'tests': [10. + _ for _ in range(30)],
+        })
+        self.df.loc[12, 'cases'] = float('nan')
+
+    def test_matches_rolling(self):
+        df = data.add_avg_columns(self.df, [3, 7])
+        for window in (3, 7):
+            roller = self.df[['cases', 'tests']].rolling(window)
+            means = roller.mean()
+            for col in ('cases', 'tests'):
+                pd.testing.assert_series_equal(
+                    df['{}_{}day-avg'.format(col, window)], means[col],
+                    check_names=False)
+            sums = roller.sum()
+            pd.testing.assert_series_equal(
+                df['positive-test-rate_{}day-avg'.format(window)],
+                sums.cases / sums.tests, check_names=False)
+
+    def test_single_window(self):
+        df = data.add_avg_columns(self.df, 7)
+        self.assertIn('cases_7day-avg', df.columns)
+        self.assertNotIn('cases_3day-avg', df.columns)
+
+        raw = data.add_avg_columns(self.df, 1)
+        self.assertEqual(list(raw.columns),
+                         list(self.df.columns) + ['positive-test-rate'])
+
+    def test_lengths(self):
+        other = self.df.iloc[:10].assign(state='Iowa')
+        both = pd.concat([self.df, other], ignore_index=True)
+        df = data.add_avg_columns(both, [3, 7], lengths=[30, 10])
+        expected = pd.concat([data.add_avg_columns(self.df, [3, 7]),
+                              data.add_avg_columns(other, [3, 7])],
+                             ignore_index=True)
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_tests_only(self):
+        # e.g. only what tests100k needs, there is no positive test rate
+        df = data.add_avg_columns(self.df.drop(columns='cases'), [1, 7])
+        self.assertIn('tests_7day-avg', df.columns)
+        self.assertFalse([_ for _ in df.columns if 'positive' in _])
+
+
+def covidtracking_csv(n_days=10):
+    """Bytes shaped like a covidtracking daily.csv"""
+    rows = []
+    for day, date in enumerate(pd.date_range('2020-03-01', periods=n_days)):
+        rows.append('{},XX,{},{},{},{}'.format(
+            date.strftime('%Y-%m-%d'), day, 10 * day, day // 5, day // 2))
+    # newest first, like the real thing
+    header = ('date,state,positiveIncrease,totalTestResultsIncrease,'
+              'deathIncrease,hospitalizedIncrease')
+    return '\n'.join([header] + rows[::-1] + ['']).encode()
+
+
+class CovidTrackingPrefetchTest(unittest.TestCase):
+    states = ['PA', 'OH', 'CA', 'NY', 'TX', 'FL', 'WA', 'CT']
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = data.DATA_DIR
+        data.DATA_DIR = self.tmp_dir.name
+        self.server = FakeServer(body=covidtracking_csv(), latency=0.2)
+        self.data = data.CovidTrackingData(base_url=self.server.base_url(),
+                                           max_workers=len(self.states))
+
+    def tearDown(self) -> None:
+        data.DATA_DIR = self.data_dir
+        self.server.close()
+        self.tmp_dir.cleanup()
+
+    def test_prefetch(self):
+        start = time.perf_counter()
+        self.data.prefetch(self.states + ['USA'])
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(self.server.requests), len(self.states) + 1)
+        # sequentially this would take at least 9 x latency
+        self.assertLess(elapsed, 4 * self.server.httpd.latency)
+
+        # parsed frames are re-used
+        pa = self.data.get_state_data('Pennsylvania').get_df()
+        self.assertEqual(len(self.server.requests), len(self.states) + 1)
+        self.assertEqual(set(pa.state), {'Pennsylvania'})
+        self.assertTrue(pa.date.is_monotonic_increasing)
+        self.assertEqual(set(self.data.get_state_data('OH').get_df().state),
+                         {'Ohio'})
+
+
+def write_counties_csv(path, n_days=5, offset=0):
+    """Write a tiny csv shaped like nytimes us-counties.csv"""
+    counties = [('Allegheny', 'Pennsylvania'), ('Erie', 'Pennsylvania'),
+                ('Clark', 'Ohio'), ('Contra Costa', 'California')]
+    rows = []
+    for day, date in enumerate(pd.date_range('2020-03-01', periods=n_days)):
+        for i, (county, state) in enumerate(counties):
+            rows.append((date.strftime('%Y-%m-%d'), county, state, i,
+                         (i + 1) * (day + 1) + offset, day))
+    df = pd.DataFrame(rows, columns=['date', 'county', 'state', 'fips',
+                                     'cases', 'deaths'])
+    df.to_csv(path, index=False)
+    return path
+
+
+def write_census_csv(path):
+    """Write a tiny csv shaped like the census co-est2019-alldata.csv"""
+    rows = [(40, 'Pennsylvania', 'Pennsylvania', 3000),
+            (50, 'Pennsylvania', 'Allegheny County', 1000),
+            (50, 'Pennsylvania', 'Erie County', 2000),
+            (40, 'Ohio', 'Ohio', 500),
+            (50, 'Ohio', 'Clark County', 500),
+            (40, 'California', 'California', 4000),
+            (50, 'California', 'Contra Costa County', 4000)]
+    df = pd.DataFrame(rows, columns=['SUMLEV', 'STNAME', 'CTYNAME',
+                                     'POPESTIMATE2019'])
+    df.to_csv(path, index=False, encoding='latin-1')
+    return path
+
+
+class CensusCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = write_census_csv(
+            os.path.join(self.tmp_dir.name, 'census.csv'))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_population(self):
+        census = data.CensusData(csv_path=self.csv_path)
+        self.assertEqual(set(census.df.county),
+                         {'Allegheny', 'Erie', 'Clark', 'Contra Costa'})
+        for location, population in (('Allegheny,PA', 1000),
+                                     ('PA', 3000), ('USA', 7500)):
+            loc = data.parse_location(location)
+            self.assertEqual(census.get_population(loc), population)
+            self.assertEqual(census.build_df(loc).population.sum(),
+                             population)
+        with self.assertRaises(data.DataUnavailableException):
+            census.get_population(data.parse_location('Clark,PA'))
+
+    def test_cached(self):
+        first = data.CensusData(csv_path=self.csv_path)
+        self.assertTrue(os.path.exists(self.csv_path + '.parquet'))
+        # the totals are read back, not recomputed
+        with mock.patch('data._census_totals') as totals:
+            second = data.CensusData(csv_path=self.csv_path)
+        totals.assert_not_called()
+        pd.testing.assert_frame_equal(first.df, second.df)
+        for name in ('_county_population', '_county_count',
+                     '_state_population', '_national_population'):
+            self.assertEqual(getattr(first, name), getattr(second, name))
+        self.assertEqual(second.get_population(data.parse_location('PA')),
+                         3000)
+
+        write_census_csv(self.csv_path)
+        with open(self.csv_path, 'a') as ofp:
+            ofp.write('50,Ohio,Erie County,100\n')
+        self.assertEqual(len(data.CensusData(csv_path=self.csv_path).df), 5)
+
+
+class LocationTest(unittest.TestCase):
+    def test_value(self):
+        pa = data.parse_location('Allegheny,PA')
+        self.assertIs(pa, data.Location('USA', 'Pennsylvania', 'Allegheny'))
+        self.assertIs(pa, data.parse_location('Allegheny, pa'))
+        self.assertEqual(pa.state, 'Pennsylvania')
+        self.assertEqual(str(pa), 'USA,Pennsylvania,Allegheny')
+        self.assertEqual(len({pa, data.parse_location('Allegheny,PA'),
+                              data.parse_location('Allegheny,Pennsylvania')}),
+                         1)
+        self.assertIs(pa.drop_county(), data.parse_location('PA'))
+        self.assertNotEqual(pa, pa.drop_county())
+        self.assertIs(pickle.loads(pickle.dumps(pa)), pa)
+        with self.assertRaises(AttributeError):
+            pa.county = 'Erie'
+
+
+class SelectorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = data.LocationIndex([
+            ('Pennsylvania', 'Allegheny'), ('Pennsylvania', 'Erie'),
+            ('Ohio', 'Erie'), ('Ohio', 'Clark'), ('California', 'Orange'),
+            ('Florida', 'Orange')])
+
+    def names(self, locations):
+        return [str(_) for _ in locations]
+
+    def test_resolve(self):
+        resolve = data.resolve_locations
+        self.assertEqual(self.names(resolve(['PA:*'], self.index)),
+                         ['USA,Pennsylvania,Allegheny',
+                          'USA,Pennsylvania,Erie'])
+        self.assertEqual(self.names(resolve(['*:orange'], self.index)),
+                         ['USA,California,Orange', 'USA,Florida,Orange'])
+        self.assertEqual(len(resolve(['*:*'], self.index)), 6)
+        # in order, without duplicates
+        self.assertEqual(self.names(resolve(
+            ['OH', 'Erie,PA', '*:Erie', 'Ohio:erie', 'OH'], self.index)),
+            ['USA,Ohio', 'USA,Pennsylvania,Erie', 'USA,Ohio,Erie'])
+
+        for selector in ('PA:Orange', 'XX:*', '*:Nowhere', '@file'):
+            with self.assertRaises(ValueError):
+                resolve([selector], self.index)
+        with self.assertRaises(ValueError):
+            resolve(['PA:*'])
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inner = os.path.join(tmp_dir, 'inner.txt')
+            outer = os.path.join(tmp_dir, 'outer.txt')
+            with open(inner, 'w') as ofp:
+                ofp.write('*:Orange\n')
+            with open(outer, 'w') as ofp:
+                ofp.write('# counties\nClark,OH\n\n  @{}\n'.format(inner))
+            selectors = data.read_selectors(['PA', '@' + outer])
+            self.assertEqual(selectors, ['PA', 'Clark,OH', '*:Orange'])
+            self.assertEqual(len(data.resolve_locations(selectors,
+                                                        self.index)), 4)
+
+            with open(inner, 'a') as ofp:
+                ofp.write('@{}\n'.format(outer))
+            with self.assertRaises(ValueError):
+                data.read_selectors(['@' + outer])
+
+    def test_from_sources(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            census = data.CensusData(csv_path=write_census_csv(
+                os.path.join(tmp_dir, 'census.csv')))
+            # Clark,PA isn't in the census
+            index = data.LocationIndex.from_sources(
+                [('Pennsylvania', 'Erie'), ('Pennsylvania', 'Clark'),
+                 ('Ohio', 'Clark')], census)
+        self.assertEqual(self.names(index.counties),
+                         ['USA,Ohio,Clark', 'USA,Pennsylvania,Erie'])
+
+
+class FrameCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        csv_path = write_counties_csv(
+            os.path.join(self.tmp_dir.name, 'daily.csv'), n_days=20)
+        census_path = write_census_csv(
+            os.path.join(self.tmp_dir.name, 'census.csv'))
+        self.normalized = data.PopulationNormalizedData(
+            data.NyTimesData(csv_path=csv_path),
+            data.CensusData(csv_path=census_path))
+        self.location = data.parse_location('Allegheny,PA')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_hit(self):
+        first = self.normalized.build_df(self.location, 7)
+        second = self.normalized.build_df(self.location, [7])
+        cache = self.normalized.cache
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        pd.testing.assert_frame_equal(first, second)
+        self.assertIn('cases100k_7day-avg', first.columns)
+
+        self.normalized.build_df(self.location, 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_protected(self):
+        df = self.normalized.build_df(self.location, 7)
+        df['cases'] = -1
+        data.add_location_info(df, 'USA', 'Ohio', 'Clark')
+        again = self.normalized.build_df(self.location, 7)
+        self.assertTrue((again.cases >= 0).all())
+        self.assertEqual(set(again.county), {'Allegheny'})
+
+    def test_budget(self):
+        self.normalized.build_df(self.location, 7)
+        one_frame = self.normalized.cache.current_bytes
+        self.normalized.cache.max_bytes = one_frame
+
+        self.normalized.build_df(data.parse_location('Erie,PA'), 7)
+        cache = self.normalized.cache
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.current_bytes, one_frame)
+
+
+class BuildDfManyTest(FrameCacheTest):
+    def test_matches_build_df(self):
+        locations = [data.parse_location(_)
+                     for _ in ('Allegheny,PA', 'PA', 'Clark,OH', 'USA')]
+        start = pd.to_datetime('2020-03-05')
+        df = self.normalized.build_df_many(locations, [1, 7], start)
+        self.assertEqual(list(df.location.unique()),
+                         ['Allegheny Pennsylvania USA', 'Pennsylvania USA',
+                          'Clark Ohio USA', 'USA'])
+        for loc in locations:
+            expected = self.normalized.build_df(loc, [1, 7], start)
+            got = df[df.location == expected.location.iloc[0]]
+            np.testing.assert_array_equal(got.date.to_numpy(),
+                                          expected.date.to_numpy())
+            # prefix sums of the other locations shift the rounding
+            for col in ('cases100k', 'cases_7day-avg', 'deaths100k_7day-avg'):
+                np.testing.assert_allclose(got[col].to_numpy(dtype=float),
+                                           expected[col].to_numpy(dtype=float),
+                                           rtol=1e-9)
+
+    def test_columns(self):
+        locations = [data.parse_location('Allegheny,PA'),
+                     data.parse_location('Clark,OH')]
+        df = self.normalized.build_df_many(locations, [3, 7],
+                                           columns=['cases100k'])
+        self.assertEqual(list(df.columns),
+                         ['date', 'location', 'cases100k',
+                          'cases100k_3day-avg', 'cases100k_7day-avg'])
+        self.assertEqual(len(df), 40)
+
+        again = self.normalized.build_df_many(locations, [3, 7],
+                                              columns=['cases100k'])
+        self.assertEqual(self.normalized.cache.hits, 1)
+        pd.testing.assert_frame_equal(df, again)
+
+    def test_daily_many(self):
+        # one take per frame gives what slicing every location does
+        nytimes = self.normalized.covid_data
+        locations = [data.parse_location(_) for _ in
+                     ('Clark,OH', 'PA', 'Allegheny,PA', 'USA', 'Erie,PA')]
+        for columns in (None, {'cases'}):
+            df, labels, lengths = nytimes.get_daily_many(locations, columns)
+            expected = data.NationalData.get_daily_many(nytimes, locations,
+                                                        columns)
+            pd.testing.assert_frame_equal(df, expected[0])
+            self.assertEqual(labels, expected[1])
+            np.testing.assert_array_equal(lengths, expected[2])
+        with self.assertRaises(ValueError):
+            nytimes.get_daily_many([data.parse_location('Nowhere,PA')])
+
+    def test_requirements(self):
+        self.assertIsNone(data.metric_requirements(None))
+        self.assertEqual(data.metric_requirements(
+            ['cases100k', 'deaths', 'positive-test-rate']),
+            {'cases', 'deaths', 'tests'})
+
+
+class ColumnarCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = write_counties_csv(
+            os.path.join(self.tmp_dir.name, 'daily.csv'))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_matches_csv(self):
+        expected = pd.read_csv(self.csv_path, parse_dates=['date'],
+                               usecols=data.NYTIMES_COLUMNS)
+        cold = data._load_nytimes_df(self.csv_path)
+        warm = data._load_nytimes_df(self.csv_path)
+        for df in (cold, warm):
+            self.assertEqual(list(df.columns), data.NYTIMES_COLUMNS)
+            self.assertEqual(len(df), len(expected))
+            self.assertEqual(df.cases.sum(), expected.cases.sum())
+
+    def test_pushdown(self):
+        df = data._load_nytimes_df(self.csv_path,
+                                   columns=['date', 'state', 'cases'],
+                                   states={'Pennsylvania'})
+        self.assertEqual(list(df.columns), ['date', 'state', 'cases'])
+        self.assertEqual(set(df.state), {'Pennsylvania'})
+        self.assertEqual(len(df), 10)
+
+    def test_rebuilt_after_download(self):
+        data._load_nytimes_df(self.csv_path)
+        write_counties_csv(self.csv_path, n_days=6)
+        os.utime(self.csv_path, ns=(0, 0))
+        self.assertEqual(len(data._load_nytimes_df(self.csv_path)), 24)
+
+    def test_incremental(self):
+        data._load_nytimes_df(self.csv_path)
+        write_counties_csv(self.csv_path, n_days=7)
+        df = data._load_nytimes_df(self.csv_path)
+
+        cache_dir = data._columnar_cache_dir(self.csv_path)
+        self.assertEqual(data._read_ingest_meta(cache_dir)['parts'], 2)
+        self.assertEqual(len(df), 28)
+        for _, group in df.groupby('state'):
+            self.assertTrue(group.date.is_monotonic_increasing)
+
+    def test_history_rewritten(self):
+        data._load_nytimes_df(self.csv_path)
+        write_counties_csv(self.csv_path, n_days=7, offset=1)
+        df = data._load_nytimes_df(self.csv_path)
+
+        cache_dir = data._columnar_cache_dir(self.csv_path)
+        self.assertEqual(data._read_ingest_meta(cache_dir)['parts'], 1)
+        self.assertEqual(df.cases.min(), 2)
+        self.assertEqual(len(df), 28)
+
+    def test_index(self):
+        nytimes = data.NyTimesData(csv_path=self.csv_path)
+        pa = nytimes.get_state_data('PA')
+        self.assertEqual(set(pa.df.state), {'Pennsylvania'})
+        self.assertEqual(len(pa.df), 5)
+        self.assertEqual(len(pa.county_df), 10)
+
+        erie = pa.get_county_data('Erie')
+        self.assertEqual(set(erie.df.county), {'Erie'})
+        self.assertTrue(erie.df.date.is_monotonic_increasing)
+        self.assertEqual(len(erie.df), 5)
+
+        with self.assertRaises(ValueError):
+            pa.get_county_data('Clark')
+
+    def test_compact(self):
+        compact = data.NyTimesData(csv_path=self.csv_path)
+        wide = data.NyTimesData(csv_path=self.csv_path, compact=False)
+        self.assertLess(compact.df.memory_usage(deep=True).sum(),
+                        wide.df.memory_usage(deep=True).sum())
+
+        def sources(nytimes):
+            pa = nytimes.get_state_data('PA')
+            return nytimes, pa, pa.get_county_data('Erie')
+
+        for small, big in zip(sources(compact), sources(wide)):
+            small_df, big_df = small.get_df(), big.get_df()
+            self.assertEqual(list(small_df.date), list(big_df.date))
+            self.assertEqual(list(small_df.cases), list(big_df.cases))
+
+        start, end = pd.Timestamp('2020-03-02'), pd.Timestamp('2020-03-03')
+        filtered = data.date_filter(compact.df, start, end)
+        self.assertEqual(len(filtered), 8)
+        self.assertEqual(len(data.convert_to_deltas(filtered)), 2)
+
+    def test_streaming(self):
+        full = data.NyTimesData(csv_path=self.csv_path)
+        # tiny chunks so counties span several of them
+        data.MIN_CHUNK_ROWS, min_rows = 3, data.MIN_CHUNK_ROWS
+        try:
+            streamed = data.NyTimesData(
+                locations=[data.parse_location('Erie,PA')],
+                csv_path=self.csv_path, max_bytes=1)
+        finally:
+            data.MIN_CHUNK_ROWS = min_rows
+
+        self.assertEqual(set(streamed.df.state), {'Pennsylvania'})
+        for a, b in ((full, streamed),
+                     (full.get_state_data('PA'), streamed.get_state_data('PA')),
+                     (full.get_state_data('PA').get_county_data('Erie'),
+                      streamed.get_state_data('PA').get_county_data('Erie'))):
+            pd.testing.assert_frame_equal(
+                a.get_df().reset_index(drop=True),
+                b.get_df().reset_index(drop=True), check_dtype=False)
+        with self.assertRaises(data.DataUnavailableException):
+            streamed.get_state_data('OH')
+
+    def test_requirements(self):
+        # states and the nation come from the rollups
+        columns, states = data._nytimes_requirements(
+            [data.parse_location('PA'), data.parse_location('Clark,OH')])
+        self.assertEqual(states, {'Ohio'})
+        self.assertIn('county', columns)
+
+        columns, states = data._nytimes_requirements(
+            [data.parse_location('PA'), data.parse_location('USA')])
+        self.assertEqual(states, set())
+        self.assertIsNone(data._nytimes_requirements(None)[1])
+
+    def test_rollups(self):
+        full = data.NyTimesData(csv_path=self.csv_path)
+        rollups = data.NyTimesData(
+            locations=[data.parse_location('USA'), data.parse_location('PA')],
+            csv_path=self.csv_path)
+        # no county rows were read
+        self.assertEqual(len(rollups.df), 0)
+        for a, b in ((full, rollups),
+                     (full.get_state_data('PA'), rollups.get_state_data('PA')),
+                     (full.get_state_data('OH'), rollups.get_state_data('OH'))):
+            pd.testing.assert_frame_equal(a.get_df(), b.get_df())
+        with self.assertRaises(data.DataUnavailableException):
+            rollups.get_state_data('PA').get_county_data('Erie')
+
+    def test_counties(self):
+        self.assertEqual(sorted(data.nytimes_counties(self.csv_path)),
+                         [('California', 'Contra Costa'),
+                          ('Ohio', 'Clark'), ('Pennsylvania', 'Allegheny'),
+                          ('Pennsylvania', 'Erie')])
+        nytimes = data.NyTimesData(csv_path=self.csv_path)
+        self.assertEqual(sorted(nytimes.counties()),
+                         sorted(data.nytimes_counties(self.csv_path)))
+
+    def test_rollups_incremental(self):
+        data._load_nytimes_df(self.csv_path)
+        write_counties_csv(self.csv_path, n_days=7)
+        # a county first reported on a day which was already ingested
+        with open(self.csv_path, 'a') as ofp:
+            ofp.write('2020-03-07,Butler,Pennsylvania,9,4,1\n')
+        state_df, national_df = data._load_nytimes_rollups(self.csv_path)
+        cache_dir = data._columnar_cache_dir(self.csv_path)
+        self.assertEqual(data._read_ingest_meta(cache_dir)['parts'], 2)
+
+        shutil.rmtree(cache_dir)
+        rebuilt_state_df, rebuilt_national_df = data._load_nytimes_rollups(
+            self.csv_path)
+        pd.testing.assert_frame_equal(state_df, rebuilt_state_df)
+        pd.testing.assert_frame_equal(national_df, rebuilt_national_df)
+        self.assertEqual(national_df.cases.sum(), 7 * 10 + 4)
+
+    def test_rollups_interrupted(self):
+        data._load_nytimes_df(self.csv_path)
+        # three more days, the ingest dies before its meta is written
+        write_counties_csv(self.csv_path, n_days=8)
+        cache_dir = data._columnar_cache_dir(self.csv_path)
+        meta_path = data._ingest_meta_path(cache_dir)
+        write_json = data.download.atomic_write_json
+
+        def crash(path, obj):
+            if path == meta_path:
+                raise KeyboardInterrupt
+            write_json(path, obj)
+
+        with mock.patch('download.atomic_write_json', crash):
+            with self.assertRaises(KeyboardInterrupt):
+                data._load_nytimes_rollups(self.csv_path)
+        self.assertEqual(data._read_ingest_meta(cache_dir)['parts'], 1)
+
+        # ingested again from the rollups the meta still names
+        state_df, national_df = data._load_nytimes_rollups(self.csv_path)
+        meta = data._read_ingest_meta(cache_dir)
+        self.assertEqual((meta['parts'], meta['rollup_generation']), (2, 1))
+        self.assertEqual(sorted(_ for _ in os.listdir(cache_dir)
+                                if _.startswith('_state_daily')),
+                         ['_state_daily-1.parquet'])
+        # the appended rows were written once
+        keys = ['state', 'county', 'date']
+        pd.testing.assert_frame_equal(
+            data._load_nytimes_df(self.csv_path).sort_values(
+                keys, ignore_index=True),
+            data._parse_nytimes_csv(self.csv_path)[data.NYTIMES_COLUMNS]
+            .sort_values(keys, ignore_index=True), check_dtype=False)
+
+        shutil.rmtree(cache_dir)
+        rebuilt_state_df, rebuilt_national_df = data._load_nytimes_rollups(
+            self.csv_path)
+        pd.testing.assert_frame_equal(state_df, rebuilt_state_df)
+        pd.testing.assert_frame_equal(national_df, rebuilt_national_df)
+
+    def test_deltas(self):
+        nytimes = data.NyTimesData(csv_path=self.csv_path)
+        raw = pd.read_csv(self.csv_path, parse_dates=['date'])
+
+        def assert_deltas(df, raw_df):
+            expected = data.convert_to_deltas(raw_df)
+            self.assertEqual(list(df.date), list(expected.date))
+            self.assertEqual(list(df.cases), list(expected.cases))
+            self.assertEqual(list(df.deaths), list(expected.deaths))
+
+        assert_deltas(nytimes.get_df(), raw)
+        pa = nytimes.get_state_data('PA')
+        assert_deltas(pa.get_df(), raw[raw.state == 'Pennsylvania'])
+        assert_deltas(pa.get_county_data('Erie').get_df(),
+                      raw[raw.county == 'Erie'])
+        # the first day is diffed against zeros
+        self.assertEqual(pa.get_county_data('Erie').get_df().cases.iloc[0], 2)
+
+    def test_blank_counts(self):
+        # the feed leaves some deaths blank, e.g. Puerto Rico "Unknown"
+        raw = pd.read_csv(self.csv_path)
+        raw['deaths'] = raw['deaths'].astype(float)
+        raw.loc[(raw.county == 'Erie') & (raw.date == '2020-03-03'),
+                'deaths'] = np.nan
+        raw.to_csv(self.csv_path, index=False)
+        self.test_deltas()
+
+        erie = (data.NyTimesData(csv_path=self.csv_path)
+                .get_state_data('PA').get_county_data('Erie').get_avg_df(3))
+        self.assertFalse(erie['deaths_3day-avg'].iloc[2:].isna().any())
+        streamed = data.NyTimesData(csv_path=self.csv_path, max_bytes=1)
+        pd.testing.assert_frame_equal(
+            streamed.get_df(),
+            data.NyTimesData(csv_path=self.csv_path).get_df())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,220 @@
+import gzip
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import download
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves `server.bodies` (else `server.body`) honoring If-None-Match,
+    gzip encoded with `server.gzip`. The next `server.not_modified`
+    requests are answered 304 whatever they ask, like a confused proxy"""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        time.sleep(server.latency)
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+
+        body = server.bodies.get(self.path, server.body)
+        etag = '"{}"'.format(hash(body))
+        if server.not_modified:
+            server.not_modified -= 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if server.gzip:
+            # members are compressed separately, like appended gzip files
+            body = b''.join(gzip.compress(_, mtime=0)
+                            for _ in body.splitlines(keepends=True))
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(object):
+    def __init__(self, body=b'', bodies=None, latency=0.):
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     _Handler)
+        self.httpd.body = body
+        self.httpd.bodies = bodies or {}
+        self.httpd.latency = latency
+        self.httpd.gzip = False
+        self.httpd.not_modified = 0
+        self.httpd.requests = []
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def url(self, path='/daily.csv'):
+        return 'http://127.0.0.1:{}{}'.format(self.httpd.server_port, path)
+
+    def base_url(self):
+        return self.url('')
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FetchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'source', 'daily.csv')
+        self.server = FakeServer(b'date,cases\n2020-03-01,1\n')
+
+    def tearDown(self) -> None:
+        self.server.close()
+        self.tmp_dir.cleanup()
+
+    def read(self):
+        with open(self.path, 'rb') as ifp:
+            return ifp.read()
+
+    def test_fresh_within_ttl(self):
+        download.fetch(self.server.url(), self.path, ttl=60)
+        download.fetch(self.server.url(), self.path, ttl=60)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.read(), self.server.httpd.body)
+
+    def test_conditional_get(self):
+        download.fetch(self.server.url(), self.path, ttl=0)
+        mtime = os.stat(self.path).st_mtime_ns
+
+        download.fetch(self.server.url(), self.path, ttl=0)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('If-None-Match', self.server.requests[1])
+        # not modified so the file wasn't touched
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+        self.server.httpd.body += b'2020-03-02,3\n'
+        download.fetch(self.server.url(), self.path, ttl=0)
+        self.assertEqual(self.read(), self.server.httpd.body)
+
+    def test_cache_forever(self):
+        download.fetch(self.server.url(), self.path, ttl=None)
+        download.fetch(self.server.url(), self.path, ttl=None)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_new_url(self):
+        download.fetch(self.server.url(), self.path, ttl=None)
+        download.fetch(self.server.url('/other.csv'), self.path, ttl=None)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertNotIn('If-None-Match', self.server.requests[1])
+
+    def test_concurrent(self):
+        self.server.httpd.body = b'x' * (3 * download.CHUNK_SIZE)
+        threads = [threading.Thread(target=download.fetch,
+                                    args=(self.server.url(), self.path, 60))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the lock makes everyone after the first see a fresh file
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.read(), self.server.httpd.body)
+        leftovers = [_ for _ in os.listdir(os.path.dirname(self.path))
+                     if _.startswith('.')]
+        self.assertFalse(leftovers)
+
+    def test_fingerprint(self):
+        download.fetch(self.server.url(), self.path, ttl=0)
+        expected = hashlib.md5(self.server.httpd.body).hexdigest()
+        self.assertEqual(download.fingerprint(self.path), expected)
+
+        # a 304 keeps the fingerprint of what is on disk
+        download.fetch(self.server.url(), self.path, ttl=0)
+        self.assertEqual(download.read_meta(self.path)['md5'], expected)
+
+        os.unlink(self.path + '.meta.json')
+        self.assertEqual(download.fingerprint(self.path), expected)
+
+    def test_compressed(self):
+        path = self.path + download.GZIP_SUFFIX
+        body = self.server.httpd.body
+        for encoded in (False, True):
+            self.server.httpd.gzip = encoded
+            download.fetch(self.server.url(), path, ttl=0)
+            with open(path, 'rb') as ifp:
+                self.assertEqual(gzip.decompress(ifp.read()), body)
+            with download.open_file(path) as ifp:
+                self.assertEqual(ifp.read(), body)
+            self.assertEqual(download.fingerprint(path),
+                             hashlib.md5(body).hexdigest())
+            self.assertEqual(download.content_size(path), len(body))
+            self.server.httpd.body = body = body + b'2020-03-02,3\n'
+
+        os.unlink(path + '.meta.json')
+        self.assertEqual(download.content_size(path), len(body) - 13)
+
+    def test_not_modified_without_validators(self):
+        self.server.httpd.not_modified = 1
+        download.fetch(self.server.url(), self.path, ttl=0)
+        self.assertEqual(self.read(), self.server.httpd.body)
+        self.assertEqual(self.server.requests[1].get('Cache-Control'),
+                         'no-cache')
+
+        os.unlink(self.path + '.meta.json')
+        self.server.httpd.not_modified = 2
+        with self.assertRaises(download.requests.HTTPError):
+            download.fetch(self.server.url(), self.path, ttl=0)
+        self.assertIsNone(download.read_meta(self.path))
+
+    def test_error(self):
+        with self.assertRaises(download.requests.HTTPError):
+            download.fetch(self.server.url('/missing'), self.path)
+
+
+class _FakeMsvcrt(object):
+    """msvcrt.locking which times out once before locking"""
+    LK_LOCK, LK_UNLCK = 1, 0
+
+    def __init__(self):
+        self.calls = []
+
+    def locking(self, fd, mode, n_bytes):
+        self.calls.append((os.lseek(fd, 0, os.SEEK_CUR), mode, n_bytes))
+        if len(self.calls) == 1:
+            raise OSError('Resource deadlock avoided')
+
+
+class FileLockTest(unittest.TestCase):
+    def test_without_fcntl(self):
+        msvcrt = _FakeMsvcrt()
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(download, 'fcntl', None), \
+                mock.patch.object(download, 'msvcrt', msvcrt):
+            with download.FileLock(os.path.join(tmp_dir, 'lock')) as lock:
+                os.write(lock._fd, b'x')
+        self.assertEqual(msvcrt.calls, [(0, msvcrt.LK_LOCK, 1),
+                                        (0, msvcrt.LK_LOCK, 1),
+                                        (0, msvcrt.LK_UNLCK, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import data
+import download
+import plot_data
+import synthetic
+
+
+def location_df(n_days=1000, locations=('Allegheny, PA', 'Clark, OH')):
+    rng = np.random.default_rng(0)
+    frames = []
+    for location in locations:
+        dates = pd.date_range('2020-03-01', periods=n_days)
+        cases = np.sin(np.arange(n_days) / 50) * 100 + rng.random(n_days)
+        frames.append(pd.DataFrame({'date': dates,
+                                    'location': location,
+                                    'cases_7day-avg': cases}))
+    df = pd.concat(frames, ignore_index=True)
+    # the first days of a rolling average are missing
+    df.loc[df.index[:6], 'cases_7day-avg'] = np.nan
+    return df
+
+
+class DownsampleTest(unittest.TestCase):
+    def test_lttb(self):
+        x = np.arange(100, dtype=float)
+        y = np.zeros(100)
+        y[37] = 10.
+        y[80] = -5.
+        index = plot_data.lttb_indices(x, y, 10)
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index[0], 0)
+        self.assertEqual(index[-1], 99)
+        self.assertTrue((np.diff(index) > 0).all())
+        # the spikes survive
+        self.assertIn(37, index)
+        self.assertIn(80, index)
+
+        np.testing.assert_array_equal(plot_data.lttb_indices(x, y, 100),
+                                      np.arange(100))
+        with self.assertRaises(ValueError):
+            plot_data.lttb_indices(x, y, 2)
+
+    def test_downsample(self):
+        df = location_df()
+        small = plot_data.downsample(df, 'cases_7day-avg', 100)
+        counts = small.groupby('location').size()
+        self.assertEqual(counts.to_dict(),
+                         {'Allegheny, PA': 100, 'Clark, OH': 100})
+        self.assertFalse(small['cases_7day-avg'].isna().any())
+        for _, group in small.groupby('location'):
+            self.assertTrue(group.date.is_monotonic_increasing)
+            self.assertEqual(group.date.iloc[-1], df.date.iloc[-1])
+        # the shape is still there, up to the noise
+        self.assertAlmostEqual(small['cases_7day-avg'].max(),
+                               df['cases_7day-avg'].max(), delta=1)
+        self.assertAlmostEqual(small['cases_7day-avg'].min(),
+                               df['cases_7day-avg'].min(), delta=1)
+
+        # short series are left alone
+        pd.testing.assert_frame_equal(
+            plot_data.downsample(df, 'cases_7day-avg', 1000), df)
+
+    def test_make_figure(self):
+        fig = plot_data.make_figure(None, None, 'cases', 7,
+                                    df=location_df(), max_points=50)
+        self.assertEqual([len(trace.y) for trace in fig.data], [50, 50])
+
+
+class RenderFiguresTest(unittest.TestCase):
+    def test_jobs(self):
+        frames = {
+            'cases': (None, location_df(n_days=100)),
+            'deaths': (None, location_df(
+                n_days=50, locations=('PA',)).rename(
+                    columns={'cases_7day-avg': 'deaths_7day-avg'})),
+        }
+        tasks = [(metric, 7, max_points)
+                 for metric in frames for max_points in (None, 20)]
+        serial = list(plot_data.render_figures(frames, tasks, jobs=1))
+        self.assertEqual(len(serial), 4)
+        self.assertEqual(list(plot_data.render_figures(frames, tasks, jobs=3)),
+                         serial)
+        # the frames aren't kept around after rendering
+        self.assertFalse(plot_data._render_frames)
+
+
+class MainTest(unittest.TestCase):
+    """plot_data.main against a synthetic dataset"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.prev = (data.DATA_DIR, data.CENSUS_DIR, plot_data.CHECK_SUM_FILE,
+                    plot_data.FRAGMENT_DIR)
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            cls.tmp_dir.name, n_counties=120, n_days=60)
+        plot_data.CHECK_SUM_FILE = os.path.join(cls.tmp_dir.name, 'checksums')
+        plot_data.FRAGMENT_DIR = os.path.join(cls.tmp_dir.name, 'fragments')
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        (data.DATA_DIR, data.CENSUS_DIR, plot_data.CHECK_SUM_FILE,
+         plot_data.FRAGMENT_DIR) = cls.prev
+        cls.tmp_dir.cleanup()
+
+    def setUp(self) -> None:
+        plot_data.load_pn_data.cache_clear()
+        plot_data.load_census_data.cache_clear()
+        if os.path.exists(plot_data.CHECK_SUM_FILE):
+            os.unlink(plot_data.CHECK_SUM_FILE)
+        shutil.rmtree(plot_data.FRAGMENT_DIR, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def run_main(self, *args):
+        county = 'County {},OH'.format(sorted(data.STATE_ABV_MAP).index('Ohio'))
+        argv = ['plot_data.py', county, 'PA', '--windows=1,7',
+                '--metrics=cases100k,positive-test-rate',
+                '-o', self.path('out.html')] + list(args)
+        plot_data.main(argv)
+
+    def test_report(self):
+        self.run_main()
+        with open(self.path('out.html')) as ifp:
+            html = ifp.read()
+        # 2 metrics x 2 windows
+        self.assertEqual(html.count('<div id="figure-'), 4)
+
+    def test_profile(self):
+        self.run_main('--profile', self.path('profile.json'))
+        with open(self.path('profile.json')) as ifp:
+            profile = json.load(ifp)
+        names = {_['name'] for _ in profile['spans']}
+        for name in ('main', 'checksums', 'download', 'load', 'nytimes.load',
+                     'nytimes.parse', 'covidtracking.load', 'census.load',
+                     'build_df_many', 'add_avg_columns', 'make_figure',
+                     'report.render', 'report.write'):
+            self.assertIn(name, names)
+        span = next(_ for _ in profile['spans'] if _['name'] == 'nytimes.load')
+        self.assertEqual(span['parent'], 'load')
+        # only the counties of Ohio are loaded, Pennsylvania is a rollup
+        self.assertEqual(span['rows'], 2 * 60)
+        self.assertIn('rss_delta_bytes', span)
+        self.assertEqual(profile['summary']['make_figure']['count'], 4)
+        self.assertFalse(plot_data.profiling.enabled())
+
+    def test_profile_jobs(self):
+        self.run_main('--jobs', '2', '--profile', self.path('profile.json'))
+        with open(self.path('profile.json')) as ifp:
+            profile = json.load(ifp)
+        renders = [_ for _ in profile['spans'] if _['name'] == 'report.render']
+        self.assertEqual(len(renders), 4)
+        self.assertNotIn(os.getpid(), {_['pid'] for _ in renders})
+
+    def read_figures(self):
+        with open(self.path('out.html')) as ifp:
+            html = ifp.read()
+        # everything but the time it was written
+        return html[html.index('<h2 id='):]
+
+    def test_fragments(self):
+        self.run_main()
+        html = self.read_figures()
+
+        # new CovidTracking numbers for Ohio, nothing else changed
+        csv_path = data._csv_path('covidtracking', 'OH')
+        shutil.copy(csv_path, self.path('oh.csv'))
+        synthetic.covidtracking_df(60, 'OH', seed=99).to_csv(csv_path,
+                                                             index=False)
+        download.mark_downloaded(data._covidtracking_url('oh'), csv_path)
+        try:
+            plot_data.load_pn_data.cache_clear()
+            self.run_main('--profile', self.path('profile.json'))
+            with open(self.path('profile.json')) as ifp:
+                profile = json.load(ifp)
+            span, = [_ for _ in profile['spans'] if _['name'] == 'report']
+            # only the positive-test-rate figures were rendered again
+            self.assertEqual(span['attrs'], {'figures': 4, 'rendered': 2})
+            incremental = self.read_figures()
+            self.assertNotEqual(incremental, html)
+
+            # same as rendering everything
+            shutil.rmtree(plot_data.FRAGMENT_DIR)
+            os.unlink(plot_data.CHECK_SUM_FILE)
+            self.run_main()
+            self.assertEqual(self.read_figures(), incremental)
+        finally:
+            shutil.copy(self.path('oh.csv'), csv_path)
+            download.mark_downloaded(data._covidtracking_url('oh'), csv_path)
+
+    def test_top(self):
+        plot_data.load_tensor.cache_clear()
+        plot_data.main(['plot_data.py', '--top', '3', '--windows=7',
+                        '--metrics=cases100k,deaths', '-o',
+                        self.path('top.html')])
+        with open(self.path('top.html')) as ifp:
+            html = ifp.read()
+        self.assertEqual(html.count('<div id="figure-'), 2)
+
+        with self.assertRaises(ValueError):
+            # CovidTracking has no counties to rank
+            plot_data.main(['plot_data.py', '--top', '3', '--windows=7',
+                            '--metrics=positive-test-rate'])
+        with self.assertRaises(ValueError):
+            self.run_main('--top', '3')
+
+    def test_selectors(self):
+        plot_data.load_location_index.cache_clear()
+        ohio = sorted(data.STATE_ABV_MAP).index('Ohio')
+        path = self.path('locations.txt')
+        with open(path, 'w') as ofp:
+            ofp.write('OH:*\nPA\n')
+        locations = plot_data.resolve_locations(
+            ['County {},OH'.format(ohio), '@' + path])
+        self.assertEqual([str(_) for _ in locations],
+                         ['USA,Ohio,County {}'.format(ohio + 56 * i)
+                          for i in range(2)] + ['USA,Pennsylvania'])
+        self.assertEqual(plot_data.update_locations(locations, 'tests100k'),
+                         [data.parse_location('OH'), data.parse_location('PA')])
+
+        plot_data.main(['plot_data.py', 'PA:*', '--windows=7',
+                        '--metrics=cases100k', '-o', self.path('pa.html')])
+        with open(self.path('pa.html')) as ifp:
+            html = ifp.read()
+        self.assertEqual(html.count('<div id="figure-'), 1)
+        self.assertIn('County 97', html)
+
+    def test_selector_file_changed(self):
+        path = self.path('changing.txt')
+        argv = ['plot_data.py', '@' + path, '--windows=7',
+                '--metrics=cases', '-o', self.path('changing.html')]
+        with open(path, 'w') as ofp:
+            ofp.write('PA\n')
+        plot_data.main(argv)
+        with open(self.path('changing.html')) as ifp:
+            self.assertIn('Pennsylvania', ifp.read())
+
+        # same arguments and data, other locations
+        with open(path, 'w') as ofp:
+            ofp.write('OH\n')
+        plot_data.main(argv)
+        with open(self.path('changing.html')) as ifp:
+            html = ifp.read()
+        self.assertIn('Ohio', html)
+        self.assertNotIn('Pennsylvania', html)
+
+    def test_fragment_key(self):
+        df = location_df(n_days=50)
+        key = plot_data.fragment_key(df, 'cases', 7)
+        self.assertEqual(plot_data.fragment_key(df.copy(), 'cases', 7), key)
+        self.assertNotEqual(plot_data.fragment_key(df, 'cases', 7, 20), key)
+        changed = df.copy()
+        changed.loc[40, 'cases_7day-avg'] += 1
+        self.assertNotEqual(plot_data.fragment_key(changed, 'cases', 7), key)
+        # columns which aren't plotted don't matter
+        self.assertEqual(plot_data.fragment_key(
+            df.assign(cases=1.), 'cases', 7), key)
+
+
+_HEAVY_MODULES = ('numpy', 'pandas', 'plotly', 'requests', 'pyarrow')
+
+_UNCHANGED_SCRIPT = """
+import json, os, sys, time
+import data, download, plot_data
+
+tmp_dir = sys.argv[1]
+data.DATA_DIR = os.path.join(tmp_dir, 'data')
+data.CENSUS_DIR = os.path.join(tmp_dir, 'census')
+plot_data.CHECK_SUM_FILE = os.path.join(tmp_dir, 'checksums')
+# fresh downloads, so they aren't fetched again
+for url, path in ((data.NYTIMES_URL,
+                   data._csv_path('nytimes', 'us-counties')),
+                  (data.CENSUS_URL, data._census_csv_path())):
+    os.makedirs(os.path.dirname(path))
+    with download.open_file(path, 'wt') as ofp:
+        ofp.write(url)
+    download.atomic_write_json(path + '.meta.json',
+                               {'url': url, 'checked': time.time()})
+
+argv = ['plot_data.py', 'Allegheny,PA', '--windows=7', '--metrics=cases',
+        '--start=2020-04-01', '-o', os.path.join(tmp_dir, 'out.html')]
+with open(plot_data.CHECK_SUM_FILE, 'w') as ofp:
+    ofp.write(plot_data.report_check_sums(
+        plot_data.parse_args(argv), [data.parse_location('Allegheny,PA')],
+        ['cases']))
+plot_data.main(argv)
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+class StartupTest(unittest.TestCase):
+    def run_python(self, *args):
+        out = subprocess.run([sys.executable] + list(args), check=True,
+                             stdout=subprocess.PIPE,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout
+
+    def assertNotHeavy(self, modules):
+        self.assertFalse([_ for _ in modules if _.split('.')[0] in _HEAVY_MODULES])
+
+    def test_import(self):
+        modules = json.loads(self.run_python(
+            '-c', 'import json, sys, plot_data; '
+                  'print(json.dumps(sorted(sys.modules)))'))
+        self.assertNotHeavy(modules)
+
+    def test_help(self):
+        self.assertIn(b'--windows', self.run_python('plot_data.py', '--help'))
+
+    def test_unchanged(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            modules = json.loads(self.run_python('-c', _UNCHANGED_SCRIPT,
+                                                 tmp_dir))
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, 'out.html')))
+        self.assertNotHeavy(modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.offline
+
+import report
+
+
+def make_figure(n_days=30, windows=(7,)):
+    rng = np.random.default_rng(0)
+    frames = []
+    for i, location in enumerate(('Allegheny, PA', 'Clark, OH', 'PA')):
+        # the locations start on different days
+        dates = pd.date_range('2020-03-01', periods=n_days - i)
+        frames.append(pd.DataFrame({
+            'date': dates,
+            'location': location,
+            'cases100k': rng.random(len(dates)) * 100,
+        }))
+    df = pd.concat(frames)
+    df.loc[df.index[:3], 'cases100k'] = np.nan
+    return px.line(df, x='date', y='cases100k', color='location',
+                   hover_name='location', title='cases100k')
+
+
+def figure_calls(html):
+    """(axis, figure) of every renderFigure in the report"""
+    axes = dict(re.findall(r'var (reportAxis\d+) = (.*?);</script>', html))
+    calls = re.findall(r'renderFigure\("[^"]+", (reportAxis\d+), '
+                       r'reportTemplate\d+, (.*?)\);</script>', html)
+    return [(json.loads(axes[axis]), json.loads(figure))
+            for axis, figure in calls]
+
+
+class ReportWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'report.html')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def read(self):
+        with open(self.path, 'r', encoding='utf8') as ifp:
+            return ifp.read()
+
+    def test_plotlyjs_once(self):
+        with report.ReportWriter(self.path) as out:
+            for _ in range(4):
+                out.add_figure(make_figure())
+        html = self.read()
+        bundle_start = plotly.offline.get_plotlyjs()[:200]
+        self.assertEqual(html.count(bundle_start), 1)
+        self.assertEqual(html.count('var reportTemplate'), 1)
+        self.assertEqual(html.count('var reportAxis'), 1)
+        self.assertEqual(html.count('<div id="figure-'), 4)
+
+        # four figures weigh about what one fig.to_html does
+        single = len(make_figure().to_html(full_html=False))
+        self.assertLess(len(html), single * 1.1)
+
+    def test_directory(self):
+        with report.ReportWriter(self.path, plotlyjs='directory') as out:
+            out.add_figure(make_figure())
+        html = self.read()
+        self.assertIn('<script src="plotly.min.js">', html)
+        self.assertLess(len(html), 100000)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp_dir.name, report.PLOTLYJS_FILE)))
+
+    def test_round_trip(self):
+        fig = make_figure()
+        with report.ReportWriter(self.path, plotlyjs='directory') as out:
+            out.add_figure(fig)
+        (axis, figure), = figure_calls(self.read())
+
+        self.assertEqual(len(figure['data']), len(fig.data))
+        for trace, expected in zip(figure['data'], fig.data):
+            self.assertEqual(trace['hovertext'], expected.hovertext[0])
+            x = axis[trace['x0']:trace['x0'] + len(trace['y'])]
+            np.testing.assert_array_equal(pd.to_datetime(x).values,
+                                          expected.x)
+            y = np.array(trace['y'], dtype=float)
+            np.testing.assert_allclose(y, expected.y, rtol=1e-5)
+        self.assertEqual(figure['layout']['title']['text'], 'cases100k')
+
+    def test_round_values(self):
+        self.assertEqual(report.round_values(
+            np.array([12.345678912, 0.000123456789, 1234567.8, np.nan, 0.])),
+            [12.3457, 0.000123457, 1234570., None, 0.])
+        self.assertEqual(report.round_values(np.array([1., 2., 30.])),
+                         [1, 2, 30])
+
+    def test_discarded(self):
+        with self.assertRaises(RuntimeError):
+            with report.ReportWriter(self.path) as out:
+                out.add_figure(make_figure())
+                raise RuntimeError()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+import data
+import download
+import server
+import synthetic
+
+
+class ServerTest(unittest.TestCase):
+    """server against a synthetic dataset"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.prev = data.DATA_DIR, data.CENSUS_DIR
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            cls.tmp_dir.name, n_counties=120, n_days=60)
+        cls.county = 'County {},OH'.format(
+            sorted(data.STATE_ABV_MAP).index('Ohio'))
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        data.DATA_DIR, data.CENSUS_DIR = cls.prev
+        cls.tmp_dir.cleanup()
+
+    def setUp(self) -> None:
+        self.store = server.DatasetStore()
+        self.httpd = server.make_server(self.store, port=0)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+        self.base = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def tearDown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        self.store.stop()
+
+    def get(self, path, **params):
+        return requests.get(self.base + path, params=params)
+
+    def test_data(self):
+        response = self.get('/data', locations=self.county + ';PA',
+                            metric='cases100k', window=7)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['column'], 'cases100k_7day-avg')
+        self.assertEqual(len(result['series']), 2)
+        for series in result['series']:
+            self.assertEqual(len(series['dates']), 60)
+            self.assertEqual(len(series['values']), 60)
+            # the average needs 7 days
+            self.assertEqual(series['values'][:6], [None] * 6)
+            self.assertIsNotNone(series['values'][6])
+
+        # county locations are their state for CovidTracking metrics
+        response = self.get('/data', locations=self.county + ';OH',
+                            metric='positive-test-rate', window=1,
+                            start='2020-02-01')
+        series, = response.json()['series']
+        self.assertEqual(series['location'], 'Ohio USA')
+        self.assertEqual(series['dates'][0], '2020-02-01')
+
+    def test_figure(self):
+        response = self.get('/figure', locations=self.county + ';PA',
+                            metric='deaths100k', window=14, max_points=20)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<script src="/plotly.min.js">', response.text)
+        self.assertEqual(response.text.count('renderFigure("figure-0"'), 1)
+
+    def test_errors(self):
+        self.assertEqual(self.get('/data', locations='PA',
+                                  metric='unknown').status_code, 400)
+        self.assertEqual(self.get('/data', metric='cases').status_code, 400)
+        self.assertEqual(self.get('/data', locations='Nowhere,PA',
+                                  metric='cases').status_code, 400)
+        self.assertEqual(self.get('/data', locations='@/etc/passwd',
+                                  metric='cases').status_code, 400)
+        self.assertEqual(self.get('/nothing').status_code, 404)
+
+    def test_missing_population(self):
+        # in the NYTimes data but not in the census
+        loc = data.parse_location(self.county)
+        census = self.store.snapshot.counties.census_data
+        del census._county_count[(loc.state, loc.county)]
+        response = self.get('/data', locations=self.county,
+                            metric='cases100k')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('census', response.text)
+
+    def test_internal_error(self):
+        # a bug, not missing data
+        with mock.patch('server.data_json', side_effect=KeyError('bug')):
+            response = self.get('/data', locations='PA', metric='cases')
+        self.assertEqual(response.status_code, 500)
+
+    def test_selectors(self):
+        result = self.get('/data', locations='OH:*;' + self.county,
+                          metric='cases').json()
+        self.assertEqual(len(result['series']), 2)
+        self.assertEqual(self.get('/status').json()['counties'], 120)
+
+    def test_refresh(self):
+        before = self.get('/data', locations='PA', metric='cases').json()
+        self.assertFalse(self.store.refresh())
+
+        # new nytimes data, downloaded under the running server
+        csv_path = data._csv_path('nytimes', 'us-counties')
+        synthetic.write_nytimes_csv(csv_path, 120, 60, seed=1)
+        download.mark_downloaded(data.NYTIMES_URL, csv_path)
+        try:
+            self.assertTrue(self.store.refresh())
+            status = self.get('/status').json()
+            self.assertEqual(status['refreshes'], 1)
+            after = self.get('/data', locations='PA', metric='cases').json()
+            self.assertNotEqual(before, after)
+        finally:
+            synthetic.write_nytimes_csv(csv_path, 120, 60)
+            download.mark_downloaded(data.NYTIMES_URL, csv_path)
+
+    def test_requests_during_reload(self):
+        loading = threading.Event()
+        release = threading.Event()
+        snapshot = server.Snapshot
+
+        def slow_snapshot(*args, **kwargs):
+            loading.set()
+            release.wait(10)
+            return snapshot(*args, **kwargs)
+
+        with mock.patch('server.Snapshot', slow_snapshot):
+            reload = threading.Thread(target=self.store.refresh,
+                                      kwargs={'force': True})
+            reload.start()
+            try:
+                self.assertTrue(loading.wait(10))
+                # answered from the loaded snapshot while the reload waits
+                response = requests.get(
+                    self.base + '/data', timeout=5,
+                    params={'locations': 'PA', 'metric': 'cases'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.get('/status').json()['refreshes'], 0)
+            finally:
+                release.set()
+                reload.join()
+        self.assertEqual(self.get('/status').json()['refreshes'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
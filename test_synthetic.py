@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+import data
+import synthetic
+
+
+class SyntheticDatasetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.prev_dirs = data.DATA_DIR, data.CENSUS_DIR
+        data.DATA_DIR, data.CENSUS_DIR = synthetic.write_dataset(
+            cls.tmp_dir.name, n_counties=120, n_days=30)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        data.DATA_DIR, data.CENSUS_DIR = cls.prev_dirs
+        cls.tmp_dir.cleanup()
+
+    def test_nytimes(self):
+        nytimes = data.NyTimesData()
+        df = nytimes.get_df()
+        self.assertEqual(len(df), 30)
+        self.assertTrue((df.cases >= 0).all())
+
+        county = (nytimes.get_state_data('Ohio')
+                  .get_county_data('County {}'.format(
+                      sorted(data.STATE_ABV_MAP).index('Ohio'))))
+        self.assertEqual(len(county.get_df()), 30)
+
+    def test_covidtracking(self):
+        covid = data.CovidTrackingData()
+        pa = covid.get_state_data('PA').get_df()
+        self.assertEqual(len(pa), 30)
+        self.assertTrue(pa.date.is_monotonic_increasing)
+        self.assertEqual(set(pa.state), {'Pennsylvania'})
+
+        usa = covid.get_df()
+        total = sum(covid.get_state_data(_).get_df().cases.sum()
+                    for _ in data.ABV_STATE_MAP)
+        self.assertEqual(usa.cases.sum(), total)
+
+    def test_census(self):
+        census = data.CensusData()
+        self.assertEqual(len(census.df), 120)
+        ohio = data.Location('USA', 'Ohio', None)
+        self.assertGreater(census.get_population(ohio), 0)
+        county = data.Location('USA', 'Ohio', 'County {}'.format(
+            sorted(data.STATE_ABV_MAP).index('Ohio')))
+        self.assertGreater(census.get_population(county), 0)
+
+    def test_fresh(self):
+        path = data._csv_path('nytimes', 'us-counties')
+        meta = data.download.read_meta(path)
+        self.assertEqual(meta['url'], data.NYTIMES_URL)
+        self.assertEqual(data._dl_nytimes_csv(), path)
+        self.assertTrue(os.path.exists(data._census_csv_path()))
+
+
+if __name__ == '__main__':
+    unittest.main()